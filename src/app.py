@@ -9,7 +9,7 @@ from bean.beans import inject
 from instance import Instance
 from internal import InternalEventProcessor
 from request import HttpRequest, HttpException, Response
-from utils import loghelper
+from utils import loghelper, deadline
 from web import WebRequestProcessor, init_lambda
 
 logger = loghelper.get_logger(__name__)
@@ -45,20 +45,42 @@ def __dispatch_web_request(event: dict, context: Any, instance: Instance, web_ro
 
 
 @inject(bean_instances=(BeanName.INSTANCE, BeanName.INTERNAL_ROUTER))
-def __process_internal_event(event: dict, instance: Instance, router: InternalEventProcessor):
+def __process_internal_event(event: dict, context: Any, instance: Instance, router: InternalEventProcessor):
+    if not instance.has_function_arn() and context is not None:
+        instance.set_function_arn(context.invoked_function_arn)
     return router.process(instance, event)
 
 
+@inject(bean_instances=BeanName.INSTANCE)
+def __warm_up(instance: Instance):
+    instance.warm_up()
+
+
+@inject(bean_instances=BeanName.INSTANCE)
+def __log_retry_metrics(instance: Instance):
+    instance.log_retry_metrics()
+
+
+# The init phase runs with boosted CPU and is not billed to a request, so we get push notifications ready here
+if os.environ.get('AWS_LAMBDA_FUNCTION_NAME') is not None:
+    __warm_up()
+
+
 def handler(event: dict, context: Any):
     def wrapper():
+        deadline.start_invocation(context)
         logger.info(f'Received event:\n {json.dumps(event, indent=True)}')
 
         internal_event = event.get('internalEvent')
         if internal_event is not None:
-            return __process_internal_event(event)
+            return __process_internal_event(event, context)
         return __dispatch_web_request(event, context)
 
-    r = wrapper()
+    try:
+        r = wrapper()
+    finally:
+        # Once per invocation, so the counts line up with the invocation that made the retries
+        __log_retry_metrics()
     if r is not None:
         if isinstance(r, Response):
             r = r.to_dict()
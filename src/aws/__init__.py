@@ -14,6 +14,27 @@ def is_conflict_exception(source: Exception) -> bool:
     return is_exception(source, 409, "ConflictException")
 
 
+def is_throttling_exception(source: Exception) -> bool:
+    return is_exception(source, 400, "ThrottlingException")
+
+
+def is_internal_server_exception(source: Exception) -> bool:
+    return is_exception(source, 500, "InternalServerException")
+
+
+def is_service_unavailable_exception(source: Exception) -> bool:
+    return is_exception(source, 503, "ServiceUnavailableException")
+
+
+def is_transient_exception(source: Exception) -> bool:
+    """
+    Checks for errors that are worth retrying.
+    """
+    return is_throttling_exception(source) or \
+        is_internal_server_exception(source) or \
+        is_service_unavailable_exception(source)
+
+
 def is_exception(source: Exception, status: int, code: str):
     if hasattr(source, "response"):
         response = getattr(source, "response")
@@ -2,6 +2,7 @@ import abc
 import json
 import threading
 import time
+import uuid
 from typing import Any, Callable, Tuple, Union, Optional, List, Mapping, Dict, Collection, Iterable
 
 from aws import is_not_found_exception, is_exception
@@ -58,12 +59,39 @@ class DynamoDbValidationException(Exception):
         super(DynamoDbValidationException, self).__init__(message)
 
 
+class UnprocessedItemsException(Exception):
+    def __init__(self, operation: str, count: int):
+        super(UnprocessedItemsException, self).__init__(f"{operation} left {count} item(s) unprocessed.")
+        self.count = count
+
+
+# Maximum number of items DynamoDB allows in a single TransactWriteItems call
+MAX_TRANSACTION_ITEMS = 100
+
+# Maximum number of items DynamoDB allows in a single BatchWriteItem call
+MAX_BATCH_WRITE_ITEMS = 25
+
+# Maximum number of keys in a single BatchGetItem call
+MAX_BATCH_GET_ITEMS = 100
+
+# Maximum number of calls made for one batch, to work through unprocessed items
+_MAX_BATCH_ATTEMPTS = 6
+
+
 class CancelReason:
     def __init__(self, node: dict):
         self.code = node['Code']
         if self.code == 'None':
             self.code = None
         self.message = node.get('Message')
+        # The request that caused this reason, set by DynamoDb.transact_write()
+        self.request: Optional['TransactionRequest'] = None
+
+    def is_conflict(self) -> bool:
+        return self.code == 'TransactionConflict'
+
+    def is_condition_failure(self) -> bool:
+        return self.code == 'ConditionalCheckFailed'
 
 
 class TransactionCancelledException(Exception):
@@ -71,6 +99,30 @@ class TransactionCancelledException(Exception):
         super(TransactionCancelledException, self).__init__("TransactionCancelled")
         self.reasons = list(map(CancelReason, nodes))
 
+    def bind_requests(self, requests: List['TransactionRequest']):
+        """
+        Associates each cancellation reason with the request at the same position in the transaction.
+
+        :param requests: the requests that were sent, in order.
+        """
+        for reason, request in zip(self.reasons, requests):
+            reason.request = request
+
+    def get_failed_reasons(self) -> List[CancelReason]:
+        return list(filter(lambda r: r.code is not None, self.reasons))
+
+    def get_failed_requests(self) -> List['TransactionRequest']:
+        """
+        :return: the requests that caused the transaction to be cancelled.
+        """
+        return list(map(lambda r: r.request, self.get_failed_reasons()))
+
+    def get_conflicted_requests(self) -> List['TransactionRequest']:
+        """
+        :return: the requests that were cancelled because of a conflicting transaction, these can be retried.
+        """
+        return list(map(lambda r: r.request, filter(lambda r: r.is_conflict(), self.reasons)))
+
 
 def _from_ddb_item(item: dict) -> dict:
     def convert_value(value: dict):
@@ -237,6 +289,12 @@ class TransactionRequest(metaclass=abc.ABCMeta):
     def to_ddb_request(self) -> Dict[str, Any]:
         raise NotImplementedError()
 
+    def to_batch_request(self) -> Optional[Dict[str, Any]]:
+        """
+        :return: the request in BatchWriteItem format, or None if the request cannot be sent in a batch.
+        """
+        return None
+
 
 class PutItemRequest(TransactionRequest):
     def __init__(self,
@@ -270,6 +328,11 @@ class PutItemRequest(TransactionRequest):
 
         return {'Put': params}
 
+    def to_batch_request(self) -> Optional[Dict[str, Any]]:
+        if self.condition is not None or (self.key_attributes is not None and len(self.key_attributes) > 0):
+            return None
+        return {'PutRequest': {'Item': _to_ddb_item(self.item)}}
+
 
 class UpdateItemRequest(TransactionRequest):
     def __init__(self,
@@ -344,6 +407,11 @@ class DeleteItemRequest(TransactionRequest):
             _process_condition(self.condition, params)
         return {'Delete': params}
 
+    def to_batch_request(self) -> Optional[Dict[str, Any]]:
+        if self.condition is not None:
+            return None
+        return {'DeleteRequest': {'Key': _to_ddb_item(self.keys)}}
+
 
 class DynamoDb:
     def __init__(self, client):
@@ -437,7 +505,6 @@ class DynamoDb:
     def delete_items(self, table_name: str,
                      keys: List[Dict[str, Any]]):
         items = []
-        req = {table_name: items}
         for key in keys:
             item = {
                 'DeleteRequest': {
@@ -445,7 +512,145 @@ class DynamoDb:
                 }
             }
             items.append(item)
-        self._execute_and_wrap(lambda: self.__client.batch_write_item(RequestItems=req))
+        self._batch_write(table_name, items)
+
+    def batch_write(self, requests: List[Union['PutItemRequest', 'DeleteItemRequest']]):
+        """
+        Writes the given requests using BatchWriteItem.  The requests cannot have conditions.
+        """
+        by_table: Dict[str, List[Dict[str, Any]]] = {}
+        for request in requests:
+            batch_request = request.to_batch_request()
+            if batch_request is None:
+                raise DynamoDbValidationException("Conditional requests cannot be sent in a batch.")
+            by_table.setdefault(request.table_name, []).append(batch_request)
+        for table_name, items in by_table.items():
+            self._batch_write(table_name, items)
+
+    def _batch_write(self, table_name: str, items: List[Dict[str, Any]]):
+        """
+        Sends the given write requests in batches, retrying any unprocessed items.
+        """
+        for offset in range(0, len(items), MAX_BATCH_WRITE_ITEMS):
+            req = {table_name: items[offset:offset + MAX_BATCH_WRITE_ITEMS:]}
+            attempt = 0
+            while len(req) > 0:
+                if attempt == _MAX_BATCH_ATTEMPTS:
+                    raise UnprocessedItemsException("BatchWriteItem", len(req[table_name]))
+                if attempt > 0:
+                    time.sleep(min(0.05 * (2 ** attempt), 1.0))
+                resp = self._execute_and_wrap(lambda: self.__client.batch_write_item(RequestItems=req))
+                req = resp.get('UnprocessedItems') or {}
+                attempt += 1
+
+    def batch_get_items(self, table_name: str,
+                        keys: List[Dict[str, Any]],
+                        consistent: bool = False) -> List[dict]:
+        """
+        Reads the items for the given keys in batches, retrying any unprocessed keys.
+
+        :param table_name: the table name.
+        :param keys: the keys of the items to read.
+        :param consistent: True for consistent reads.
+        :return: the items that were found, in no particular order.
+        """
+        items = []
+        for offset in range(0, len(keys), MAX_BATCH_GET_ITEMS):
+            request = {'Keys': list(map(_to_ddb_item, keys[offset:offset + MAX_BATCH_GET_ITEMS:]))}
+            if consistent:
+                request['ConsistentRead'] = True
+            req = {table_name: request}
+            attempt = 0
+            while len(req) > 0:
+                if attempt == _MAX_BATCH_ATTEMPTS:
+                    raise UnprocessedItemsException("BatchGetItem", len(req[table_name]['Keys']))
+                if attempt > 0:
+                    time.sleep(min(0.05 * (2 ** attempt), 1.0))
+                resp = self._execute_and_wrap(lambda: self.__client.batch_get_item(RequestItems=req))
+                items.extend(map(_from_ddb_item, resp.get('Responses', {}).get(table_name, [])))
+                req = resp.get('UnprocessedKeys') or {}
+                attempt += 1
+        return items
+
+    def query(self, table_name: str,
+              key_condition: Tuple[str, dict],
+              index_name: Optional[str] = None,
+              consistent: bool = False,
+              page_size: Optional[int] = None) -> Iterable[dict]:
+        """
+        Queries the given table or index, following the pages as the results are consumed.
+
+        :param table_name: the table name.
+        :param key_condition: the key condition expression and its bind values.
+        :param index_name: optional secondary index to query.
+        :param consistent: True for a consistent read (not allowed on global secondary indexes).
+        :param page_size: optional maximum number of items to evaluate per call.
+        :return: the items.
+        """
+        params = {"TableName": table_name,
+                  "KeyConditionExpression": key_condition[0],
+                  "ExpressionAttributeValues": _to_ddb_item(key_condition[1])}
+        if index_name is not None:
+            params['IndexName'] = index_name
+        if consistent:
+            params['ConsistentRead'] = True
+        if page_size is not None:
+            params['Limit'] = page_size
+
+        while True:
+            resp = self._execute_and_wrap(lambda: self.__client.query(**params))
+            for item in resp.get('Items', []):
+                yield _from_ddb_item(item)
+            last_key = resp.get('LastEvaluatedKey')
+            if last_key is None:
+                break
+            params['ExclusiveStartKey'] = last_key
+
+    def scan(self, table_name: str,
+             page_size: Optional[int] = None,
+             filter_expression: Optional[Tuple[str, dict]] = None) -> Iterable[List[dict]]:
+        """
+        Scans the given table, one page at a time.
+
+        :param table_name: the table name.
+        :param page_size: optional maximum number of items to evaluate per call.
+        :param filter_expression: optional filter expression and its bind values, applied after the page is read.
+        :return: the pages of items, pages where nothing passed the filter are skipped.
+        """
+        start_key = None
+        while True:
+            items, start_key = self.scan_page(table_name, page_size, start_key, filter_expression)
+            if len(items) > 0:
+                yield items
+            if start_key is None:
+                break
+
+    def scan_page(self, table_name: str,
+                  page_size: Optional[int] = None,
+                  start_key: Optional[dict] = None,
+                  filter_expression: Optional[Tuple[str, dict]] = None) -> Tuple[List[dict], Optional[dict]]:
+        """
+        Reads a single page of a scan.
+
+        :param table_name: the table name.
+        :param page_size: optional maximum number of items to evaluate.
+        :param start_key: the key to resume after, as returned by the previous page, None to start at the beginning.
+        :param filter_expression: optional filter expression and its bind values, applied after the page is read.
+        :return: the items that passed the filter, and the key to resume after or None if this was the last page.
+        """
+        params = {"TableName": table_name}
+        if page_size is not None:
+            params['Limit'] = page_size
+        if start_key is not None:
+            params['ExclusiveStartKey'] = _to_ddb_item(start_key)
+        if filter_expression is not None:
+            params['FilterExpression'] = filter_expression[0]
+            if len(filter_expression[1]) > 0:
+                params['ExpressionAttributeValues'] = _to_ddb_item(filter_expression[1])
+        resp = self._execute_and_wrap(lambda: self.__client.scan(**params))
+        last_key = resp.get('LastEvaluatedKey')
+        return list(map(_from_ddb_item, resp.get('Items', []))), \
+            _from_ddb_item(last_key) if last_key is not None else None
 
     def update_item(self, table_name: str,
                     keys: dict,
@@ -483,6 +688,29 @@ class DynamoDb:
         resp = self._execute_and_wrap(lambda: self.__client.update_item(**params))
         return resp
 
-    def transact_write(self, items: List[TransactionRequest]):
+    def transact_write(self, items: List[TransactionRequest], client_request_token: Optional[str] = None):
+        """
+        Writes the given items in a single transaction.
+
+        A client request token is generated if one is not given, and it is reused when retrying after throttling,
+        so the retries are idempotent.  If the transaction is cancelled, each reason in the raised
+        TransactionCancelledException refers back to the request that caused it.
+
+        :param items: the requests to write, at most MAX_TRANSACTION_ITEMS.
+        :param client_request_token: optional idempotency token.
+        """
+        if len(items) == 0:
+            raise DynamoDbValidationException("At least one item is required for a transaction.")
+        if len(items) > MAX_TRANSACTION_ITEMS:
+            raise DynamoDbValidationException(f"Too many items for a transaction: {len(items)}, "
+                                              f"maximum is {MAX_TRANSACTION_ITEMS}.")
+        if client_request_token is None:
+            client_request_token = str(uuid.uuid4())
         item_list = list(map(lambda item: item.to_ddb_request(), items))
-        return self._execute_and_wrap(lambda: self.__client.transact_write_items(TransactItems=item_list))
+        try:
+            return self._execute_and_wrap(lambda: self.__client.transact_write_items(
+                TransactItems=item_list,
+                ClientRequestToken=client_request_token))
+        except TransactionCancelledException as ex:
+            ex.bind_requests(items)
+            raise ex
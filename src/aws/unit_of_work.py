@@ -0,0 +1,125 @@
+from copy import deepcopy
+from typing import Dict, Any, Optional, Tuple, List, Union, Collection
+
+from aws.dynamodb import DynamoDb, TransactionRequest, PutItemRequest, UpdateItemRequest, DeleteItemRequest, \
+    PreconditionFailedException, PrimaryKeyViolationException, TransactionCancelledException
+
+_ItemKey = Tuple[str, Tuple[Tuple[str, Any], ...]]
+
+_NOT_FOUND = object()
+
+
+def _to_item_key(table_name: str, keys: dict) -> _ItemKey:
+    return table_name, tuple(sorted(keys.items()))
+
+
+class DynamoDbUnitOfWork:
+    """
+    Collects the reads and writes for a single unit of work.
+
+    Repeated reads of the same item are served from the first read, and writes are buffered until commit() is
+    called, at which point they are sent with the fewest calls possible.  A single write is sent as-is, several
+    unconditional writes are sent with BatchWriteItem, anything else is sent with TransactWriteItems.
+    """
+
+    def __init__(self, ddb: DynamoDb):
+        self.__ddb = ddb
+        self.__reads: Dict[_ItemKey, Any] = {}
+        self.__writes: Dict[_ItemKey, TransactionRequest] = {}
+        self.failed_requests: List[TransactionRequest] = []
+
+    def find_item(self, table_name: str, keys: dict) -> Optional[dict]:
+        item_key = _to_item_key(table_name, keys)
+        pending = self.__writes.get(item_key)
+        if isinstance(pending, PutItemRequest):
+            return deepcopy(pending.item)
+        if isinstance(pending, DeleteItemRequest):
+            return None
+
+        item = self.__reads.get(item_key, _NOT_FOUND)
+        if item is _NOT_FOUND:
+            item = self.__ddb.find_item(table_name, keys, consistent=True)
+            self.__reads[item_key] = item
+        if item is None:
+            return None
+        item = deepcopy(item)
+        if isinstance(pending, UpdateItemRequest):
+            item.update(pending.item)
+        return item
+
+    def put_item(self, table_name: str,
+                 keys: dict,
+                 item: dict,
+                 key_attributes: Optional[Collection[str]] = None,
+                 condition: Union[dict, Tuple[str, dict]] = None):
+        self.__add(keys, PutItemRequest(table_name, item,
+                                        list(key_attributes) if key_attributes is not None else None,
+                                        condition))
+
+    def update_item(self, table_name: str,
+                    keys: dict,
+                    item: dict,
+                    condition: Union[dict, Tuple[str, dict]] = None):
+        self.__add(keys, UpdateItemRequest(table_name, keys, item, condition))
+
+    def delete_item(self, table_name: str,
+                    keys: dict,
+                    condition: Union[dict, Tuple[str, dict]] = None):
+        item_key = _to_item_key(table_name, keys)
+        pending = self.__writes.get(item_key)
+        if isinstance(pending, PutItemRequest) and pending.key_attributes:
+            # Deleting an item we are creating, so there is nothing to write
+            self.__writes.pop(item_key)
+            return
+        self.__add(keys, DeleteItemRequest(table_name, keys, condition))
+
+    def __add(self, keys: dict, request: Union[PutItemRequest, UpdateItemRequest, DeleteItemRequest]):
+        item_key = _to_item_key(request.table_name, keys)
+        if item_key in self.__writes:
+            raise ValueError(f"Item {item_key} is already being written in this unit of work.")
+        self.__writes[item_key] = request
+
+    def has_writes(self) -> bool:
+        return len(self.__writes) > 0
+
+    def discard(self):
+        self.__writes.clear()
+        self.__reads.clear()
+
+    def commit(self) -> bool:
+        """
+        Sends the buffered writes.
+
+        :return: False if the writes were rejected because a condition failed, the failed requests are available
+        in failed_requests.
+        """
+        requests = list(self.__writes.values())
+        self.discard()
+        self.failed_requests = []
+        if len(requests) == 0:
+            return True
+        try:
+            if len(requests) == 1:
+                self.__write_one(requests[0])
+            elif all(map(lambda r: r.to_batch_request() is not None, requests)):
+                self.__ddb.batch_write(requests)
+            else:
+                self.__ddb.transact_write(requests)
+        except (PreconditionFailedException, PrimaryKeyViolationException):
+            self.failed_requests = requests
+            return False
+        except TransactionCancelledException as ex:
+            self.failed_requests = ex.get_failed_requests()
+            if len(ex.get_conflicted_requests()) > 0:
+                raise ex
+            return False
+        return True
+
+    def __write_one(self, request: TransactionRequest):
+        if isinstance(request, PutItemRequest):
+            self.__ddb.put_item(request.table_name, request.item, request.key_attributes, request.condition)
+        elif isinstance(request, UpdateItemRequest):
+            self.__ddb.update_item(request.table_name, request.keys, request.item, request.condition)
+        else:
+            assert isinstance(request, DeleteItemRequest)
+            self.__ddb.delete_item(request.table_name, request.keys, request.condition)
@@ -20,6 +20,7 @@ class BeanName(Enum):
     NOTIFIER = 13
     SNS_CLIENT = 14
     GCP_CERT_BUILDER = 15
+    EVENT_DISPATCHER = 16
 
 
 class Bean(metaclass=abc.ABCMeta):
@@ -105,6 +105,7 @@ __BEANS: Dict[BeanName, _BeanImpl] = {
     BeanName.PUSH_NOTIFIER: _BeanImpl(_LazyLoader('push_notifier')),
     BeanName.NOTIFIER: _BeanImpl(_LazyLoader('notifier')),
     BeanName.SNS_CLIENT: _BeanImpl(_Boto3Loader('sns')),
+    BeanName.EVENT_DISPATCHER: _BeanImpl(_LazyLoader('event_dispatcher', tag_as_lazy=False)),
 
 }
 
@@ -0,0 +1,4 @@
+def init():
+    # Imported here since app imports the beans, by the time this is loaded it is already initialized
+    import app
+    return app.handler
@@ -1,8 +1,21 @@
+import os
+
 from bean import BeanName, Bean
 from bean.beans import inject
-from push_notifier.gcp_notifier import GcpPushNotifier
+from utils.http_client import HttpClient
+
+# Seconds to wait for FCM to connect, and for each read
+_HTTP_TIMEOUT_SECONDS = 10
 
 
 @inject(beans=(BeanName.GCP_CREDS, BeanName.FIREBASE_ADMIN, BeanName.GCP_CERT_BUILDER))
 def init(gcp_creds_bean: Bean, firebase_admin_bean: Bean, cert_builder_bean: Bean):
+    # Imported here, so the transport we do not use is never loaded, firebase_admin takes a while to import
+    if os.environ.get('SS_KEEPALIVE_PUSH_TRANSPORT', 'firebase') == 'http':
+        from push_notifier.fcm_http_notifier import FcmHttpPushNotifier, DEFAULT_FCM_URL
+        return FcmHttpPushNotifier(gcp_creds_bean,
+                                   HttpClient(_HTTP_TIMEOUT_SECONDS),
+                                   os.environ.get('SS_KEEPALIVE_FCM_URL', DEFAULT_FCM_URL))
+
+    from push_notifier.gcp_notifier import GcpPushNotifier
     return GcpPushNotifier(gcp_creds_bean, firebase_admin_bean, cert_builder_bean)
@@ -1,13 +1,33 @@
 import os
-from typing import Any
 
-from bean import BeanName
+from bean import BeanName, Bean
 from bean.beans import inject
 from scheduler.aws_scheduler import AwsScheduler
+from scheduler.bucket_scheduler import BucketScheduler
+from scheduler.local_scheduler import LocalScheduler
+from scheduler.spread_policy import SpreadPolicy
+from scheduler.wheel_scheduler import WheelScheduler
 
 
-@inject(bean_instances=BeanName.SCHEDULER_CLIENT)
-def init(client: Any):
+@inject(beans=(BeanName.SCHEDULER_CLIENT, BeanName.DYNAMODB, BeanName.EVENT_DISPATCHER))
+def init(client_bean: Bean, ddb_bean: Bean, dispatcher_bean: Bean):
+    mode = os.environ.get('SS_KEEPALIVE_SCHEDULING_MODE', 'session')
+    if mode == 'local':
+        workers = int(os.environ.get('SS_KEEPALIVE_LOCAL_SCHEDULER_WORKERS', '4'))
+        return LocalScheduler(dispatcher_bean.get_instance(), workers)
+
+    client = client_bean.get_instance()
     group_name = os.environ.get('SS_KEEPALIVE_SCHEDULE_GROUP', 'default')
     role_arn = os.environ.get('SS_KEEPALIVE_SCHEDULE_GROUP_ROLE_ARN', 'bad')
-    return AwsScheduler(client, group_name, role_arn)
+    shard_count = int(os.environ.get('SS_KEEPALIVE_SCHEDULE_GROUP_SHARDS', '1'))
+    # Where the schedules made before the shard count was last changed are
+    previous_shard_count = int(os.environ.get('SS_KEEPALIVE_SCHEDULE_GROUP_PREVIOUS_SHARDS', '1'))
+    if mode == 'bucket':
+        return BucketScheduler(client, group_name, role_arn, ddb_bean.get_instance(), shard_count,
+                               previous_shard_count)
+    if mode == 'wheel':
+        return WheelScheduler(client, group_name, role_arn, ddb_bean.get_instance(), shard_count,
+                              previous_shard_count)
+    spread_policy = SpreadPolicy.from_json(os.environ.get('SS_KEEPALIVE_SCHEDULE_SPREAD'))
+    return AwsScheduler(client, group_name, role_arn, spread_policy=spread_policy, shard_count=shard_count,
+                        previous_shard_count=previous_shard_count)
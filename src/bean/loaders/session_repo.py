@@ -1,10 +1,22 @@
-from typing import Any
+import os
 
-from bean import BeanName
+from bean import BeanName, Bean
 from bean.beans import inject
+from session_repo import COMPACT_FORMAT, PACKED_FORMAT
 from session_repo.aws_session_repo import AwsSessionRepo
+from session_repo.sqlite_session_repo import SqliteSessionRepo
 
+_STORAGE_FORMATS = {
+    'compact': COMPACT_FORMAT,
+    'packed': PACKED_FORMAT
+}
 
-@inject(bean_instances=BeanName.DYNAMODB_CLIENT)
-def init(client: Any):
-    return AwsSessionRepo(client)
\ No newline at end of file
+
+@inject(beans=BeanName.DYNAMODB_CLIENT)
+def init(client_bean: Bean):
+    repo_type = os.environ.get('SS_KEEPALIVE_SESSION_REPO', 'dynamodb')
+    if repo_type == 'sqlite':
+        return SqliteSessionRepo(os.environ.get('SS_KEEPALIVE_SQLITE_PATH', 'ss-keepalive.db'))
+
+    storage_format = os.environ.get('SS_KEEPALIVE_SESSION_FORMAT', 'compact')
+    return AwsSessionRepo(client_bean.get_instance(), _STORAGE_FORMATS[storage_format])
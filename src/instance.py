@@ -1,18 +1,107 @@
-from typing import Optional
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from typing import Optional, List, Collection, Iterable, Dict
 
 from notifier.notifier import Notifier
-from push_notifier import PushNotifier
+from push_notifier import PushNotifier, PushMessage, PushResult, PushErrorCode, TRANSIENT_ERROR_CODES, \
+    PERMANENT_ERROR_CODES
 from request import NotFoundException, GoneException
-from scheduler import Scheduler
+from scheduler import Scheduler, ScheduleResult, is_near_end
 from secrets_repo import SecretsRepo
-from session_repo import SessionRepo, Session
-from utils import exception_utils, loghelper
+from session_repo import SessionRepo, Session, UnitOfWork
+from utils import exception_utils, loghelper, deadline
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenException, OPEN
+from utils.date_utils import get_system_time_in_seconds, calc_expire_time_in_epoch_seconds
+from utils.page import Page
+from utils.ttl_cache import TtlCache
 
 logger = loghelper.get_logger(__name__)
 
 # 4 hours
 _TTL_SECONDS = 14400
 
+# Sessions have to be expired for at least this long before we purge them, so a racing extend is not lost
+_PURGE_GRACE_SECONDS = 300
+
+# Maximum number of concurrent scheduler calls when checking schedules in bulk
+_MAX_SCHEDULE_CHECK_WORKERS = 8
+
+# Maximum number of dry-run results we remember
+_TOKEN_CACHE_SIZE = 10000
+
+# How long we remember that a token passed the dry-run
+_VALID_TOKEN_TTL_SECONDS = 3600
+
+# How long we remember that a token failed the dry-run, shorter since a rejected token is usually retried soon
+_INVALID_TOKEN_TTL_SECONDS = 600
+
+# Number of sends in a row that have to fail because FCM is unavailable before we stop trying
+_PUSH_FAILURE_THRESHOLD = 5
+
+# How long we stop trying before we probe FCM again
+_PUSH_OPEN_SECONDS = 30
+
+# FCM rejects messages whose data, keys and values together, is larger than this
+_MAX_PUSH_DATA_BYTES = 4096
+
+_NOT_CACHED = object()
+
+
+def _hash_token(token: str) -> str:
+    # Tokens are credentials of sorts, so we do not keep them around
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _build_keepalive_record(session_id: str) -> Dict[str, str]:
+    return {
+        'type': 'keepalive',
+        'sessionId': session_id
+    }
+
+
+def _calc_data_size(data: Dict[str, str]) -> int:
+    return sum(map(lambda item: len(item[0].encode('utf-8')) + len(item[1].encode('utf-8')), data.items()))
+
+
+def _build_device_keepalive_record(session_ids: List[str]) -> Dict[str, str]:
+    record = _build_keepalive_record(session_ids[0])
+    if len(session_ids) > 1:
+        # Clients that do not know about sessionIds still keep the first session alive
+        # FCM data values have to be strings
+        record['sessionIds'] = ",".join(session_ids)
+    return record
+
+
+def _split_device_session_ids(session_ids: List[str]) -> List[List[str]]:
+    """
+    Splits the session ids of a device into as few keepalive pushes as fit in FCM's data limit.
+
+    :param session_ids: the session ids of the device.
+    :return: the session ids of each push.
+    """
+    chunks: List[List[str]] = []
+    chunk: List[str] = []
+    size = 0
+    for session_id in session_ids:
+        id_size = len(session_id.encode('utf-8'))
+        if len(chunk) == 0:
+            chunk = [session_id]
+            size = _calc_data_size(_build_device_keepalive_record(chunk))
+            chunks.append(chunk)
+            continue
+        # The id goes in sessionIds, after a comma, and sessionIds is added with the second id
+        added = id_size + 1 + (len("sessionIds") + len(chunk[0].encode('utf-8')) if len(chunk) == 1 else 0)
+        if size + added > _MAX_PUSH_DATA_BYTES:
+            chunk = [session_id]
+            size = _calc_data_size(_build_device_keepalive_record(chunk))
+            chunks.append(chunk)
+        else:
+            chunk.append(session_id)
+            size += added
+    return chunks
+
 
 class Instance:
     def __init__(self,
@@ -27,6 +116,10 @@ class Instance:
         self.__push_notifier = push_notifier
         self.__notifier = notifier
         self.__function_arn: Optional[str] = None
+        # Dry-run results by token hash, None for a valid token or the error message
+        self.__token_cache: TtlCache[str, Optional[str]] = TtlCache(_TOKEN_CACHE_SIZE, _VALID_TOKEN_TTL_SECONDS)
+        # Only FCM being unavailable counts against it, a rejected token means FCM is up
+        self.__push_breaker = CircuitBreaker("fcm", _PUSH_FAILURE_THRESHOLD, _PUSH_OPEN_SECONDS)
 
     def set_function_arn(self, arn: str):
         self.__function_arn = arn
@@ -34,6 +127,37 @@ class Instance:
     def has_function_arn(self):
         return self.__function_arn is not None
 
+    def warm_up(self) -> bool:
+        """
+        Gets push notifications ready ahead of the first one.
+
+        :return: True if it worked, a failure is only logged since the first push notification tries again.
+        """
+        try:
+            self.__push_notifier.warm_up()
+            return True
+        except Exception:
+            logger.error(f"Failed to warm up push notifications: {exception_utils.dump_ex()}")
+            return False
+
+    def log_retry_metrics(self) -> Dict[str, dict]:
+        """
+        Logs the retries made since the last time, as a single JSON line a metric filter can pick up.
+
+        :return: the retry counts that were logged, by component, empty if nothing was retried.
+        """
+        logged = {}
+        for name, metrics in (('scheduler', self.__scheduler.get_retry_metrics()),
+                              ('pushNotifier', self.__push_notifier.get_retry_metrics())):
+            if metrics is None:
+                continue
+            delta = metrics.take_delta()
+            if delta['retries'] > 0 or delta['exhausted'] > 0:
+                logged[name] = delta
+        if len(logged) > 0:
+            logger.info(f"Retry metrics: {json.dumps({'retryMetrics': logged})}")
+        return logged
+
     def test_push_notification(self, token: str) -> Optional[str]:
         """
         Attempt a push notification as a dry-run.
@@ -41,22 +165,137 @@ class Instance:
         :param token: the FCM device token.
         :return: None if the test passed, otherwise a string with the error message.
         """
+        token_hash = _hash_token(token)
+        cached = self.__token_cache.get(token_hash, _NOT_CACHED)
+        if cached is not _NOT_CACHED:
+            return cached
         record = {'type': 'keepalive-test'}
         try:
             self.__push_notifier.notify(token, record, dry_run=True)
         except Exception as ex:
-            return exception_utils.get_exception_message(ex)
+            message = exception_utils.get_exception_message(ex)
+            # Only errors that say the token itself is bad, anything else may not happen on the next try
+            if self.__push_notifier.classify_error(ex) in PERMANENT_ERROR_CODES:
+                self.__token_cache.put(token_hash, message, _INVALID_TOKEN_TTL_SECONDS)
+            return message
+        self.__token_cache.put(token_hash, None)
         return None
 
-    def send_push_notification(self, token: str, session_id: str):
-        record = {
-            'type': 'keepalive',
-            'sessionId': session_id
-        }
+    def is_push_suspended(self) -> bool:
+        """
+        :return: True while push notifications are skipped because FCM keeps failing.
+        """
+        return self.__push_breaker.get_state() == OPEN
+
+    def send_push_notification(self, token: str, session_id: str) -> PushResult:
+        """
+        Sends the keepalive push notification for a session.
+
+        :param token: the FCM device token.
+        :param session_id: the session id.
+        :return: the result, the session and its schedule are gone when its error code is a permanent one.
+        """
+        if not self.__push_breaker.allow_request():
+            logger.info(f"Push notifications are suspended, skipping session {session_id}.")
+            return PushResult(session_id, False, CircuitOpenException(self.__push_breaker.name),
+                              PushErrorCode.UNAVAILABLE)
         try:
-            self.__push_notifier.notify(token, record)
-        except Exception:
-            self.notify_error("Failed to send push notification", exception_utils.dump_ex())
+            self.__push_notifier.notify(token, _build_keepalive_record(session_id))
+            self.__record_push_outcome(True)
+            return PushResult(session_id, True)
+        except Exception as ex:
+            code = self.__push_notifier.classify_error(ex)
+            self.__record_push_outcome(code not in TRANSIENT_ERROR_CODES, exception_utils.get_exception_message(ex))
+            if code in PERMANENT_ERROR_CODES:
+                self.__drop_rejected_session(session_id, token, code, exception_utils.get_exception_message(ex))
+            elif code in TRANSIENT_ERROR_CODES:
+                # Outages are reported once by the circuit breaker
+                logger.info(f"Failed to send push notification for session {session_id}: "
+                            f"{exception_utils.dump_ex()}")
+            else:
+                self.notify_error("Failed to send push notification", exception_utils.dump_ex())
+            return PushResult(session_id, False, ex, code)
+
+    def send_push_notifications(self, sessions: Collection[Session], report_errors: bool = True) -> List[PushResult]:
+        """
+        Sends the keepalive push notifications for several sessions, in as few calls as possible.
+
+        :param sessions: the sessions.
+        :param report_errors: False to skip the error notification when pushes fail.
+        :return: the results, in the same order as the sessions.
+        """
+        sessions = list(sessions)
+        if len(sessions) == 0:
+            return []
+        if not self.__push_breaker.allow_request():
+            logger.info(f"Push notifications are suspended, skipping {len(sessions)} session(s).")
+            error = CircuitOpenException(self.__push_breaker.name)
+            return list(map(lambda s: PushResult(s.session_id, False, error, PushErrorCode.UNAVAILABLE), sessions))
+
+        # Sessions on the same device share as few pushes as fit their session ids
+        devices: Dict[str, List[str]] = {}
+        for session in sessions:
+            devices.setdefault(session.fcm_device_token, []).append(session.session_id)
+        messages: List[PushMessage] = []
+        message_session_ids: List[List[str]] = []
+        for token, session_ids in devices.items():
+            for chunk in _split_device_session_ids(session_ids):
+                messages.append(PushMessage(chunk[0], token, _build_device_keepalive_record(chunk)))
+                message_session_ids.append(chunk)
+        try:
+            message_results = self.__push_notifier.notify_many(messages)
+        except BaseException as ex:
+            # Whatever happened has to be recorded, this may have been the probe of a half-open circuit
+            self.__record_push_outcome(False, str(ex))
+            raise ex
+        session_results: Dict[str, PushResult] = {}
+        for session_ids, result in zip(message_session_ids, message_results):
+            for session_id in session_ids:
+                session_results[session_id] = result
+        results = []
+        for session in sessions:
+            result = session_results[session.session_id]
+            results.append(PushResult(session.session_id, result.success, result.error, result.error_code))
+        transient = list(filter(lambda r: r.error_code in TRANSIENT_ERROR_CODES, results))
+        # FCM is only considered down if nothing got through
+        self.__record_push_outcome(len(transient) < len(results),
+                                   str(transient[0].error) if len(transient) > 0 else None)
+        for session, result in zip(sessions, results):
+            if result.error_code in PERMANENT_ERROR_CODES:
+                self.__drop_rejected_session(session.session_id,
+                                             session.fcm_device_token,
+                                             result.error_code,
+                                             exception_utils.get_exception_message(result.error))
+        failed = list(filter(lambda r: not r.success and r.error_code not in PERMANENT_ERROR_CODES, results))
+        if len(failed) > 0 and len(transient) == len(results):
+            logger.info(f"Failed to send {len(failed)} push notification(s): {transient[0].error}")
+        elif len(failed) > 0:
+            details = "\n".join(map(lambda r: f"Session {r.session_id}: {r.error_code.value}: {r.error}", failed))
+            if report_errors:
+                self.notify_error(f"Failed to send {len(failed)} of {len(results)} push notification(s)", details)
+            else:
+                logger.info(f"Failed to send {len(failed)} of {len(results)} push notification(s):\n{details}")
+        return results
+
+    def __record_push_outcome(self, fcm_available: bool, error_message: Optional[str] = None):
+        if fcm_available:
+            skipped = self.__push_breaker.record_success()
+            if skipped > 0:
+                logger.info(f"Push notifications resumed, {skipped} send(s) were skipped during the outage.")
+        elif self.__push_breaker.record_failure():
+            self.notify_error("Push notifications suspended",
+                              f"Sending push notifications failed {_PUSH_FAILURE_THRESHOLD} times in a row, "
+                              f"the last error was: {error_message}\n"
+                              f"Sends are skipped until a probe every {_PUSH_OPEN_SECONDS} seconds succeeds.")
+
+    def __drop_rejected_session(self, session_id: str, token: str, code: PushErrorCode, message: str):
+        # FCM will never accept the token again, so the session is of no use and creating another one with the
+        # same token fails without asking FCM
+        logger.info(f"Push notification for session {session_id} was rejected with {code.value}, "
+                    f"deleting the session.")
+        self.__token_cache.put(_hash_token(token), message, _INVALID_TOKEN_TTL_SECONDS)
+        self.__session_repo.delete_session(session_id)
+        self.__scheduler.delete_schedule(session_id)
 
     def notify_error(self, subject: str, message: str) -> bool:
         logger.error(f"{subject}:\n{message}")
@@ -67,10 +306,32 @@ class Instance:
             logger.error(f"Failed to notify error: {exception_utils.dump_ex()}")
             return False
 
+    def begin_unit_of_work(self) -> UnitOfWork:
+        """
+        Starts a unit of work for the session repo, session reads are coalesced and writes are buffered until the
+        unit of work is committed.
+        """
+        return self.__session_repo.begin_unit_of_work()
+
     def create_session(self, session: Session) -> bool:
+        if session.expire_time is None:
+            session.expire_time = calc_expire_time_in_epoch_seconds(_TTL_SECONDS)
+        session.schedule_end_time = self.__scheduler.calc_end_time(session.expire_time)
         return self.__session_repo.create_session(session, _TTL_SECONDS)
 
     def extend_session(self, session: Session):
+        expire_time = calc_expire_time_in_epoch_seconds(_TTL_SECONDS)
+        if session.schedule_end_time is not None and expire_time > session.schedule_end_time and \
+                is_near_end(session.schedule_end_time, session.interval_seconds, get_system_time_in_seconds()):
+            # The last fire of the schedule, which moves the end when it finds the session extended, may have
+            # passed, so we push it out now.  If the extend fails the schedule just runs a bit longer.
+            session = copy(session)
+            session.schedule_end_time = self.__scheduler.calc_end_time(expire_time)
+            # The schedule payload carries the session as it will be once extended
+            scheduled = copy(session)
+            scheduled.expire_time = expire_time
+            scheduled.state_counter += 1
+            self.__move_schedule_end(scheduled)
         if not self.__session_repo.extend_session(session, _TTL_SECONDS):
             # We raise gone because it must have existed in order to call this
             raise GoneException(f"Session with id {session.session_id} no longer exists.")
@@ -78,12 +339,86 @@ class Instance:
     def find_session(self, session_id: str) -> Optional[Session]:
         return self.__session_repo.find_session(session_id)
 
+    def find_sessions(self, session_ids: Collection[str]) -> List[Session]:
+        return self.__session_repo.find_sessions(session_ids)
+
     def delete_session(self, session_id: str) -> bool:
         return self.__session_repo.delete_session(session_id)
 
-    def create_schedule(self, session_id: str, future_seconds: int) -> bool:
+    def __move_schedule_end(self, session: Session):
+        assert self.__function_arn is not None
+        if not self.__scheduler.update_schedule(self.__function_arn, session, session.schedule_end_time):
+            logger.info(f"Schedule for session {session.session_id} no longer exists, creating it.")
+            self.__scheduler.create_schedule(self.__function_arn, session)
+
+    def refresh_schedule(self, session: Session) -> bool:
+        """
+        Updates the session data carried by the session's schedule, and moves its end to the session's expire time.
+        """
         assert self.__function_arn is not None
-        return self.__scheduler.create_schedule(self.__function_arn, session_id, future_seconds)
+        return self.__scheduler.update_schedule(self.__function_arn,
+                                                session,
+                                                self.__scheduler.calc_end_time(session.expire_time))
+
+    def create_schedule(self, session: Session) -> bool:
+        assert self.__function_arn is not None
+        return self.__scheduler.create_schedule(self.__function_arn, session)
 
     def delete_schedule(self, session_id: str) -> bool:
         return self.__scheduler.delete_schedule(session_id)
+
+    def is_interval_supported(self, interval_seconds: int) -> bool:
+        return self.__scheduler.is_interval_supported(interval_seconds)
+
+    def list_bucket_members(self, bucket_id: str) -> List[str]:
+        return self.__scheduler.list_bucket_members(bucket_id)
+
+    def get_schedule_shard_count(self) -> int:
+        return self.__scheduler.get_shard_count()
+
+    def list_scheduled_session_ids(self, created_before: int,
+                                   page_size: int,
+                                   shard: int = 0,
+                                   cursor: Optional[str] = None) -> Iterable[Page[str]]:
+        return self.__scheduler.list_session_ids(created_before, page_size, shard, cursor)
+
+    def scan_sessions(self, page_size: int, cursor: Optional[str] = None) -> Iterable[Page[Session]]:
+        return self.__session_repo.scan_sessions(page_size, cursor)
+
+    def find_unscheduled_sessions(self, sessions: Collection[Session]) -> List[Session]:
+        """
+        Checks concurrently which of the given sessions do not have a schedule.
+        """
+        if len(sessions) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=min(_MAX_SCHEDULE_CHECK_WORKERS, len(sessions))) as executor:
+            found = list(executor.map(deadline.bind(lambda session: self.__scheduler.has_schedule(session.session_id)),
+                                      sessions))
+        return [session for session, has_schedule in zip(sessions, found) if not has_schedule]
+
+    def scan_expired_session_ids(self, page_size: int, cursor: Optional[str] = None) -> Iterable[Page[str]]:
+        expired_before = get_system_time_in_seconds() - _PURGE_GRACE_SECONDS
+        return self.__session_repo.scan_expired_session_ids(expired_before, page_size, cursor)
+
+    def delete_sessions(self, session_ids: Collection[str]):
+        self.__session_repo.delete_sessions(session_ids)
+
+    def create_schedules(self, sessions: Collection[Session]) -> List[ScheduleResult]:
+        assert self.__function_arn is not None
+        return self.__scheduler.create_schedules(self.__function_arn, sessions)
+
+    def delete_schedules(self, session_ids: Collection[str]) -> int:
+        """
+        Deletes the schedules for the given sessions concurrently.
+
+        :param session_ids: the session ids.
+        :return: the number of schedules that were deleted.
+        """
+        deleted = 0
+        for result in self.__scheduler.delete_schedules(session_ids):
+            if result.error is not None:
+                logger.error(f"Failed to delete schedule for session {result.session_id}: "
+                             f"{exception_utils.get_exception_message(result.error)}")
+            elif result.success:
+                deleted += 1
+        return deleted
@@ -1,11 +1,42 @@
-from typing import Any, Dict, Optional
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
 from instance import Instance
 from internal import InternalEventProcessor
-from request import get_required_parameter
-from utils import loghelper
+from push_notifier import PERMANENT_ERROR_CODES
+from request import get_required_parameter, get_parameter
+from scheduler import is_near_end
+from scheduler.wheel_scheduler import parse_wheel_bucket_id, calc_offset
+from session_repo import Session
+from utils import loghelper, deadline
+from utils.date_utils import get_system_time_in_seconds
+from utils.timer_wheel import TimerWheel
 
 logger = loghelper.get_logger(__name__)
 
+# Default number of sessions to look at per page when purging expired sessions
+_DEFAULT_PURGE_PAGE_SIZE = 1000
+
+# Default number of schedules and sessions to read per page when reconciling
+_DEFAULT_RECONCILE_PAGE_SIZE = 100
+
+# Schedules younger than this are left alone when reconciling, their session may not have been committed yet
+_RECONCILE_GRACE_SECONDS = 300
+
+# Maximum number of schedule shards reconciled at the same time
+_MAX_RECONCILE_SHARD_WORKERS = 4
+
+# Reconciling and purging stop starting new pages once the invocation has this little time left, and return a
+# cursor instead
+_JOB_DEADLINE_MARGIN_SECONDS = 10
+
+# A wheel invocation that starts late sends the pushes it missed by at most this much, older ones are skipped
+_WHEEL_CATCH_UP_SECONDS = 5
+
+# Time left at the end of a wheel invocation to finish up before the Lambda deadline
+_WHEEL_DEADLINE_MARGIN_SECONDS = 2
+
 
 class InternalEventProcessorImpl(InternalEventProcessor):
     def process(self, instance: Instance, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
@@ -14,6 +45,19 @@ class InternalEventProcessorImpl(InternalEventProcessor):
         if event_type == 'keepalive':
             self.keep_alive(instance, internal_event)
             return None
+        if event_type == 'bucketKeepalive':
+            self.bucket_keep_alive(instance, internal_event)
+            return None
+        if event_type == 'wheelKeepalive':
+            self.wheel_keep_alive(instance, internal_event)
+            return None
+        if event_type == 'purgeExpiredSessions':
+            return self.purge_expired_sessions(instance, internal_event)
+        if event_type == 'reconcileSchedules':
+            return self.reconcile_schedules(instance, internal_event)
+        if event_type == 'warmup':
+            instance.warm_up()
+            return None
         logger.error(f"Unrecognized event type: {event_type}")
         return None
 
@@ -24,7 +68,118 @@ class InternalEventProcessorImpl(InternalEventProcessor):
             logger.error(f"sessionId not found in event: {event}")
             return
 
+        token = event.get('fcmDeviceToken')
+        expire_time = event.get('expireTime')
+        if token is not None and expire_time is not None:
+            # The session can only expire later than the payload says, unless it is deleted, and deleting a
+            # session deletes its schedule.  So we can push without reading the session, until the last fire
+            # before the schedule ends with the expire time in the payload.
+            if not is_near_end(expire_time, event.get('intervalSeconds', 0), get_system_time_in_seconds()):
+                logger.info(f"Sending push notification for sessionId {session_id} ...")
+                result = instance.send_push_notification(token, session_id)
+                if result.success or result.error_code in PERMANENT_ERROR_CODES:
+                    # A token rejected for good already took the session and its schedule with it
+                    return
+                if instance.is_push_suspended():
+                    # FCM is down, the session tells us nothing we can act on until it is back
+                    return
+                # The push was already tried, the session is only read to see whether the schedule should go
+                logger.info(f"Push notification for sessionId {session_id} failed, checking the session.")
+                session = instance.find_session(session_id)
+                if session is None or session.is_expired():
+                    InternalEventProcessorImpl.keep_session_alive(instance, session_id, session)
+                return
+
         session = instance.find_session(session_id)
+        if session is not None and session.is_expired() and session.schedule_end_time is not None:
+            # The schedule ends by the time the session expires, this is a late fire
+            logger.info(f"Session {session_id} is expired, its schedule ends on its own.")
+            return
+        InternalEventProcessorImpl.keep_session_alive(instance, session_id, session)
+        if token is not None and session is not None and not session.is_expired() and \
+                session.state_counter != event.get('stateCounter'):
+            # The session was extended since the payload was built, refresh it so we can skip the read again
+            logger.info(f"Refreshing schedule for sessionId {session_id} ...")
+            instance.refresh_schedule(session)
+
+    @staticmethod
+    def bucket_keep_alive(instance: Instance, event: Dict[str, Any]):
+        bucket_id = event.get('bucketId')
+        if bucket_id is None:
+            logger.error(f"bucketId not found in event: {event}")
+            return
+
+        session_ids = instance.list_bucket_members(bucket_id)
+        if len(session_ids) == 0:
+            logger.info(f"Bucket {bucket_id} is empty.")
+            return
+        found = {session.session_id: session for session in instance.find_sessions(session_ids)}
+        logger.info(f"Bucket {bucket_id} has {len(session_ids)} session(s).")
+        live = []
+        for session_id in session_ids:
+            session = found.get(session_id)
+            if session is None or session.is_expired():
+                InternalEventProcessorImpl.keep_session_alive(instance, session_id, session)
+            else:
+                live.append(session)
+        results = instance.send_push_notifications(live)
+        logger.info(f"Sent {sum(map(lambda r: r.success, results))} of {len(live)} push notification(s) "
+                    f"for bucket {bucket_id}.")
+
+    @staticmethod
+    def wheel_keep_alive(instance: Instance, event: Dict[str, Any]):
+        bucket_id = event.get('bucketId')
+        if bucket_id is None:
+            logger.error(f"bucketId not found in event: {event}")
+            return
+
+        interval = parse_wheel_bucket_id(bucket_id)
+        session_ids = instance.list_bucket_members(bucket_id)
+        if len(session_ids) == 0:
+            logger.info(f"Bucket {bucket_id} is empty.")
+            return
+        found = {session.session_id: session for session in instance.find_sessions(session_ids)}
+        logger.info(f"Bucket {bucket_id} has {len(session_ids)} session(s).")
+
+        # We cover the rest of the minute we were started in, the next invocation picks up from there
+        now = time.time()
+        start_tick = max(int(now) // 60 * 60, int(now) - _WHEEL_CATCH_UP_SECONDS)
+        end_tick = min(int(now) // 60 * 60 + 60,
+                       int(now + deadline.get_deadline().get_remaining_seconds() - _WHEEL_DEADLINE_MARGIN_SECONDS))
+        wheel: TimerWheel[Session] = TimerWheel(start_tick)
+        for session_id in session_ids:
+            session = found.get(session_id)
+            if session is None or session.is_expired():
+                InternalEventProcessorImpl.keep_session_alive(instance, session_id, session)
+                continue
+            tick = start_tick + (calc_offset(session.fcm_device_token, interval) - start_tick) % interval
+            if tick < end_tick:
+                wheel.schedule(tick, session)
+
+        sent = 0
+        while len(wheel) > 0 and wheel.get_current_tick() < end_tick:
+            delay = wheel.get_current_tick() - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            tick = wheel.get_current_tick()
+            due = []
+            for session in wheel.advance():
+                if session.is_expired():
+                    InternalEventProcessorImpl.keep_session_alive(instance, session.session_id, session)
+                else:
+                    due.append(session)
+            # Everything due in the same second goes out together
+            results = instance.send_push_notifications(due)
+            sent += sum(map(lambda r: r.success, results))
+            if tick + interval < end_tick:
+                for session, result in zip(due, results):
+                    # Sessions whose token was rejected for good are gone
+                    if result.error_code not in PERMANENT_ERROR_CODES:
+                        wheel.schedule(tick + interval, session)
+        logger.info(f"Sent {sent} push notification(s) for bucket {bucket_id}.")
+
+    @staticmethod
+    def keep_session_alive(instance: Instance, session_id: str, session: Optional[Session]):
         if session is None or session.is_expired():
             state = "gone" if session is None else "expired"
             logger.info(f"Session {session_id} is {state}, deleting schedule.")
@@ -32,3 +187,149 @@ class InternalEventProcessorImpl(InternalEventProcessor):
         else:
             logger.info(f"Sending push notification for sessionId {session_id} ...")
             instance.send_push_notification(session.fcm_device_token, session_id)
+
+    @staticmethod
+    def purge_expired_sessions(instance: Instance, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Deletes the expired sessions that TTL has not removed yet, and their schedules, one page at a time.
+
+        When the invocation runs out of time it stops and returns {'cursor': ...}, invoking it again with the
+        cursor in the event picks up where it stopped.  Nothing is returned once it is done.
+        """
+        page_size = get_parameter(event, 'pageSize', int) or _DEFAULT_PURGE_PAGE_SIZE
+        cursor = get_parameter(event, 'cursor', str)
+        stop_at = time.monotonic() + deadline.get_deadline().get_remaining_seconds() - _JOB_DEADLINE_MARGIN_SECONDS
+        purged = deleted = 0
+        next_cursor = None
+        for page in instance.scan_expired_session_ids(page_size, cursor):
+            if len(page.items) > 0:
+                # Sessions first, if deleting a schedule fails it will remove itself when it finds the session gone
+                instance.delete_sessions(page.items)
+                deleted += instance.delete_schedules(page.items)
+                purged += len(page.items)
+            if page.cursor is not None and time.monotonic() >= stop_at:
+                next_cursor = page.cursor
+                break
+
+        logger.info(f"Purged {purged} expired session(s), deleted {deleted} schedule(s).")
+        if next_cursor is None:
+            return None
+        logger.info(f"Ran out of time purging expired sessions, resume with cursor: {json.dumps(next_cursor)}")
+        return {'cursor': next_cursor}
+
+    @staticmethod
+    def delete_orphaned_schedules(instance: Instance,
+                                  created_before: int,
+                                  page_size: int,
+                                  shard: int,
+                                  cursor: Optional[str],
+                                  stop_at: float) -> Tuple[int, int, Optional[str], bool]:
+        """
+        Deletes the schedules in the given shard that do not have a live session, holding one page at a time.
+
+        :param cursor: where to resume the listing, None to start at the beginning.
+        :param stop_at: no page is listed after this time, as given by time.monotonic().
+        :return: the number of orphaned schedules found and the number deleted, the cursor to resume from and
+        whether the shard is done.
+        """
+        orphaned = deleted = 0
+        if time.monotonic() >= stop_at:
+            return orphaned, deleted, cursor, False
+        for page in instance.list_scheduled_session_ids(created_before, page_size, shard, cursor):
+            session_ids = page.items
+            if len(session_ids) > 0:
+                live = set(map(lambda s: s.session_id,
+                               filter(lambda s: not s.is_expired(), instance.find_sessions(session_ids))))
+                orphans = list(filter(lambda session_id: session_id not in live, session_ids))
+                if len(orphans) > 0:
+                    orphaned += len(orphans)
+                    deleted += instance.delete_schedules(orphans)
+            if page.cursor is not None and time.monotonic() >= stop_at:
+                return orphaned, deleted, page.cursor, False
+        return orphaned, deleted, None, True
+
+    @staticmethod
+    def create_missing_schedules(instance: Instance,
+                                 page_size: int,
+                                 cursor: Optional[str],
+                                 stop_at: float) -> Tuple[int, int, Optional[str], bool]:
+        """
+        Creates the schedules of the live sessions that do not have one, holding one page at a time.
+
+        :param cursor: where to resume the scan, None to start at the beginning.
+        :param stop_at: no page is read after this time, as given by time.monotonic().
+        :return: the number of missing schedules found and the number created, the cursor to resume from and
+        whether the scan is done.
+        """
+        missing = created = 0
+        if time.monotonic() >= stop_at:
+            return missing, created, cursor, False
+        for page in instance.scan_sessions(page_size, cursor):
+            unscheduled = instance.find_unscheduled_sessions(list(filter(lambda s: not s.is_expired(), page.items)))
+            if len(unscheduled) > 0:
+                missing += len(unscheduled)
+                for result in instance.create_schedules(unscheduled):
+                    if result.error is not None:
+                        logger.error(f"Failed to create schedule for session {result.session_id}: {result.error}")
+                    elif result.success:
+                        created += 1
+            if page.cursor is not None and time.monotonic() >= stop_at:
+                return missing, created, page.cursor, False
+        return missing, created, None, True
+
+    @staticmethod
+    def reconcile_schedules(instance: Instance, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Deletes the schedules without a live session, then creates the missing schedules of live sessions.
+
+        When the invocation runs out of time it stops and returns {'cursor': ...}, invoking it again with the
+        cursor in the event picks up where it stopped.  Nothing is returned once it is done.
+        """
+        page_size = get_parameter(event, 'pageSize', int) or _DEFAULT_RECONCILE_PAGE_SIZE
+        cursor = get_parameter(event, 'cursor', dict)
+        if cursor is None:
+            shard_count = instance.get_schedule_shard_count()
+            cursor = {
+                'createdBefore': get_system_time_in_seconds() - _RECONCILE_GRACE_SECONDS,
+                # The shards still to do, with where to resume each of them
+                'shards': {str(shard): None for shard in range(shard_count)},
+                'sessions': None
+            }
+        created_before: int = cursor['createdBefore']
+        shards: Dict[str, Optional[str]] = dict(cursor.get('shards', {}))
+        # The deadline is per thread, so the shard workers get it from us
+        stop_at = time.monotonic() + deadline.get_deadline().get_remaining_seconds() - _JOB_DEADLINE_MARGIN_SECONDS
+
+        # Schedules without a live session, the shards are listed in parallel
+        orphaned = deleted = 0
+        if len(shards) > 0:
+            with ThreadPoolExecutor(max_workers=min(len(shards), _MAX_RECONCILE_SHARD_WORKERS)) as executor:
+                # The scheduler calls of the workers retry under our deadline
+                results = list(executor.map(
+                    deadline.bind(lambda item: InternalEventProcessorImpl.delete_orphaned_schedules(
+                        instance, created_before, page_size, int(item[0]), item[1], stop_at)),
+                    list(shards.items())))
+            for shard, (shard_orphaned, shard_deleted, shard_cursor, done) in zip(list(shards.keys()), results):
+                orphaned += shard_orphaned
+                deleted += shard_deleted
+                if done:
+                    shards.pop(shard)
+                else:
+                    shards[shard] = shard_cursor
+
+        # Live sessions without a schedule
+        missing = created = 0
+        sessions_done = 'sessions' not in cursor
+        if not sessions_done:
+            missing, created, sessions_cursor, sessions_done = InternalEventProcessorImpl.create_missing_schedules(
+                instance, page_size, cursor['sessions'], stop_at)
+
+        logger.info(f"Reconciled schedules: deleted {deleted} of {orphaned} orphaned schedule(s), "
+                    f"created {created} of {missing} missing schedule(s).")
+        if len(shards) == 0 and sessions_done:
+            return None
+        next_cursor = {'createdBefore': created_before, 'shards': shards}
+        if not sessions_done:
+            next_cursor['sessions'] = sessions_cursor
+        logger.info(f"Ran out of time reconciling schedules, resume with cursor: {json.dumps(next_cursor)}")
+        return {'cursor': next_cursor}
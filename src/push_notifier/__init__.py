@@ -1,5 +1,131 @@
 import abc
-from typing import Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from email.utils import parsedate_to_datetime
+from enum import Enum
+from typing import Dict, Optional, Collection, List, Callable, TypeVar
+
+from utils.deadline import calc_max_retry_seconds
+from utils.retry import RetryPolicy, RetryMetrics
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# Maximum number of sends running at the same time, the HTTP clients pool 10 connections per host and we stay under that
+_MAX_DISPATCH_WORKERS = 8
+
+# Maximum number of sends queued or running, the dispatcher waits for one to finish before queueing another
+_MAX_PENDING_DISPATCHES = 2 * _MAX_DISPATCH_WORKERS
+
+# Retries are kept short, a keepalive that is a few seconds late is fine but one that never comes is not
+RETRY_POLICY = RetryPolicy(max_attempts=4, base_delay_seconds=0.1, max_delay_seconds=2.0, deadline_seconds=10.0)
+
+
+class PushErrorCode(Enum):
+    """
+    Why a push notification failed, named after the FCM error codes.
+    """
+    UNREGISTERED = 'UNREGISTERED'
+    INVALID_ARGUMENT = 'INVALID_ARGUMENT'
+    SENDER_ID_MISMATCH = 'SENDER_ID_MISMATCH'
+    QUOTA_EXCEEDED = 'QUOTA_EXCEEDED'
+    UNAVAILABLE = 'UNAVAILABLE'
+    INTERNAL = 'INTERNAL'
+    THIRD_PARTY_AUTH_ERROR = 'THIRD_PARTY_AUTH_ERROR'
+    UNKNOWN = 'UNKNOWN'
+
+
+# Errors that mean FCM will never accept the token
+PERMANENT_ERROR_CODES = frozenset((PushErrorCode.UNREGISTERED,
+                                   PushErrorCode.INVALID_ARGUMENT,
+                                   PushErrorCode.SENDER_ID_MISMATCH))
+
+# Errors that may go away if we try again later
+TRANSIENT_ERROR_CODES = frozenset((PushErrorCode.QUOTA_EXCEEDED, PushErrorCode.UNAVAILABLE, PushErrorCode.INTERNAL))
+
+
+def get_retry_after(ex: Exception) -> Optional[float]:
+    """
+    :return: the seconds FCM asked us to wait before trying again, from the Retry-After header, if any.
+    """
+    response = getattr(ex, 'http_response', None)
+    headers = getattr(response, 'headers', None)
+    value = headers.get('Retry-After') if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class PushDispatcher:
+    """
+    Runs the sends of notify_many on a bounded pool of workers, with a bounded number of them queued at a time.
+    The pool is created on first use and shared by every call.
+    """
+
+    def __init__(self, max_workers: int = _MAX_DISPATCH_WORKERS, max_pending: int = _MAX_PENDING_DISPATCHES):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.mutex = threading.Lock()
+        self.__executor: Optional[ThreadPoolExecutor] = None
+
+    def map(self, function: Callable[[T, float], R], items: Collection[T], max_seconds: float) -> List[R]:
+        """
+        Calls the function for each of the items, concurrently unless there is only one.
+
+        :param function: called with the item and the monotonic time by which its retries have to be done.  The
+        workers do not know about our invocation, so they get the deadline from us.
+        :param items: the items to send.
+        :param max_seconds: the longest the retries may take, capped by the time the invocation has left.
+        :return: the results, in the order of the items.
+        """
+        deadline_at = time.monotonic() + min(max_seconds, calc_max_retry_seconds())
+        if len(items) <= 1:
+            return list(map(lambda item: function(item, deadline_at), items))
+
+        executor = self.__get_executor()
+        pending = threading.BoundedSemaphore(self.max_pending)
+        futures: List[Future] = []
+        for item in items:
+            pending.acquire()
+            future = executor.submit(function, item, deadline_at)
+            future.add_done_callback(lambda f: pending.release())
+            futures.append(future)
+        return list(map(lambda f: f.result(), futures))
+
+    def __get_executor(self) -> ThreadPoolExecutor:
+        if self.__executor is None:
+            with self.mutex:
+                if self.__executor is None:
+                    self.__executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                         thread_name_prefix="push-dispatch")
+        return self.__executor
+
+
+class PushMessage:
+    def __init__(self, session_id: str, token: str, data: Dict[str, str]):
+        self.session_id = session_id
+        self.token = token
+        self.data = data
+
+
+class PushResult:
+    def __init__(self, session_id: str,
+                 success: bool,
+                 error: Optional[Exception] = None,
+                 error_code: Optional[PushErrorCode] = None):
+        self.session_id = session_id
+        self.success = success
+        # The error that caused the send to fail
+        self.error = error
+        self.error_code = error_code if error_code is not None or error is None else PushErrorCode.UNKNOWN
 
 
 class PushNotifier(metaclass=abc.ABCMeta):
@@ -7,3 +133,41 @@ class PushNotifier(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def notify(self, token: str, data: Dict[str, str], dry_run: bool = False):
         raise NotImplementedError()
+
+    def warm_up(self):
+        """
+        Does the expensive setup ahead of the first push notification, so it is not paid by a request.
+        """
+        pass
+
+    def get_retry_metrics(self) -> Optional[RetryMetrics]:
+        """
+        :return: the retry counts of the sends, or None if the notifier does not retry.
+        """
+        return None
+
+    def classify_error(self, ex: Exception) -> PushErrorCode:
+        """
+        Tells why a push notification failed.
+
+        :param ex: the exception raised by notify().
+        :return: the error code.
+        """
+        return PushErrorCode.UNKNOWN
+
+    def notify_many(self, messages: Collection[PushMessage], dry_run: bool = False) -> List[PushResult]:
+        """
+        Sends several push notifications.  A failure for one message does not stop the others.
+
+        :param messages: the messages.
+        :param dry_run: True to validate the messages without delivering them.
+        :return: the results, in the same order as the messages.
+        """
+        results = []
+        for message in messages:
+            try:
+                self.notify(message.token, message.data, dry_run=dry_run)
+                results.append(PushResult(message.session_id, True))
+            except Exception as ex:
+                results.append(PushResult(message.session_id, False, ex))
+        return results
@@ -0,0 +1,267 @@
+import base64
+import json
+import threading
+import time
+from typing import Optional, Dict, Collection, List, Any
+from urllib.parse import urlencode
+
+import requests
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+
+from bean import Bean
+from push_notifier import PushNotifier, PushMessage, PushResult, PushErrorCode, PushDispatcher, \
+    TRANSIENT_ERROR_CODES, RETRY_POLICY, get_retry_after
+from secrets_repo import GcpCredentials
+from utils import loghelper
+from utils.deadline import calc_max_retry_seconds
+from utils.http_client import HttpClient, HttpMethod, RequestBuilder, HttpException, HttpServerException
+from utils.retry import RetryMetrics, call_with_retry
+from utils.token_refresher import TokenRefresher, AccessToken
+
+logger = loghelper.get_logger(__name__)
+
+DEFAULT_FCM_URL = "https://fcm.googleapis.com"
+
+# Used when the service account does not have a token_uri
+_DEFAULT_TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+_FCM_SCOPE = "https://www.googleapis.com/auth/firebase.messaging"
+
+_JWT_BEARER_GRANT_TYPE = "urn:ietf:params:oauth:grant-type:jwt-bearer"
+
+# The longest Google accepts
+_JWT_LIFETIME_SECONDS = 3600
+
+# Tokens are refreshed in the background once they are this close to expiring
+_TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+_FCM_ERROR_TYPE = "type.googleapis.com/google.firebase.fcm.v1.FcmError"
+
+# Our error codes are named after the FCM ones
+_FCM_ERROR_CODES = dict(map(lambda code: (code.value, code), PushErrorCode))
+
+# Used when the error has no FCM error code
+_STATUS_ERROR_CODES = {
+    'INVALID_ARGUMENT': PushErrorCode.INVALID_ARGUMENT,
+    'RESOURCE_EXHAUSTED': PushErrorCode.QUOTA_EXCEEDED,
+    'UNAVAILABLE': PushErrorCode.UNAVAILABLE,
+    'INTERNAL': PushErrorCode.INTERNAL
+}
+
+# Used when the response has no error status either
+_HTTP_STATUS_ERROR_CODES = {
+    400: PushErrorCode.INVALID_ARGUMENT,
+    429: PushErrorCode.QUOTA_EXCEEDED,
+    500: PushErrorCode.INTERNAL,
+    503: PushErrorCode.UNAVAILABLE
+}
+
+
+class FcmException(Exception):
+    def __init__(self, message: str, error_code: PushErrorCode, http_response: Optional[requests.Response] = None):
+        super().__init__(message)
+        self.error_code = error_code
+        self.http_response = http_response
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64_json(record: Dict[str, Any]) -> str:
+    return _b64(json.dumps(record, separators=(',', ':')).encode('utf-8'))
+
+
+def build_jwt(content: Dict[str, Any], key: RSAPrivateKey, token_uri: str, now: int) -> str:
+    """
+    Builds the assertion we trade for an access token, signed with the service account's key.
+
+    :param content: the service account credentials.
+    :param key: the service account's private key.
+    :param token_uri: the token endpoint.
+    :param now: the current time, in epoch seconds.
+    :return: the signed JWT.
+    """
+    header = {'alg': 'RS256', 'typ': 'JWT'}
+    if content.get('private_key_id') is not None:
+        header['kid'] = content['private_key_id']
+    claims = {
+        'iss': content['client_email'],
+        'scope': _FCM_SCOPE,
+        'aud': token_uri,
+        'iat': now,
+        'exp': now + _JWT_LIFETIME_SECONDS
+    }
+    signing_input = f"{_b64_json(header)}.{_b64_json(claims)}"
+    signature = key.sign(signing_input.encode('ascii'), padding.PKCS1v15(), hashes.SHA256())
+    return f"{signing_input}.{_b64(signature)}"
+
+
+def _to_fcm_exception(response: requests.Response) -> FcmException:
+    code = None
+    message = response.text
+    try:
+        error = json.loads(response.text).get('error')
+    except (ValueError, AttributeError):
+        error = None
+    if isinstance(error, dict):
+        message = error.get('message', message)
+        for detail in error.get('details', []):
+            if detail.get('@type') == _FCM_ERROR_TYPE:
+                code = _FCM_ERROR_CODES.get(detail.get('errorCode'))
+        if code is None:
+            code = _STATUS_ERROR_CODES.get(error.get('status'))
+    if code is None:
+        code = _HTTP_STATUS_ERROR_CODES.get(response.status_code, PushErrorCode.UNKNOWN)
+    return FcmException(f"{response.status_code}: {message}", code, response)
+
+
+def _is_unauthenticated(ex: FcmException) -> bool:
+    return ex.http_response is not None and ex.http_response.status_code == 401
+
+
+def _classify_token_error(ex: Exception) -> PushErrorCode:
+    # Not being able to authenticate says nothing about the device token, so it is never a permanent error
+    if isinstance(ex, (HttpServerException, requests.RequestException)):
+        return PushErrorCode.UNAVAILABLE
+    return PushErrorCode.UNKNOWN
+
+
+def classify_error(ex: Exception) -> PushErrorCode:
+    if isinstance(ex, FcmException):
+        return ex.error_code
+    return PushErrorCode.UNKNOWN
+
+
+def is_transient_error(ex: Exception) -> bool:
+    return classify_error(ex) in TRANSIENT_ERROR_CODES
+
+
+class FcmHttpPushNotifier(PushNotifier):
+    """
+    Sends push notifications with the FCM HTTP v1 API directly, instead of going through firebase_admin.
+
+    The access token is obtained with a JWT signed with the service account's key, and refreshed in the background
+    before it expires, or right away when FCM rejects it.  FCM has no batch send, so notify_many sends the messages
+    concurrently over the pooled connections of the HTTP client, with a bounded number of them queued at a time.
+    """
+
+    def __init__(self, gcp_creds_bean: Bean, client: HttpClient, fcm_url: str = DEFAULT_FCM_URL):
+        self.gcp_creds_bean = gcp_creds_bean
+        self.client = client
+        self.fcm_url = fcm_url
+        self.mutex = threading.RLock()
+        self.__content: Optional[Dict[str, Any]] = None
+        self.__key: Optional[RSAPrivateKey] = None
+        self.dispatcher = PushDispatcher()
+        self.token_refresher = TokenRefresher(self.__fetch_access_token, _TOKEN_REFRESH_MARGIN_SECONDS)
+        self.retry_policy = RETRY_POLICY
+        self.retry_metrics = RetryMetrics()
+
+    def notify(self, token: str, data: Dict[str, str], dry_run: bool = False):
+        self.__check_credentials()
+        call_with_retry(lambda: self.__send(token, data, dry_run),
+                        is_transient_error,
+                        self.retry_policy,
+                        self.retry_metrics,
+                        "send",
+                        get_retry_after=get_retry_after,
+                        max_seconds=calc_max_retry_seconds())
+
+    def warm_up(self):
+        """
+        Loads the credentials and gets the first access token.
+        """
+        self.__check_credentials()
+        self.token_refresher.get_token()
+
+    def classify_error(self, ex: Exception) -> PushErrorCode:
+        return classify_error(ex)
+
+    def get_retry_metrics(self) -> Optional[RetryMetrics]:
+        return self.retry_metrics
+
+    def notify_many(self, messages: Collection[PushMessage], dry_run: bool = False) -> List[PushResult]:
+        self.__check_credentials()
+        messages = list(messages)
+        return self.dispatcher.map(lambda message, deadline_at: self.__send_message(message, dry_run, deadline_at),
+                                   messages,
+                                   self.retry_policy.deadline_seconds)
+
+    def __send_message(self, message: PushMessage, dry_run: bool, deadline_at: float) -> PushResult:
+        try:
+            call_with_retry(lambda: self.__send(message.token, message.data, dry_run),
+                            is_transient_error,
+                            self.retry_policy,
+                            self.retry_metrics,
+                            "send",
+                            get_retry_after=get_retry_after,
+                            max_seconds=max(0.0, deadline_at - time.monotonic()))
+            return PushResult(message.session_id, True)
+        except Exception as ex:
+            return PushResult(message.session_id, False, ex, classify_error(ex))
+
+    def __send(self, token: str, data: Dict[str, str], dry_run: bool):
+        body: Dict[str, Any] = {
+            'message': {
+                'token': token,
+                'data': data
+            }
+        }
+        if dry_run:
+            body['validate_only'] = True
+        access_token = self.__get_access_token()
+        try:
+            self.__post(body, access_token)
+        except FcmException as ex:
+            if not _is_unauthenticated(ex):
+                raise
+            # The token was revoked before it expired, one new token is worth a try before giving up
+            logger.warning(f"Access token rejected, getting a new one: {ex}")
+            self.token_refresher.invalidate(access_token)
+            self.__post(body, self.__get_access_token())
+
+    def __get_access_token(self) -> str:
+        try:
+            return self.token_refresher.get_token()
+        except Exception as ex:
+            raise FcmException(f"Failed to get an access token: {ex}", _classify_token_error(ex))
+
+    def __post(self, body: Dict[str, Any], access_token: str):
+        try:
+            (RequestBuilder(HttpMethod.POST, f"v1/projects/{self.__content['project_id']}/messages:send")
+             .authorization("Bearer", access_token)
+             .content_type("application/json")
+             .body(body)
+             .send(self.client, self.fcm_url))
+        except HttpException as ex:
+            raise _to_fcm_exception(ex.response)
+        except requests.RequestException as ex:
+            # Timeouts and connection errors
+            raise FcmException(f"Failed to reach FCM: {ex}", PushErrorCode.UNAVAILABLE)
+
+    def __fetch_access_token(self) -> AccessToken:
+        self.__check_credentials()
+        now = int(time.time())
+        token_uri = self.__content.get('token_uri', _DEFAULT_TOKEN_URI)
+        body = urlencode({
+            'grant_type': _JWT_BEARER_GRANT_TYPE,
+            'assertion': build_jwt(self.__content, self.__key, token_uri, now)
+        })
+        resp = (RequestBuilder(HttpMethod.POST, token_uri)
+                .content_type("application/x-www-form-urlencoded")
+                .body(body)
+                .send(self.client))
+        record = json.loads(resp.get_body())
+        return AccessToken(record['access_token'], now + int(record.get('expires_in', _JWT_LIFETIME_SECONDS)))
+
+    def __check_credentials(self):
+        if self.__key is None:
+            with self.mutex:
+                if self.__key is None:
+                    creds: GcpCredentials = self.gcp_creds_bean.get_instance()
+                    self.__content = creds.content
+                    self.__key = serialization.load_pem_private_key(creds.content['private_key'].encode('utf-8'),
+                                                                    password=None)
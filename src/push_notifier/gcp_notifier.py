@@ -1,14 +1,58 @@
+import time
+from datetime import timezone
 from threading import RLock
 from types import ModuleType
-from typing import Optional, Dict
+from typing import Optional, Dict, Collection, List
 
-from firebase_admin import App
+from firebase_admin import App, exceptions
 from firebase_admin.credentials import Certificate
-from firebase_admin.messaging import Message
+from firebase_admin.messaging import Message, UnregisteredError, SenderIdMismatchError, QuotaExceededError, \
+    ThirdPartyAuthError
 
 from bean import Bean
-from push_notifier import PushNotifier
+from push_notifier import PushNotifier, PushMessage, PushResult, PushErrorCode, PushDispatcher, \
+    TRANSIENT_ERROR_CODES, RETRY_POLICY, get_retry_after
 from secrets_repo import GcpCredentials
+from utils import loghelper
+from utils.deadline import calc_max_retry_seconds
+from utils.retry import RetryMetrics, call_with_retry
+from utils.token_refresher import TokenRefresher, AccessToken
+
+logger = loghelper.get_logger(__name__)
+
+# The most messages FCM accepts in one send_each call
+_MAX_BATCH_SIZE = 500
+
+# google-auth refreshes the token itself once it is within 3m45s of expiring, blocking the send that finds it so.
+# We start a background refresh before that, so no send has to wait.
+_TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+# Assumed when the credential does not tell us when its token expires
+_DEFAULT_TOKEN_LIFETIME_SECONDS = 3600
+
+# Checked in order, the messaging errors extend the generic ones
+_ERROR_CODES = (
+    (UnregisteredError, PushErrorCode.UNREGISTERED),
+    (SenderIdMismatchError, PushErrorCode.SENDER_ID_MISMATCH),
+    (QuotaExceededError, PushErrorCode.QUOTA_EXCEEDED),
+    (ThirdPartyAuthError, PushErrorCode.THIRD_PARTY_AUTH_ERROR),
+    (exceptions.InvalidArgumentError, PushErrorCode.INVALID_ARGUMENT),
+    (exceptions.UnavailableError, PushErrorCode.UNAVAILABLE),
+    # Timeouts and connection errors
+    (exceptions.DeadlineExceededError, PushErrorCode.UNAVAILABLE),
+    (exceptions.InternalError, PushErrorCode.INTERNAL)
+)
+
+
+def classify_error(ex: Exception) -> PushErrorCode:
+    for error_type, code in _ERROR_CODES:
+        if isinstance(ex, error_type):
+            return code
+    return PushErrorCode.UNKNOWN
+
+
+def is_transient_error(ex: Exception) -> bool:
+    return classify_error(ex) in TRANSIENT_ERROR_CODES
 
 
 class GcpPushNotifier(PushNotifier):
@@ -23,14 +67,128 @@ class GcpPushNotifier(PushNotifier):
         self.messaging: Optional[ModuleType] = None
         self.app: Optional[App] = None
         self.mutex = RLock()
+        self.dispatcher = PushDispatcher()
+        self.token_refresher = TokenRefresher(self.__fetch_access_token, _TOKEN_REFRESH_MARGIN_SECONDS)
+        self.retry_policy = RETRY_POLICY
+        self.retry_metrics = RetryMetrics()
 
     def notify(self, token: str, data: Dict[str, str], dry_run: bool = False):
         messaging = self.__check_app()
+        self.__check_token()
         message = Message(
             data=data,
             token=token
         )
-        messaging.send(message, dry_run=dry_run)
+        call_with_retry(lambda: messaging.send(message, dry_run=dry_run, app=self.app),
+                        is_transient_error,
+                        self.retry_policy,
+                        self.retry_metrics,
+                        "send",
+                        get_retry_after=get_retry_after,
+                        max_seconds=calc_max_retry_seconds())
+
+    def warm_up(self):
+        """
+        Fetches the credentials, initializes the Firebase app and mints the first access token.  The messaging
+        client shares the credential, so it finds the token ready.
+        """
+        self.__check_app()
+        self.token_refresher.get_token()
+
+    def classify_error(self, ex: Exception) -> PushErrorCode:
+        return classify_error(ex)
+
+    def get_retry_metrics(self) -> Optional[RetryMetrics]:
+        return self.retry_metrics
+
+    def notify_many(self, messages: Collection[PushMessage], dry_run: bool = False) -> List[PushResult]:
+        """
+        Sends the messages in batches, with the batches sent concurrently by a bounded pool of workers.
+        """
+        messaging = self.__check_app()
+        self.__check_token()
+        messages = list(messages)
+        results: List[Optional[PushResult]] = [None] * len(messages)
+        offsets = range(0, len(messages), _MAX_BATCH_SIZE)
+        self.dispatcher.map(lambda offset, deadline_at: self.__send_batch(messaging, messages, offset, results,
+                                                                          dry_run, deadline_at),
+                            offsets,
+                            self.retry_policy.deadline_seconds)
+        return results
+
+    def __send_batch(self, messaging: ModuleType,
+                     messages: List[PushMessage],
+                     offset: int,
+                     results: List[Optional[PushResult]],
+                     dry_run: bool,
+                     deadline_at: float):
+        """
+        Sends one batch, resending the messages that failed with transient errors.  Each batch fills in its own
+        slice of the results, so they stay in order.
+        """
+        batch = messages[offset:offset + _MAX_BATCH_SIZE]
+        indexes = list(range(len(batch)))
+        attempt = 0
+        self.retry_metrics.record_call()
+        while True:
+            try:
+                response = messaging.send_each(list(map(lambda i: Message(data=batch[i].data, token=batch[i].token),
+                                                        indexes)),
+                                               dry_run=dry_run,
+                                               app=self.app)
+                outcomes = list(map(lambda r: (r.success,
+                                               r.exception,
+                                               classify_error(r.exception) if r.exception is not None else None),
+                                    response.responses))
+            except Exception as ex:
+                # The whole call failed, for example because we could not authenticate.  That says nothing about
+                # the tokens, so unless it is worth retrying it is not blamed on them.
+                code = classify_error(ex)
+                if code not in TRANSIENT_ERROR_CODES:
+                    code = PushErrorCode.UNKNOWN
+                outcomes = [(False, ex, code)] * len(indexes)
+
+            retry_indexes = []
+            retry_after = None
+            for index, (success, error, code) in zip(indexes, outcomes):
+                results[offset + index] = PushResult(batch[index].session_id, success, error, code)
+                if code in TRANSIENT_ERROR_CODES:
+                    retry_indexes.append(index)
+                    error_retry_after = get_retry_after(error)
+                    if error_retry_after is not None:
+                        retry_after = max(retry_after or 0.0, error_retry_after)
+            if len(retry_indexes) == 0:
+                return
+
+            attempt += 1
+            delay = self.retry_policy.calc_delay(attempt - 1)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if attempt >= self.retry_policy.max_attempts or time.monotonic() + delay > deadline_at:
+                self.retry_metrics.record_exhausted()
+                logger.error(f"Giving up on {len(retry_indexes)} push notification(s) after {attempt} attempt(s).")
+                return
+            self.retry_metrics.record_retry(results[offset + retry_indexes[0]].error.__class__.__name__)
+            logger.info(f"Retrying {len(retry_indexes)} push notification(s), attempt {attempt} ...")
+            time.sleep(delay)
+            indexes = retry_indexes
+
+    def __fetch_access_token(self) -> AccessToken:
+        # This refreshes the credential the messaging client uses
+        info = self.app.credential.get_access_token()
+        if info.expiry is None:
+            expires_at = time.time() + _DEFAULT_TOKEN_LIFETIME_SECONDS
+        else:
+            # google-auth uses naive datetimes in UTC
+            expires_at = info.expiry.replace(tzinfo=timezone.utc).timestamp()
+        return AccessToken(info.access_token, expires_at)
+
+    def __check_token(self):
+        try:
+            self.token_refresher.get_token()
+        except Exception:
+            # Already logged, the send tries to get a token itself and reports the error if that fails too
+            pass
 
     def __obtain_app(self):
         creds: GcpCredentials = self.gcp_creds_bean.get_instance()
@@ -1,11 +1,161 @@
 import abc
+from typing import List, Optional, Collection, Iterable, Dict, Any
+
+from session_repo import Session
+from utils.page import Page
+from utils.retry import RetryMetrics
+
+# The last fire of a schedule before it ends has to come at least this long before the end
+NEAR_END_SECONDS = 60
+
+
+class ScheduleResult:
+    def __init__(self, session_id: str, success: bool, error: Optional[Exception] = None):
+        self.session_id = session_id
+        # False if the schedule already existed (create) or did not exist (delete), or the call failed
+        self.success = success
+        # The error that caused the call to fail
+        self.error = error
+
+
+def is_near_end(end_time: int, interval_seconds: int, now: int) -> bool:
+    """
+    Tells whether a schedule that fires now may not fire again before the given time, so this is the last fire to
+    find out whether the session was extended.
+
+    :param end_time: the time the schedule ends, in epoch seconds.
+    :param interval_seconds: the time between fires.
+    :param now: the current time, in epoch seconds.
+    """
+    return now + interval_seconds + NEAR_END_SECONDS >= end_time
+
+
+def build_keepalive_event(session: Session) -> Dict[str, Any]:
+    """
+    Builds the internal event a session's schedule sends.  The session data lets the keepalive push without reading
+    the session.
+
+    The FCM device token is stored in the schedule's input in plain text, so anyone allowed to get the schedules can
+    read the tokens, not only those who can read the session table.
+    """
+    return {
+        'type': 'keepalive',
+        'sessionId': session.session_id,
+        'fcmDeviceToken': session.fcm_device_token,
+        'expireTime': session.expire_time,
+        'stateCounter': session.state_counter,
+        'intervalSeconds': session.interval_seconds
+    }
 
 
 class Scheduler(metaclass=abc.ABCMeta):
     @abc.abstractmethod
-    def create_schedule(self, function_arn: str, session_id: str, seconds_interval: int) -> bool:
+    def create_schedule(self, function_arn: str, session: Session) -> bool:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def update_schedule(self, function_arn: str, session: Session, end_time: Optional[int]) -> bool:
+        """
+        Updates the session's schedule with the current session data and the given end time.
+
+        :param function_arn: the function the schedule invokes.
+        :param session: the session.
+        :param end_time: the new end time, in epoch seconds, or None for no end.
+        :return: False if the schedule does not exist.
+        """
         raise NotImplementedError()
 
     @abc.abstractmethod
     def delete_schedule(self, session_id: str) -> bool:
         raise NotImplementedError()
+
+    @abc.abstractmethod
+    def has_schedule(self, session_id: str) -> bool:
+        raise NotImplementedError()
+
+    def get_retry_metrics(self) -> Optional[RetryMetrics]:
+        """
+        :return: the retry counts of the scheduler calls, or None if the scheduler does not retry.
+        """
+        return None
+
+    def get_shard_count(self) -> int:
+        """
+        :return: the number of shards the schedules are spread over, each one can be listed on its own.
+        """
+        return 1
+
+    def list_session_ids(self, created_before: int,
+                         page_size: int,
+                         shard: int = 0,
+                         cursor: Optional[str] = None) -> Iterable[Page[str]]:
+        """
+        Lists the sessions that have schedules in the given shard, one page at a time.  Schedulers that clean up
+        after gone sessions on their own list nothing.
+
+        :param created_before: only schedules created before this time (epoch seconds) are listed.
+        :param page_size: the maximum number of session ids per page.
+        :param shard: the shard, from 0 to get_shard_count() - 1.
+        :param cursor: the cursor of a page to resume after, None to start at the beginning.
+        :return: the pages of session ids.
+        """
+        return []
+
+    def create_schedules(self, function_arn: str, sessions: Collection[Session]) -> List[ScheduleResult]:
+        """
+        Creates the schedules for several sessions.  A failure for one session does not stop the others.
+
+        :param function_arn: the function the schedules invoke.
+        :param sessions: the sessions.
+        :return: the results, in the same order as the sessions.
+        """
+        results = []
+        for session in sessions:
+            try:
+                results.append(ScheduleResult(session.session_id, self.create_schedule(function_arn, session)))
+            except Exception as ex:
+                results.append(ScheduleResult(session.session_id, False, ex))
+        return results
+
+    def delete_schedules(self, session_ids: Collection[str]) -> List[ScheduleResult]:
+        """
+        Deletes the schedules for several sessions.  A failure for one session does not stop the others.
+
+        :param session_ids: the session ids.
+        :return: the results, in the same order as the session ids.
+        """
+        results = []
+        for session_id in session_ids:
+            try:
+                results.append(ScheduleResult(session_id, self.delete_schedule(session_id)))
+            except Exception as ex:
+                results.append(ScheduleResult(session_id, False, ex))
+        return results
+
+    def calc_end_time(self, expire_time: int) -> Optional[int]:
+        """
+        Calculates when the schedule for a session that expires at the given time should end.
+
+        :param expire_time: the session's expire time, in epoch seconds.
+        :return: the end time in epoch seconds, or None if schedules do not end on their own.
+        """
+        return None
+
+    def list_bucket_members(self, bucket_id: str) -> List[str]:
+        """
+        Lists the sessions in the given bucket, for schedulers that group sessions into buckets.
+
+        :param bucket_id: the bucket id.
+        :return: the session ids.
+        """
+        return []
+
+    def is_interval_supported(self, interval_seconds: int) -> bool:
+        """
+        Tells whether sessions can be scheduled with the given interval.  Schedules fire at whole minutes, so by
+        default the interval has to be a whole number of minutes.
+
+        :param interval_seconds: the interval, in seconds.
+        :return: True if the interval is supported.
+        """
+        return interval_seconds % 60 == 0
@@ -1,37 +1,164 @@
 import json
+import math
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Collection, List, Callable, TypeVar, Iterable
 
-from aws import is_not_found_exception, is_conflict_exception
-from scheduler import Scheduler
+from aws import is_not_found_exception, is_conflict_exception, is_transient_exception
+from scheduler import Scheduler, ScheduleResult, build_keepalive_event
+from scheduler.spread_policy import SpreadPolicy
+from session_repo import Session
+from utils import deadline
+from utils.page import Page
+from utils.retry import RetryPolicy, RetryMetrics, call_with_retry
 
 _FLEX_WINDOW = {"Mode": "OFF"}
 
+SCHEDULE_NAME_PREFIX = "ss-keepalive-"
+
+BUCKET_SCHEDULE_NAME_PREFIX = f"{SCHEDULE_NAME_PREFIX}bucket-"
+
+
+# Maximum number of concurrent scheduler calls for the bulk operations
+_MAX_BULK_WORKERS = 8
+
+T = TypeVar('T')
+
 
 def _format_rate(minutes: int) -> str:
     return f"rate({minutes} minutes)"
 
 
+def calc_next_start_date(start_dt: datetime, minutes: int, now: datetime) -> datetime:
+    """
+    Moves the start date forward by whole periods until it is no earlier than now, so the schedule keeps its beat.
+
+    The scheduler rejects start dates more than a few minutes in the past, which an older schedule's is.
+    """
+    if start_dt >= now:
+        return start_dt
+    period = minutes * 60
+    periods = math.ceil((now - start_dt).total_seconds() / period)
+    return start_dt + timedelta(seconds=periods * period)
+
+
+def to_minutes(seconds_interval: int) -> int:
+    assert seconds_interval > 0
+    # We can only specify minutes :(
+    minutes = seconds_interval // 60
+    if seconds_interval % 60 > 0:
+        minutes += 1
+    return minutes
+
+
 class AwsScheduler(Scheduler):
-    def __init__(self, client: Any, group_name: str, role_arn: str):
+    """
+    Scheduler that uses one EventBridge schedule per session.
+
+    Schedules can be sharded over several schedule groups, named after the base group with the shard index appended,
+    so no single group becomes a quota or throttling hot spot.  A schedule's shard is picked by a hash of its key,
+    the session id or bucket id.  With a single shard the base group is used as-is.
+
+    When the shard count is changed, the existing schedules stay in the groups of the previous shard count.  They are
+    looked for there when they are not in their current group, and those groups are listed after the current shards.
+    """
+
+    def __init__(self, client: Any,
+                 group_name: str,
+                 role_arn: str,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 spread_policy: Optional[SpreadPolicy] = None,
+                 shard_count: int = 1,
+                 previous_shard_count: int = 1):
+        """
+        :param shard_count: the number of schedule groups new schedules are spread over.
+        :param previous_shard_count: the shard count before the last change, 1 for the base group.
+        """
+        assert shard_count > 0 and previous_shard_count > 0
         self.client = client
         self.group_name = group_name
+        self.shard_count = shard_count
+        self.previous_shard_count = previous_shard_count
         self.role_arn = role_arn
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.spread_policy = spread_policy or SpreadPolicy()
+        self.retry_metrics = RetryMetrics()
+        current = set(map(lambda shard: self.__to_group_name(shard, shard_count), range(shard_count)))
+        previous = map(lambda shard: self.__to_group_name(shard, previous_shard_count), range(previous_shard_count))
+        # The groups of the previous shard count that are no longer in use
+        self.__legacy_group_names = [name for name in previous if name not in current]
+
+    def __to_group_name(self, shard: int, shard_count: int) -> str:
+        return self.group_name if shard_count == 1 else f"{self.group_name}-{shard}"
+
+    def get_group_name(self, shard: int) -> str:
+        if shard >= self.shard_count:
+            return self.__legacy_group_names[shard - self.shard_count]
+        return self.__to_group_name(shard, self.shard_count)
+
+    def _get_group_name_for(self, key: str) -> str:
+        return self.get_group_name(zlib.crc32(key.encode('utf-8')) % self.shard_count)
+
+    def _get_legacy_group_name_for(self, key: str) -> Optional[str]:
+        """
+        :return: the group the key's schedule was in under the previous shard count, None if it is the same group.
+        """
+        group_name = self.__to_group_name(zlib.crc32(key.encode('utf-8')) % self.previous_shard_count,
+                                          self.previous_shard_count)
+        return group_name if group_name != self._get_group_name_for(key) else None
+
+    def _find_schedule(self, key: str, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Gets a schedule from its current group, or from its group under the previous shard count.
+
+        :return: the schedule, None if it is in neither.
+        """
+        for group_name in (self._get_group_name_for(key), self._get_legacy_group_name_for(key)):
+            if group_name is None:
+                continue
+            try:
+                return self._call('get_schedule', Name=name, GroupName=group_name)
+            except Exception as ex:
+                if not is_not_found_exception(ex):
+                    raise ex
+        return None
+
+    def get_shard_count(self) -> int:
+        # The groups left over from the previous shard count are listed as extra shards
+        return self.shard_count + len(self.__legacy_group_names)
+
+    def get_retry_metrics(self) -> Optional[RetryMetrics]:
+        return self.retry_metrics
+
+    def _call(self, operation_name: str, **kwargs) -> Dict[str, Any]:
+        """
+        Calls the scheduler client, retrying throttling and other transient errors while the invocation has time.
+        """
+        function_to_call = getattr(self.client, operation_name)
+        return call_with_retry(lambda: function_to_call(**kwargs),
+                               is_transient_exception,
+                               self.retry_policy,
+                               self.retry_metrics,
+                               operation_name,
+                               max_seconds=deadline.calc_max_retry_seconds())
 
-    def _build_params(self, function_arn: str, session_id: str, seconds_interval: int) -> Dict[str, Any]:
-        assert seconds_interval > 0
-        # We can only specify minutes :(
-        minutes = seconds_interval // 60
-        if seconds_interval % 60 > 0:
-            minutes += 1
-        start_dt = datetime.utcnow() + timedelta(minutes=minutes)
+    def _build_params(self, function_arn: str,
+                      group_name: str,
+                      name: str,
+                      internal_event: Dict[str, Any],
+                      minutes: int,
+                      start_dt: datetime,
+                      end_dt: Optional[datetime] = None,
+                      flex_window: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Builds the parameters for a schedule that sends the given internal event to us every so many minutes.
 
-        name = f"ss-keepalive-{session_id}"
+        When there is an end date, the schedule deletes itself once it has passed.
+        """
         payload = {
-            'internalEvent': {
-                'type': 'keepalive',
-                'sessionId': session_id
-            }
+            'internalEvent': internal_event
         }
         target = {
             'RoleArn': self.role_arn,
@@ -39,31 +166,146 @@ class AwsScheduler(Scheduler):
             'Input': json.dumps(payload)
         }
 
-        return {
+        params = {
             'Name': name,
-            'GroupName': self.group_name,
+            'GroupName': group_name,
             'ScheduleExpression': _format_rate(minutes),
             'Target': target,
             'StartDate': start_dt,
-            'FlexibleTimeWindow': _FLEX_WINDOW
+            'FlexibleTimeWindow': flex_window or _FLEX_WINDOW
         }
+        if end_dt is not None:
+            params['EndDate'] = end_dt
+            params['ActionAfterCompletion'] = 'DELETE'
+        return params
 
-    def create_schedule(self, function_arn: str, session_id: str, seconds_interval: int):
-        params = self._build_params(function_arn, session_id, seconds_interval)
+    def _create(self, params: Dict[str, Any]) -> bool:
+        # The token makes retries idempotent, if the first attempt made it through a retry still succeeds
+        params = dict(params)
+        params['ClientToken'] = str(uuid.uuid4())
         try:
-            self.client.create_schedule(**params)
+            self._call('create_schedule', **params)
         except Exception as ex:
             if is_conflict_exception(ex):
                 return False
             raise ex
         return True
 
-    def delete_schedule(self, session_id: str):
-        name = f"ss-keepalive-{session_id}"
+    def _delete(self, group_name: str, name: str) -> bool:
         try:
-            self.client.delete_schedule(Name=name, GroupName=self.group_name)
+            self._call('delete_schedule', Name=name, GroupName=group_name)
             return True
         except Exception as ex:
             if is_not_found_exception(ex):
                 return False
             raise ex
+
+    def _build_session_params(self, function_arn: str,
+                              session: Session,
+                              start_dt: datetime,
+                              end_time: Optional[int]) -> Dict[str, Any]:
+        event = build_keepalive_event(session)
+        minutes = to_minutes(session.interval_seconds)
+        return self._build_params(function_arn,
+                                  self._get_group_name_for(session.session_id),
+                                  f"{SCHEDULE_NAME_PREFIX}{session.session_id}",
+                                  event,
+                                  self.spread_policy.calc_rate_minutes(minutes),
+                                  start_dt,
+                                  datetime.utcfromtimestamp(end_time) if end_time is not None else None,
+                                  self.spread_policy.build_flex_window(minutes))
+
+    def __run_bulk(self, items: Collection[T],
+                   get_session_id: Callable[[T], str],
+                   function_to_call: Callable[[T], bool]) -> List[ScheduleResult]:
+        def run(item: T) -> ScheduleResult:
+            session_id = get_session_id(item)
+            try:
+                return ScheduleResult(session_id, function_to_call(item))
+            except Exception as ex:
+                return ScheduleResult(session_id, False, ex)
+
+        if len(items) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=min(_MAX_BULK_WORKERS, len(items))) as executor:
+            # The workers retry under our deadline
+            return list(executor.map(deadline.bind(run), items))
+
+    def create_schedules(self, function_arn: str, sessions: Collection[Session]) -> List[ScheduleResult]:
+        return self.__run_bulk(sessions,
+                               lambda session: session.session_id,
+                               lambda session: self.create_schedule(function_arn, session))
+
+    def delete_schedules(self, session_ids: Collection[str]) -> List[ScheduleResult]:
+        return self.__run_bulk(session_ids, lambda session_id: session_id, self.delete_schedule)
+
+    def create_schedule(self, function_arn: str, session: Session):
+        minutes = to_minutes(session.interval_seconds)
+        params = self._build_session_params(function_arn,
+                                            session,
+                                            self.spread_policy.calc_start_date(datetime.utcnow(), minutes),
+                                            session.schedule_end_time)
+        return self._create(params)
+
+    def update_schedule(self, function_arn: str, session: Session, end_time: Optional[int]) -> bool:
+        current = self._find_schedule(session.session_id, f"{SCHEDULE_NAME_PREFIX}{session.session_id}")
+        if current is None:
+            return False
+        # Updates replace the whole schedule, we keep the start date's beat so the pushes stay on schedule
+        start_dt: datetime = current['StartDate']
+        now = datetime.now(start_dt.tzinfo) if start_dt.tzinfo is not None else datetime.utcnow()
+        minutes = self.spread_policy.calc_rate_minutes(to_minutes(session.interval_seconds))
+        params = self._build_session_params(function_arn,
+                                            session,
+                                            calc_next_start_date(start_dt, minutes, now),
+                                            end_time)
+        # A schedule cannot change groups, so it is updated where it is
+        params['GroupName'] = current['GroupName']
+        try:
+            self._call('update_schedule', ClientToken=str(uuid.uuid4()), **params)
+        except Exception as ex:
+            if is_not_found_exception(ex):
+                return False
+            raise ex
+        return True
+
+    def has_schedule(self, session_id: str) -> bool:
+        return self._find_schedule(session_id, f"{SCHEDULE_NAME_PREFIX}{session_id}") is not None
+
+    def list_session_ids(self, created_before: int,
+                         page_size: int,
+                         shard: int = 0,
+                         cursor: Optional[str] = None) -> Iterable[Page[str]]:
+        # The cursor is the scheduler's NextToken
+        while True:
+            params = {
+                'GroupName': self.get_group_name(shard),
+                'NamePrefix': SCHEDULE_NAME_PREFIX,
+                'MaxResults': page_size
+            }
+            if cursor is not None:
+                params['NextToken'] = cursor
+            page = self._call('list_schedules', **params)
+            session_ids = []
+            for schedule in page.get('Schedules', []):
+                name: str = schedule['Name']
+                # Bucket schedules may share the group if the scheduling mode was changed
+                if name.startswith(BUCKET_SCHEDULE_NAME_PREFIX):
+                    continue
+                if schedule['CreationDate'].timestamp() < created_before:
+                    session_ids.append(name[len(SCHEDULE_NAME_PREFIX)::])
+            cursor = page.get('NextToken')
+            yield Page(session_ids, cursor)
+            if cursor is None:
+                break
+
+    def calc_end_time(self, expire_time: int) -> Optional[int]:
+        # The schedule ends with the session, the last fire before that moves the end if the session was extended
+        return expire_time
+
+    def delete_schedule(self, session_id: str):
+        name = f"{SCHEDULE_NAME_PREFIX}{session_id}"
+        if self._delete(self._get_group_name_for(session_id), name):
+            return True
+        legacy_group_name = self._get_legacy_group_name_for(session_id)
+        return legacy_group_name is not None and self._delete(legacy_group_name, name)
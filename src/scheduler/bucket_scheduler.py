@@ -0,0 +1,139 @@
+import zlib
+from datetime import datetime
+from typing import Any, List, Optional, Iterable
+
+from aws.dynamodb import DynamoDb, PrimaryKeyViolationException
+from scheduler.aws_scheduler import AwsScheduler, to_minutes, BUCKET_SCHEDULE_NAME_PREFIX
+from session_repo import Session
+from utils.date_utils import get_system_time_in_seconds
+from utils.page import Page
+from utils.ttl_cache import TtlCache
+
+_TABLE_NAME = "SSKeepaliveScheduleBucket"
+
+_BUCKET_INDEX_NAME = "bucketId-index"
+
+_SESSION_ID_PROPERTY = 'sessionId'
+
+_BUCKET_ID_PROPERTY = 'bucketId'
+
+# Sessions with the same interval are spread over at most this many phases, each phase is one schedule
+_MAX_PHASES = 60
+
+# How long we trust that a bucket schedule we created or found is still there, in case it is deleted behind our back
+_KNOWN_BUCKET_TTL_SECONDS = 600
+
+# Maximum number of bucket schedules we remember
+_MAX_KNOWN_BUCKETS = 4096
+
+
+def to_bucket_id(token: str, minutes: int) -> str:
+    """
+    Sessions are put in phases by their device token, so the sessions of a device share a bucket and get one push.
+    """
+    phase = zlib.crc32(token.encode('utf-8')) % min(minutes, _MAX_PHASES)
+    return f"{minutes}-{phase}"
+
+
+def _calc_start_date(bucket_id: str) -> datetime:
+    """
+    Bucket schedules are aligned to the epoch, so the same bucket always fires at the same minutes no matter
+    which invocation created its schedule.
+    """
+    minutes, phase = map(int, bucket_id.split('-'))
+    offset = phase * minutes // min(minutes, _MAX_PHASES)
+    epoch_minute = (get_system_time_in_seconds() + 59) // 60 + 1
+    epoch_minute += (offset - epoch_minute) % minutes
+    return datetime.utcfromtimestamp(epoch_minute * 60)
+
+
+class BucketScheduler(AwsScheduler):
+    """
+    Groups sessions into buckets by interval and phase, with one schedule per bucket instead of one per session.
+
+    Bucket membership is kept in DynamoDB and the bucket invocation sends the push notifications for all of its
+    members.  A session's first keepalive can arrive up to one interval early, never late.  Bucket schedules are
+    left in place when they become empty, there are at most a few per interval.
+    """
+
+    def __init__(self, client: Any,
+                 group_name: str,
+                 role_arn: str,
+                 ddb: DynamoDb,
+                 shard_count: int = 1,
+                 previous_shard_count: int = 1,
+                 known_bucket_ttl_seconds: float = _KNOWN_BUCKET_TTL_SECONDS):
+        super().__init__(client, group_name, role_arn, shard_count=shard_count,
+                         previous_shard_count=previous_shard_count)
+        self.__ddb = ddb
+        self.__known_buckets: TtlCache[str, bool] = TtlCache(_MAX_KNOWN_BUCKETS, known_bucket_ttl_seconds)
+
+    def __ensure_bucket_schedule(self, function_arn: str, bucket_id: str):
+        if self.__known_buckets.get(bucket_id, False):
+            return
+        # A bucket schedule left in its group from before the shard count changed keeps firing, so we do not add
+        # another one
+        if self._get_legacy_group_name_for(bucket_id) is None or \
+                self._find_schedule(bucket_id, f"{BUCKET_SCHEDULE_NAME_PREFIX}{bucket_id}") is None:
+            # If it already exists we are good
+            self._create(self._build_bucket_params(function_arn, bucket_id))
+        self.__known_buckets.put(bucket_id, True)
+
+    def _get_bucket_id(self, session: Session) -> str:
+        return to_bucket_id(session.fcm_device_token, to_minutes(session.interval_seconds))
+
+    def _build_bucket_params(self, function_arn: str, bucket_id: str) -> dict:
+        minutes = int(bucket_id.split('-')[0])
+        event = {
+            'type': 'bucketKeepalive',
+            'bucketId': bucket_id
+        }
+        return self._build_params(function_arn,
+                                  self._get_group_name_for(bucket_id),
+                                  f"{BUCKET_SCHEDULE_NAME_PREFIX}{bucket_id}",
+                                  event,
+                                  minutes,
+                                  _calc_start_date(bucket_id))
+
+    def create_schedule(self, function_arn: str, session: Session) -> bool:
+        session_id = session.session_id
+        bucket_id = self._get_bucket_id(session)
+        item = {
+            _SESSION_ID_PROPERTY: session_id,
+            _BUCKET_ID_PROPERTY: bucket_id
+        }
+        try:
+            self.__ddb.put_item(_TABLE_NAME, item, [_SESSION_ID_PROPERTY])
+        except PrimaryKeyViolationException:
+            return False
+        try:
+            self.__ensure_bucket_schedule(function_arn, bucket_id)
+        except BaseException as ex:
+            self.delete_schedule(session_id)
+            raise ex
+        return True
+
+    def update_schedule(self, function_arn: str, session: Session, end_time: Optional[int]) -> bool:
+        # Bucket schedules are shared and do not end, expired members are removed when the bucket fires
+        return True
+
+    def calc_end_time(self, expire_time: int) -> Optional[int]:
+        return None
+
+    def delete_schedule(self, session_id: str) -> bool:
+        return self.__ddb.delete_item(_TABLE_NAME, {_SESSION_ID_PROPERTY: session_id})
+
+    def has_schedule(self, session_id: str) -> bool:
+        return self.__ddb.find_item(_TABLE_NAME, {_SESSION_ID_PROPERTY: session_id}, consistent=True) is not None
+
+    def list_session_ids(self, created_before: int,
+                         page_size: int,
+                         shard: int = 0,
+                         cursor: Optional[str] = None) -> Iterable[Page[str]]:
+        # The bucket invocations remove members whose sessions are gone
+        return []
+
+    def list_bucket_members(self, bucket_id: str) -> List[str]:
+        condition = (f"{_BUCKET_ID_PROPERTY} = :b", {':b': bucket_id})
+        items = self.__ddb.query(_TABLE_NAME, condition, index_name=_BUCKET_INDEX_NAME)
+        return list(map(lambda item: item[_SESSION_ID_PROPERTY], items))
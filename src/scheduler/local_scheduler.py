@@ -0,0 +1,173 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Iterable
+
+from scheduler import Scheduler, build_keepalive_event
+from session_repo import Session
+from utils import loghelper
+from utils.page import Page
+
+logger = loghelper.get_logger(__name__)
+
+# What the Lambda function gets, the timer wheel uses it as its deadline
+_INVOCATION_TIMEOUT_MILLIS = 90000
+
+_DEFAULT_WORKER_COUNT = 4
+
+
+class _LocalContext:
+    def __init__(self, function_arn: str):
+        self.invoked_function_arn = function_arn
+        self.__deadline = time.monotonic() + _INVOCATION_TIMEOUT_MILLIS / 1000
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self.__deadline - time.monotonic()) * 1000))
+
+
+class _LocalSchedule:
+    def __init__(self, function_arn: str, session: Session, end_time: Optional[int], next_fire: float):
+        self.function_arn = function_arn
+        self.event = build_keepalive_event(session)
+        self.interval_seconds = session.interval_seconds
+        self.end_time = end_time
+        self.creation_time = time.time()
+        self.next_fire = next_fire
+        # Identifies the heap entry for the next fire, entries for deleted or replaced schedules are skipped
+        self.sequence = 0
+
+
+class LocalScheduler(Scheduler):
+    """
+    Scheduler that keeps the schedules in memory, for running the whole service on one machine without EventBridge.
+
+    Schedules are kept in a min-heap ordered by their next fire time.  A dispatcher thread pops the due ones and
+    hands the same internal event an EventBridge schedule would send to the dispatch function, on a pool of workers.
+    Schedules are lost when the process exits, and any interval is supported.
+    """
+
+    def __init__(self, dispatch: Callable[[Dict[str, Any], Any], Any], worker_count: int = _DEFAULT_WORKER_COUNT):
+        self.__dispatch = dispatch
+        self.__heap: List[Tuple[float, int, str]] = []
+        self.__schedules: Dict[str, _LocalSchedule] = {}
+        self.__sequence = itertools.count(1)
+        self.__condition = threading.Condition()
+        self.__executor = ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="local-scheduler")
+        self.__thread: Optional[threading.Thread] = None
+        self.__closed = False
+
+    def __push(self, session_id: str, schedule: _LocalSchedule):
+        # Must hold the condition
+        schedule.sequence = next(self.__sequence)
+        heapq.heappush(self.__heap, (schedule.next_fire, schedule.sequence, session_id))
+        if self.__heap[0][1] == schedule.sequence:
+            self.__condition.notify()
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run, name="local-scheduler-dispatcher", daemon=True)
+            self.__thread.start()
+
+    def __next_due(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Waits for the next schedule to come due and moves it on to its next fire.
+
+        :return: the function arn and the event to dispatch, or None if we are closed.
+        """
+        with self.__condition:
+            while not self.__closed:
+                if len(self.__heap) == 0:
+                    self.__condition.wait()
+                    continue
+                fire_time, sequence, session_id = self.__heap[0]
+                delay = fire_time - time.time()
+                if delay > 0:
+                    self.__condition.wait(delay)
+                    continue
+                heapq.heappop(self.__heap)
+                schedule = self.__schedules.get(session_id)
+                if schedule is None or schedule.sequence != sequence:
+                    continue
+                if schedule.end_time is not None and fire_time > schedule.end_time:
+                    # Same as ActionAfterCompletion DELETE
+                    self.__schedules.pop(session_id)
+                    continue
+                schedule.next_fire = fire_time + schedule.interval_seconds
+                self.__push(session_id, schedule)
+                return schedule.function_arn, {'internalEvent': dict(schedule.event)}
+        return None
+
+    def __run(self):
+        while True:
+            due = self.__next_due()
+            if due is None:
+                return
+            function_arn, event = due
+            self.__executor.submit(self.__invoke, function_arn, event)
+
+    def __invoke(self, function_arn: str, event: Dict[str, Any]):
+        try:
+            self.__dispatch(event, _LocalContext(function_arn))
+        except Exception as ex:
+            logger.error(f"Dispatching {event} failed: {ex}")
+
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.__executor.shutdown(wait=True)
+
+    def create_schedule(self, function_arn: str, session: Session) -> bool:
+        with self.__condition:
+            if session.session_id in self.__schedules:
+                return False
+            schedule = _LocalSchedule(function_arn,
+                                      session,
+                                      session.schedule_end_time,
+                                      time.time() + session.interval_seconds)
+            self.__schedules[session.session_id] = schedule
+            self.__push(session.session_id, schedule)
+        return True
+
+    def update_schedule(self, function_arn: str, session: Session, end_time: Optional[int]) -> bool:
+        with self.__condition:
+            schedule = self.__schedules.get(session.session_id)
+            if schedule is None:
+                return False
+            # Keeps the next fire time, so the pushes stay on the same beat
+            schedule.function_arn = function_arn
+            schedule.event = build_keepalive_event(session)
+            schedule.end_time = end_time
+        return True
+
+    def delete_schedule(self, session_id: str) -> bool:
+        with self.__condition:
+            # The heap entry is skipped when it comes up
+            return self.__schedules.pop(session_id, None) is not None
+
+    def has_schedule(self, session_id: str) -> bool:
+        with self.__condition:
+            return session_id in self.__schedules
+
+    def list_session_ids(self, created_before: int,
+                         page_size: int,
+                         shard: int = 0,
+                         cursor: Optional[str] = None) -> Iterable[Page[str]]:
+        with self.__condition:
+            session_ids = sorted(session_id for session_id, schedule in self.__schedules.items()
+                                 if schedule.creation_time < created_before)
+        # The cursor is the last session id listed, which still works when schedules come and go in between
+        if cursor is not None:
+            session_ids = [session_id for session_id in session_ids if session_id > cursor]
+        for index in range(0, len(session_ids), page_size):
+            page = session_ids[index:index + page_size]
+            yield Page(page, page[-1] if index + page_size < len(session_ids) else None)
+
+    def is_interval_supported(self, interval_seconds: int) -> bool:
+        return True
+
+    def get_schedule_count(self) -> int:
+        with self.__condition:
+            return len(self.__schedules)
@@ -0,0 +1,88 @@
+import json
+import random
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any
+
+from request import get_required_parameter, get_parameter
+
+_FLEX_WINDOW_OFF = {"Mode": "OFF"}
+
+# The largest flexible window, as a fraction of the interval, the rate is shortened by the window
+_MAX_FLEX_WINDOW_FRACTION = 0.1
+
+
+class SpreadRule:
+    def __init__(self, max_interval_minutes: int, flex_window_minutes: int = 0, start_jitter_seconds: int = 0):
+        """
+        :param max_interval_minutes: the rule applies to intervals up to this many minutes.
+        :param flex_window_minutes: the flexible time window, fires happen at a random point within it.
+        :param start_jitter_seconds: the first fire happens up to this many seconds early.
+        """
+        assert max_interval_minutes > 0 and flex_window_minutes >= 0 and start_jitter_seconds >= 0
+        self.max_interval_minutes = max_interval_minutes
+        self.flex_window_minutes = flex_window_minutes
+        self.start_jitter_seconds = start_jitter_seconds
+
+    @classmethod
+    def from_node(cls, node: Dict[str, Any]):
+        node = dict(node)
+        rule = SpreadRule(get_required_parameter(node, 'maxIntervalMinutes', int, remove=True),
+                          get_parameter(node, 'flexWindowMinutes', int, remove=True) or 0,
+                          get_parameter(node, 'startJitterSeconds', int, remove=True) or 0)
+        if len(node) > 0:
+            raise ValueError(f"Unrecognized spread rule properties: {', '.join(node.keys())}")
+        return rule
+
+
+class SpreadPolicy:
+    """
+    Spreads the schedule fires of sessions created at the same time, so they do not invoke us in lockstep.
+
+    Sessions never go longer than their interval without a push: a flexible window of W minutes can delay a fire by
+    up to W minutes, so the rate is shortened by W, and start jitter only makes the first fire earlier.  The window is
+    capped at a tenth of the interval, so the rate is at most 10% shorter, and intervals under 10 minutes get no
+    window.
+    """
+
+    def __init__(self, rules: Optional[List[SpreadRule]] = None):
+        self.__rules = sorted(rules or [], key=lambda r: r.max_interval_minutes)
+
+    def __find_rule(self, minutes: int) -> Optional[SpreadRule]:
+        for rule in self.__rules:
+            if minutes <= rule.max_interval_minutes:
+                return rule
+        return None
+
+    def __get_flex_window_minutes(self, minutes: int) -> int:
+        rule = self.__find_rule(minutes)
+        if rule is None or rule.flex_window_minutes == 0:
+            return 0
+        return min(rule.flex_window_minutes, int(minutes * _MAX_FLEX_WINDOW_FRACTION))
+
+    def calc_rate_minutes(self, minutes: int) -> int:
+        return minutes - self.__get_flex_window_minutes(minutes)
+
+    def build_flex_window(self, minutes: int) -> Dict[str, Any]:
+        window = self.__get_flex_window_minutes(minutes)
+        if window == 0:
+            return _FLEX_WINDOW_OFF
+        return {"Mode": "FLEXIBLE", "MaximumWindowInMinutes": window}
+
+    def calc_start_date(self, now: datetime, minutes: int) -> datetime:
+        start = now + timedelta(minutes=self.calc_rate_minutes(minutes))
+        rule = self.__find_rule(minutes)
+        if rule is None or rule.start_jitter_seconds == 0:
+            return start
+        jitter = min(rule.start_jitter_seconds, minutes * 60 - 1)
+        return start - timedelta(seconds=random.uniform(0, jitter))
+
+    @classmethod
+    def from_json(cls, text: Optional[str]):
+        """
+        Builds the policy from a JSON list of rules, i.e.
+        [{"maxIntervalMinutes": 5, "startJitterSeconds": 30},
+         {"maxIntervalMinutes": 1440, "flexWindowMinutes": 5, "startJitterSeconds": 300}]
+        """
+        if text is None or len(text.strip()) == 0:
+            return SpreadPolicy()
+        return SpreadPolicy(list(map(SpreadRule.from_node, json.loads(text))))
@@ -0,0 +1,67 @@
+import zlib
+from datetime import datetime
+
+from scheduler.aws_scheduler import BUCKET_SCHEDULE_NAME_PREFIX
+from scheduler.bucket_scheduler import BucketScheduler
+from session_repo import Session
+from utils.date_utils import get_system_time_in_seconds
+
+# The sub-minute intervals we support, each one has a bucket that is invoked every minute
+WHEEL_INTERVAL_SECONDS = (5, 10, 15, 20, 30)
+
+_WHEEL_BUCKET_PREFIX = "w"
+
+
+def to_wheel_bucket_id(interval_seconds: int) -> str:
+    return f"{_WHEEL_BUCKET_PREFIX}{interval_seconds}"
+
+
+def parse_wheel_bucket_id(bucket_id: str) -> int:
+    """
+    :return: the interval in seconds for the given wheel bucket.
+    """
+    assert bucket_id.startswith(_WHEEL_BUCKET_PREFIX), f"Not a wheel bucket: {bucket_id}"
+    return int(bucket_id[len(_WHEEL_BUCKET_PREFIX):])
+
+
+def calc_offset(token: str, interval_seconds: int) -> int:
+    """
+    Sessions with the same interval are spread over the seconds of the interval by their device token, so the
+    sessions of a device fire in the same second and get one push.  Offsets are relative to the epoch, so a session
+    fires at the same seconds no matter which invocation sends its pushes.
+    """
+    return zlib.crc32(token.encode('utf-8')) % interval_seconds
+
+
+class WheelScheduler(BucketScheduler):
+    """
+    Bucket scheduler that also supports intervals under a minute.
+
+    Sessions with the same sub-minute interval share a bucket with a schedule that fires every minute.  The bucket
+    invocation runs a timer wheel for the rest of the minute, sending each member's pushes at its offsets.  A new
+    member's first keepalive can take up to a minute.
+    """
+
+    def _get_bucket_id(self, session: Session) -> str:
+        if session.interval_seconds in WHEEL_INTERVAL_SECONDS:
+            return to_wheel_bucket_id(session.interval_seconds)
+        return super()._get_bucket_id(session)
+
+    def _build_bucket_params(self, function_arn: str, bucket_id: str) -> dict:
+        if not bucket_id.startswith(_WHEEL_BUCKET_PREFIX):
+            return super()._build_bucket_params(function_arn, bucket_id)
+        event = {
+            'type': 'wheelKeepalive',
+            'bucketId': bucket_id
+        }
+        # Start at a minute boundary, each invocation covers the minute it was started in
+        start_minute = (get_system_time_in_seconds() + 59) // 60 + 1
+        return self._build_params(function_arn,
+                                  self._get_group_name_for(bucket_id),
+                                  f"{BUCKET_SCHEDULE_NAME_PREFIX}{bucket_id}",
+                                  event,
+                                  1,
+                                  datetime.utcfromtimestamp(start_minute * 60))
+
+    def is_interval_supported(self, interval_seconds: int) -> bool:
+        return interval_seconds in WHEEL_INTERVAL_SECONDS or super().is_interval_supported(interval_seconds)
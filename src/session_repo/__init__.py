@@ -1,7 +1,59 @@
 import abc
-from typing import Optional
+from typing import Optional, Tuple, List, Collection, Iterable
 
 from utils.date_utils import get_system_time_in_seconds
+from utils.page import Page
+
+# Storage formats for session records.
+# The legacy format uses the full attribute names.
+LEGACY_FORMAT = 0
+
+# The compact format uses short attribute names, except for the key and the TTL attribute (expireTime).
+COMPACT_FORMAT = 1
+
+# Same as compact, but intervalSeconds, stateCounter and lastModified are packed into a single binary attribute.
+PACKED_FORMAT = 2
+
+_FORMAT_ATTRIBUTE = 'v'
+_TOKEN_ATTRIBUTE = 't'
+_INTERVAL_ATTRIBUTE = 'i'
+_LAST_MODIFIED_ATTRIBUTE = 'm'
+_STATE_COUNTER_ATTRIBUTE = 'c'
+_PACKED_ATTRIBUTE = 'p'
+# Kept outside the packed attribute, so it can change without affecting the version condition
+_SCHEDULE_END_TIME_ATTRIBUTE = 'e'
+
+
+def _pack_numbers(values: Tuple[int, ...]) -> bytes:
+    """
+    Packs non-negative integers as unsigned LEB128 varints.
+    """
+    output = bytearray()
+    for v in values:
+        assert v >= 0
+        while True:
+            b = v & 0x7f
+            v >>= 7
+            if v == 0:
+                output.append(b)
+                break
+            output.append(b | 0x80)
+    return bytes(output)
+
+
+def _unpack_numbers(data: bytes) -> List[int]:
+    values = []
+    current = 0
+    shift = 0
+    for b in data:
+        current |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            values.append(current)
+            current = 0
+            shift = 0
+    return values
 
 
 class Session:
@@ -11,13 +63,19 @@ class Session:
                  interval_seconds: int,
                  expire_time: Optional[int] = None,
                  last_modified: Optional[int] = None,
-                 state_counter: int = 0):
+                 state_counter: int = 0,
+                 storage_format: Optional[int] = None,
+                 schedule_end_time: Optional[int] = None):
         self.session_id = session_id
         self.fcm_device_token = fcm_device_token
         self.interval_seconds = interval_seconds
         self.expire_time = expire_time
         self.last_modified = last_modified
         self.state_counter = state_counter
+        # The format the session was read in, None if it was never stored
+        self.storage_format = storage_format
+        # When the session's schedule ends (epoch seconds), None if the schedule does not end on its own
+        self.schedule_end_time = schedule_end_time
 
     def __eq__(self, other):
         return isinstance(other, Session) and \
@@ -26,35 +84,131 @@ class Session:
             self.interval_seconds == other.interval_seconds and \
             self.expire_time == other.expire_time and \
             self.last_modified == other.last_modified and \
-            self.state_counter == other.state_counter
+            self.state_counter == other.state_counter and \
+            self.schedule_end_time == other.schedule_end_time
 
-    def to_record(self):
-        return {
+    def to_record(self, storage_format: int = COMPACT_FORMAT):
+        if storage_format == LEGACY_FORMAT:
+            record = {
+                'sessionId': self.session_id,
+                'fcmDeviceToken': self.fcm_device_token,
+                'intervalSeconds': self.interval_seconds,
+                'expireTime': self.expire_time,
+                'lastModified': self.last_modified,
+                'stateCounter': self.state_counter
+            }
+            if self.schedule_end_time is not None:
+                record['scheduleEndTime'] = self.schedule_end_time
+            return record
+        record = {
             'sessionId': self.session_id,
-            'fcmDeviceToken': self.fcm_device_token,
-            'intervalSeconds': self.interval_seconds,
-            'expireTime': self.expire_time,
-            'lastModified': self.last_modified,
-            'stateCounter': self.state_counter
+            _FORMAT_ATTRIBUTE: storage_format,
+            _TOKEN_ATTRIBUTE: self.fcm_device_token,
+            'expireTime': self.expire_time
         }
+        if storage_format == PACKED_FORMAT:
+            record[_PACKED_ATTRIBUTE] = self.pack_numbers()
+        else:
+            assert storage_format == COMPACT_FORMAT, f"Unsupported storage format: {storage_format}"
+            record[_INTERVAL_ATTRIBUTE] = self.interval_seconds
+            record[_LAST_MODIFIED_ATTRIBUTE] = self.last_modified
+            record[_STATE_COUNTER_ATTRIBUTE] = self.state_counter
+        if self.schedule_end_time is not None:
+            record[_SCHEDULE_END_TIME_ATTRIBUTE] = self.schedule_end_time
+        return record
+
+    def pack_numbers(self) -> bytes:
+        return _pack_numbers((self.interval_seconds, self.state_counter, self.last_modified or 0))
 
     @classmethod
     def from_record(cls, record: dict):
+        storage_format = record.get(_FORMAT_ATTRIBUTE, LEGACY_FORMAT)
+        if storage_format == LEGACY_FORMAT:
+            return Session(
+                record['sessionId'],
+                record['fcmDeviceToken'],
+                record['intervalSeconds'],
+                record['expireTime'],
+                record['lastModified'],
+                record['stateCounter'],
+                storage_format=LEGACY_FORMAT,
+                schedule_end_time=record.get('scheduleEndTime')
+            )
+        if storage_format == PACKED_FORMAT:
+            interval, state_counter, last_modified = _unpack_numbers(record[_PACKED_ATTRIBUTE])
+        else:
+            interval = record[_INTERVAL_ATTRIBUTE]
+            state_counter = record[_STATE_COUNTER_ATTRIBUTE]
+            last_modified = record[_LAST_MODIFIED_ATTRIBUTE]
         return Session(
             record['sessionId'],
-            record['fcmDeviceToken'],
-            record['intervalSeconds'],
+            record[_TOKEN_ATTRIBUTE],
+            interval,
             record['expireTime'],
-            record['lastModified'],
-            record['stateCounter']
+            last_modified,
+            state_counter,
+            storage_format=storage_format,
+            schedule_end_time=record.get(_SCHEDULE_END_TIME_ATTRIBUTE)
         )
 
+    def get_version_condition(self) -> dict:
+        """
+        Builds the condition that verifies the stored record has not changed since this session was read.
+
+        :return: the condition, in the format of the session's storage format.
+        """
+        if self.storage_format == LEGACY_FORMAT:
+            return {'stateCounter': self.state_counter}
+        if self.storage_format == PACKED_FORMAT:
+            return {_PACKED_ATTRIBUTE: self.pack_numbers()}
+        return {_STATE_COUNTER_ATTRIBUTE: self.state_counter}
+
     def is_expired(self) -> bool:
         return get_system_time_in_seconds() >= self.expire_time
 
 
+class UnitOfWork(metaclass=abc.ABCMeta):
+    """
+    Buffers the session writes made by the current thread until commit() is called.
+
+    Reads of the same session are only made once.  Leaving the with-block without committing discards the
+    buffered writes.
+    """
+
+    @abc.abstractmethod
+    def commit(self) -> bool:
+        """
+        Writes the buffered changes.
+
+        :return: False if the changes were rejected because a session was created or modified by someone else.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def discard(self):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def is_active(self) -> bool:
+        raise NotImplementedError()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.is_active():
+            self.discard()
+
+
 class SessionRepo(metaclass=abc.ABCMeta):
 
+    @abc.abstractmethod
+    def begin_unit_of_work(self) -> UnitOfWork:
+        """
+        Starts a unit of work for the current thread, the other methods take part in it until it ends.
+        """
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def create_session(self, session: Session, ttl_seconds: int) -> bool:
         raise NotImplementedError()
@@ -67,6 +221,45 @@ class SessionRepo(metaclass=abc.ABCMeta):
     def find_session(self, session_id: str) -> Optional[Session]:
         raise NotImplementedError()
 
+    def find_sessions(self, session_ids: Collection[str]) -> List[Session]:
+        """
+        Finds several sessions at once.
+
+        :param session_ids: the session ids.
+        :return: the sessions that were found, in no particular order.
+        """
+        return list(filter(lambda s: s is not None, map(self.find_session, session_ids)))
+
     @abc.abstractmethod
     def delete_session(self, session_id: str) -> bool:
         raise NotImplementedError()
+
+    @abc.abstractmethod
+    def scan_expired_session_ids(self,
+                                 expired_before: int,
+                                 page_size: int,
+                                 cursor: Optional[str] = None) -> Iterable[Page[str]]:
+        """
+        Finds sessions that have expired but have not been removed yet, one page at a time.
+
+        :param expired_before: only sessions that expired before this time (epoch seconds) are returned.
+        :param page_size: the maximum number of sessions to look at per page.
+        :param cursor: the cursor of a page to resume after, None to start at the beginning.
+        :return: the pages of session ids, which can be empty when none of the sessions looked at expired.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def delete_sessions(self, session_ids: Collection[str]):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def scan_sessions(self, page_size: int, cursor: Optional[str] = None) -> Iterable[Page[Session]]:
+        """
+        Reads all the sessions, one page at a time, so callers only hold one page in memory.
+
+        :param page_size: the maximum number of sessions per page.
+        :param cursor: the cursor of a page to resume after, None to start at the beginning.
+        :return: the pages of sessions.
+        """
+        raise NotImplementedError()
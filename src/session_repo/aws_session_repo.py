@@ -1,54 +1,146 @@
-from typing import Optional, Any
+import threading
+from copy import copy
+from typing import Optional, Any, List, Collection, Iterable
 
 from aws.dynamodb import DynamoDb, PrimaryKeyViolationException, PreconditionFailedException
-from session_repo import SessionRepo, Session
-from datetime import datetime
+from aws.unit_of_work import DynamoDbUnitOfWork
+from session_repo import SessionRepo, Session, COMPACT_FORMAT, UnitOfWork
 
 from utils import date_utils
 from utils.date_utils import get_system_time_in_millis
+from utils.page import Page
 
 _SESSION_ID_PROPERTY = 'sessionId'
 
 _TABLE_NAME = "SSKeepaliveSession"
 
 
+def _to_keys(session_id: str) -> dict:
+    return {_SESSION_ID_PROPERTY: session_id}
+
+
+class _AwsUnitOfWork(UnitOfWork):
+    def __init__(self, ddb: DynamoDb, thread_local: threading.local):
+        self.work = DynamoDbUnitOfWork(ddb)
+        self.__thread_local = thread_local
+        thread_local.unit_of_work = self
+
+    def __end(self):
+        if self.is_active():
+            self.__thread_local.unit_of_work = None
+
+    def commit(self) -> bool:
+        self.__end()
+        return self.work.commit()
+
+    def discard(self):
+        self.__end()
+        self.work.discard()
+
+    def is_active(self) -> bool:
+        return getattr(self.__thread_local, 'unit_of_work', None) is self
+
+
 class AwsSessionRepo(SessionRepo):
-    def __init__(self, client: Any):
+    def __init__(self, client: Any, storage_format: int = COMPACT_FORMAT):
         self.__ddb = DynamoDb(client)
+        self.__storage_format = storage_format
+        self.__thread_local = threading.local()
+
+    def __get_work(self) -> Optional[DynamoDbUnitOfWork]:
+        current: Optional[_AwsUnitOfWork] = getattr(self.__thread_local, 'unit_of_work', None)
+        return current.work if current is not None else None
+
+    def begin_unit_of_work(self) -> UnitOfWork:
+        assert self.__get_work() is None, "A unit of work is already active"
+        return _AwsUnitOfWork(self.__ddb, self.__thread_local)
+
+    def __to_item(self, session: Session) -> dict:
+        return session.to_record(self.__storage_format)
 
     def create_session(self, session: Session, ttl_seconds: int) -> bool:
-        item = session.to_record()
-        lm = item.get('lastModified')
-        if lm is None:
-            item['lastModified'] = get_system_time_in_millis()
-        et = item.get('expireTime')
-        if et is None:
-            item['expireTime'] = date_utils.calc_expire_time_in_epoch_seconds(ttl_seconds)
+        if session.last_modified is None:
+            session.last_modified = get_system_time_in_millis()
+        if session.expire_time is None:
+            session.expire_time = date_utils.calc_expire_time_in_epoch_seconds(ttl_seconds)
+        item = self.__to_item(session)
 
+        work = self.__get_work()
+        if work is not None:
+            # Any conflict is reported when the unit of work is committed
+            work.put_item(_TABLE_NAME, _to_keys(session.session_id), item, [_SESSION_ID_PROPERTY])
+            return True
         try:
             self.__ddb.put_item(_TABLE_NAME, item, [_SESSION_ID_PROPERTY])
         except PrimaryKeyViolationException:
             return False
+        session.storage_format = self.__storage_format
         return True
 
     def extend_session(self, session: Session, seconds_in_future: int) -> bool:
+        # We rewrite the whole record, which also migrates records stored in an older format
+        updated = copy(session)
+        updated.state_counter = session.state_counter + 1
+        updated.expire_time = date_utils.calc_expire_time_in_epoch_seconds(seconds_in_future)
+        updated.last_modified = get_system_time_in_millis()
+        work = self.__get_work()
+        if work is not None:
+            work.put_item(_TABLE_NAME, _to_keys(session.session_id), self.__to_item(updated),
+                          condition=session.get_version_condition())
+            return True
         try:
-            expire_at = date_utils.calc_expire_time_in_epoch_seconds(seconds_in_future)
-            state_counter = session.state_counter + 1
-            self.__ddb.update_item(_TABLE_NAME, keys={_SESSION_ID_PROPERTY: session.session_id},
-                                   item={
-                                       'stateCounter': state_counter,
-                                       'expireTime': expire_at,
-                                       'lastModified': get_system_time_in_millis()
-                                   },
-                                   condition={'stateCounter': session.state_counter})
+            self.__ddb.put_item(_TABLE_NAME,
+                                self.__to_item(updated),
+                                condition=session.get_version_condition())
             return True
         except PreconditionFailedException:
             return False
 
     def find_session(self, session_id: str) -> Optional[Session]:
-        item = self.__ddb.find_item(_TABLE_NAME, {_SESSION_ID_PROPERTY: session_id}, consistent=True)
+        work = self.__get_work()
+        if work is not None:
+            item = work.find_item(_TABLE_NAME, _to_keys(session_id))
+        else:
+            item = self.__ddb.find_item(_TABLE_NAME, _to_keys(session_id), consistent=True)
         return Session.from_record(item) if item is not None else None
 
+    def find_sessions(self, session_ids: Collection[str]) -> List[Session]:
+        items = self.__ddb.batch_get_items(_TABLE_NAME, list(map(_to_keys, session_ids)), consistent=True)
+        return list(map(Session.from_record, items))
+
     def delete_session(self, session_id: str) -> bool:
-        return self.__ddb.delete_item(_TABLE_NAME, keys={_SESSION_ID_PROPERTY: session_id})
+        work = self.__get_work()
+        if work is not None:
+            if work.find_item(_TABLE_NAME, _to_keys(session_id)) is None:
+                return False
+            work.delete_item(_TABLE_NAME, _to_keys(session_id))
+            return True
+        return self.__ddb.delete_item(_TABLE_NAME, keys=_to_keys(session_id))
+
+    def scan_expired_session_ids(self,
+                                 expired_before: int,
+                                 page_size: int,
+                                 cursor: Optional[str] = None) -> Iterable[Page[str]]:
+        # No index, an index on the expire time would be written by every create and extend.  The cursor is the
+        # session id of the last key evaluated.
+        condition = ("expireTime < :t", {':t': expired_before})
+        start_key = _to_keys(cursor) if cursor is not None else None
+        while True:
+            items, start_key = self.__ddb.scan_page(_TABLE_NAME, page_size, start_key, condition)
+            yield Page(list(map(lambda item: item[_SESSION_ID_PROPERTY], items)),
+                       start_key[_SESSION_ID_PROPERTY] if start_key is not None else None)
+            if start_key is None:
+                break
+
+    def delete_sessions(self, session_ids: Collection[str]):
+        self.__ddb.delete_items(_TABLE_NAME, list(map(_to_keys, session_ids)))
+
+    def scan_sessions(self, page_size: int, cursor: Optional[str] = None) -> Iterable[Page[Session]]:
+        # The cursor is the session id of the last key evaluated
+        start_key = _to_keys(cursor) if cursor is not None else None
+        while True:
+            items, start_key = self.__ddb.scan_page(_TABLE_NAME, page_size, start_key)
+            yield Page(list(map(Session.from_record, items)),
+                       start_key[_SESSION_ID_PROPERTY] if start_key is not None else None)
+            if start_key is None:
+                break
@@ -0,0 +1,263 @@
+import sqlite3
+import threading
+from copy import copy
+from typing import Optional, List, Collection, Dict, Callable, Iterable
+
+from session_repo import SessionRepo, Session, UnitOfWork
+from utils import date_utils
+from utils.date_utils import get_system_time_in_millis
+from utils.page import Page
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS session (
+    session_id       TEXT PRIMARY KEY,
+    fcm_device_token TEXT    NOT NULL,
+    interval_seconds INTEGER NOT NULL,
+    expire_time      INTEGER NOT NULL,
+    last_modified    INTEGER NOT NULL,
+    state_counter    INTEGER NOT NULL,
+    schedule_end_time INTEGER
+) WITHOUT ROWID
+"""
+
+# For databases created before the schedule end time was stored
+_ADD_SCHEDULE_END_TIME = "ALTER TABLE session ADD COLUMN schedule_end_time INTEGER"
+
+_CREATE_EXPIRE_TIME_INDEX = "CREATE INDEX IF NOT EXISTS session_expire_time ON session (expire_time)"
+
+# The statements below are compiled once per connection and reused from the connection's statement cache
+_INSERT = ("INSERT INTO session (session_id, fcm_device_token, interval_seconds, expire_time, last_modified, "
+           "state_counter, schedule_end_time) VALUES (?, ?, ?, ?, ?, ?, ?)")
+
+_EXTEND = ("UPDATE session SET state_counter = state_counter + 1, expire_time = ?, last_modified = ?, "
+           "schedule_end_time = ? WHERE session_id = ? AND state_counter = ?")
+
+_SELECT = ("SELECT session_id, fcm_device_token, interval_seconds, expire_time, last_modified, state_counter, "
+           "schedule_end_time FROM session WHERE session_id = ?")
+
+_DELETE = "DELETE FROM session WHERE session_id = ?"
+
+_SELECT_EXPIRED_PAGE = ("SELECT session_id FROM session WHERE session_id > ? AND expire_time < ? "
+                        "ORDER BY session_id LIMIT ?")
+
+_SELECT_PAGE = ("SELECT session_id, fcm_device_token, interval_seconds, expire_time, last_modified, state_counter, "
+                "schedule_end_time FROM session WHERE session_id > ? ORDER BY session_id LIMIT ?")
+
+_BUSY_TIMEOUT_SECONDS = 30
+
+
+def _to_session(row: tuple) -> Session:
+    return Session(row[0], row[1], row[2], row[3], row[4], row[5], schedule_end_time=row[6])
+
+
+class _Write:
+    def __init__(self, statement: str, params: tuple, must_change: bool):
+        self.statement = statement
+        self.params = params
+        # When True, the statement has to change a row or the unit of work fails
+        self.must_change = must_change
+
+
+class _SqliteUnitOfWork(UnitOfWork):
+    def __init__(self, connection_provider: Callable[[], sqlite3.Connection], thread_local: threading.local):
+        self.__connection_provider = connection_provider
+        self.__thread_local = thread_local
+        self.reads: Dict[str, Optional[Session]] = {}
+        self.writes: Dict[str, _Write] = {}
+        thread_local.unit_of_work = self
+
+    def add_write(self, session_id: str, write: _Write):
+        if session_id in self.writes:
+            raise ValueError(f"Session {session_id} is already being written in this unit of work.")
+        self.writes[session_id] = write
+
+    def __end(self):
+        if self.is_active():
+            self.__thread_local.unit_of_work = None
+
+    def commit(self) -> bool:
+        self.__end()
+        writes = list(self.writes.values())
+        self.discard()
+        if len(writes) == 0:
+            return True
+        conn = self.__connection_provider()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for write in writes:
+                cursor = conn.execute(write.statement, write.params)
+                if write.must_change and cursor.rowcount != 1:
+                    conn.execute("ROLLBACK")
+                    return False
+        except sqlite3.IntegrityError:
+            conn.execute("ROLLBACK")
+            return False
+        except BaseException as ex:
+            conn.execute("ROLLBACK")
+            raise ex
+        conn.execute("COMMIT")
+        return True
+
+    def discard(self):
+        self.__end()
+        self.reads.clear()
+        self.writes.clear()
+
+    def is_active(self) -> bool:
+        return getattr(self.__thread_local, 'unit_of_work', None) is self
+
+
+class SqliteSessionRepo(SessionRepo):
+    """
+    Session repo that uses a local SQLite database, for running the service on a single machine.
+
+    Each thread gets its own connection, the database uses write-ahead logging so readers do not block the writer.
+    """
+
+    def __init__(self, path: str):
+        assert path != ":memory:", "An in-memory database cannot be shared between connections"
+        self.__path = path
+        self.__thread_local = threading.local()
+        self.__connections: List[sqlite3.Connection] = []
+        self.__mutex = threading.Lock()
+        self.__work_local = threading.local()
+        conn = self.__get_connection()
+        conn.execute(_CREATE_TABLE)
+        columns = list(map(lambda row: row[1], conn.execute("PRAGMA table_info(session)").fetchall()))
+        if 'schedule_end_time' not in columns:
+            conn.execute(_ADD_SCHEDULE_END_TIME)
+        conn.execute(_CREATE_EXPIRE_TIME_INDEX)
+
+    def __get_connection(self) -> sqlite3.Connection:
+        conn = getattr(self.__thread_local, 'connection', None)
+        if conn is None:
+            # isolation_level=None puts the connection in autocommit mode, each statement is its own transaction
+            conn = sqlite3.connect(self.__path,
+                                   timeout=_BUSY_TIMEOUT_SECONDS,
+                                   isolation_level=None,
+                                   check_same_thread=False,
+                                   cached_statements=32)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.__thread_local.connection = conn
+            with self.__mutex:
+                self.__connections.append(conn)
+        return conn
+
+    def close(self):
+        with self.__mutex:
+            for conn in self.__connections:
+                conn.close()
+            self.__connections.clear()
+        self.__thread_local = threading.local()
+
+    def __get_work(self) -> Optional[_SqliteUnitOfWork]:
+        return getattr(self.__work_local, 'unit_of_work', None)
+
+    def begin_unit_of_work(self) -> UnitOfWork:
+        assert self.__get_work() is None, "A unit of work is already active"
+        return _SqliteUnitOfWork(self.__get_connection, self.__work_local)
+
+    def create_session(self, session: Session, ttl_seconds: int) -> bool:
+        if session.last_modified is None:
+            session.last_modified = get_system_time_in_millis()
+        if session.expire_time is None:
+            session.expire_time = date_utils.calc_expire_time_in_epoch_seconds(ttl_seconds)
+        params = (session.session_id,
+                  session.fcm_device_token,
+                  session.interval_seconds,
+                  session.expire_time,
+                  session.last_modified,
+                  session.state_counter,
+                  session.schedule_end_time)
+        work = self.__get_work()
+        if work is not None:
+            work.add_write(session.session_id, _Write(_INSERT, params, True))
+            work.reads[session.session_id] = copy(session)
+            return True
+        try:
+            self.__get_connection().execute(_INSERT, params)
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def extend_session(self, session: Session, seconds_in_future: int) -> bool:
+        expire_at = date_utils.calc_expire_time_in_epoch_seconds(seconds_in_future)
+        last_modified = get_system_time_in_millis()
+        params = (expire_at, last_modified, session.schedule_end_time, session.session_id, session.state_counter)
+        work = self.__get_work()
+        if work is not None:
+            work.add_write(session.session_id, _Write(_EXTEND, params, True))
+            extended = copy(session)
+            extended.expire_time = expire_at
+            extended.last_modified = last_modified
+            extended.state_counter += 1
+            work.reads[session.session_id] = extended
+            return True
+        cursor = self.__get_connection().execute(_EXTEND, params)
+        return cursor.rowcount == 1
+
+    def __select_session(self, session_id: str) -> Optional[Session]:
+        row = self.__get_connection().execute(_SELECT, (session_id,)).fetchone()
+        return _to_session(row) if row is not None else None
+
+    def find_session(self, session_id: str) -> Optional[Session]:
+        work = self.__get_work()
+        if work is None:
+            return self.__select_session(session_id)
+        if session_id not in work.reads:
+            work.reads[session_id] = self.__select_session(session_id)
+        session = work.reads[session_id]
+        return copy(session) if session is not None else None
+
+    def delete_session(self, session_id: str) -> bool:
+        work = self.__get_work()
+        if work is None:
+            cursor = self.__get_connection().execute(_DELETE, (session_id,))
+            return cursor.rowcount > 0
+        if self.find_session(session_id) is None:
+            return False
+        work.reads[session_id] = None
+        pending = work.writes.get(session_id)
+        if pending is not None and pending.statement == _INSERT:
+            # Deleting a session we are creating, so there is nothing to write
+            work.writes.pop(session_id)
+        else:
+            work.add_write(session_id, _Write(_DELETE, (session_id,), False))
+        return True
+
+    def scan_expired_session_ids(self,
+                                 expired_before: int,
+                                 page_size: int,
+                                 cursor: Optional[str] = None) -> Iterable[Page[str]]:
+        last_session_id = cursor or ""
+        while True:
+            rows = self.__get_connection().execute(_SELECT_EXPIRED_PAGE,
+                                                   (last_session_id, expired_before, page_size)).fetchall()
+            if len(rows) == 0:
+                break
+            last_session_id = rows[-1][0]
+            yield Page(list(map(lambda row: row[0], rows)), last_session_id if len(rows) == page_size else None)
+            if len(rows) < page_size:
+                break
+
+    def delete_sessions(self, session_ids: Collection[str]):
+        conn = self.__get_connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(_DELETE, map(lambda session_id: (session_id,), session_ids))
+            conn.execute("COMMIT")
+        except BaseException as ex:
+            conn.execute("ROLLBACK")
+            raise ex
+
+    def scan_sessions(self, page_size: int, cursor: Optional[str] = None) -> Iterable[Page[Session]]:
+        last_session_id = cursor or ""
+        while True:
+            rows = self.__get_connection().execute(_SELECT_PAGE, (last_session_id, page_size)).fetchall()
+            if len(rows) == 0:
+                break
+            last_session_id = rows[-1][0]
+            yield Page(list(map(_to_session, rows)), last_session_id if len(rows) == page_size else None)
+            if len(rows) < page_size:
+                break
@@ -0,0 +1,91 @@
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenException(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"Circuit {name} is open.")
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a dependency that keeps failing, so callers fail fast instead of waiting on it.
+
+    The circuit opens after so many failures in a row.  Once it has been open for a while one call is let through
+    as a probe (half-open), if it succeeds the circuit closes again, otherwise it stays open for another while.  A
+    probe whose outcome is not recorded within the open time is given up on, and another one is let through.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, open_seconds: float = 30.0):
+        assert failure_threshold > 0
+        self.name = name
+        self.__failure_threshold = failure_threshold
+        self.__open_seconds = open_seconds
+        self.__mutex = threading.Lock()
+        self.__state = CLOSED
+        self.__failures = 0
+        self.__opened_at = 0.0
+        self.__probing = False
+        self.__probe_started_at = 0.0
+        self.__rejected = 0
+
+    def get_state(self) -> str:
+        with self.__mutex:
+            return self.__state
+
+    def allow_request(self) -> bool:
+        """
+        :return: True if the call can be made, in which case its outcome has to be recorded.
+        """
+        with self.__mutex:
+            if self.__state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.__state == OPEN and now - self.__opened_at >= self.__open_seconds:
+                self.__state = HALF_OPEN
+                self.__probing = False
+            if self.__state == HALF_OPEN and (not self.__probing or
+                                              now - self.__probe_started_at >= self.__open_seconds):
+                self.__probing = True
+                self.__probe_started_at = now
+                return True
+            self.__rejected += 1
+            return False
+
+    def record_success(self) -> int:
+        """
+        :return: the number of calls rejected while the circuit was open, if this closed it, otherwise 0.
+        """
+        with self.__mutex:
+            self.__failures = 0
+            if self.__state == CLOSED:
+                return 0
+            self.__state = CLOSED
+            self.__probing = False
+            rejected = self.__rejected
+            self.__rejected = 0
+            return rejected
+
+    def record_failure(self) -> bool:
+        """
+        :return: True if this failure opened a closed circuit.
+        """
+        with self.__mutex:
+            if self.__state == HALF_OPEN:
+                # The probe failed
+                self.__state = OPEN
+                self.__opened_at = time.monotonic()
+                self.__probing = False
+                return False
+            if self.__state == OPEN:
+                return False
+            self.__failures += 1
+            if self.__failures < self.__failure_threshold:
+                return False
+            self.__state = OPEN
+            self.__opened_at = time.monotonic()
+            return True
@@ -0,0 +1,71 @@
+import threading
+import time
+from typing import Any, Callable, TypeVar
+
+# Used when we are not invoked with a Lambda context, for example when running locally
+_DEFAULT_REMAINING_SECONDS = 60.0
+
+# Retries have to be done this long before the invocation times out
+_RETRY_MARGIN_SECONDS = 2.0
+
+T = TypeVar('T')
+
+_local = threading.local()
+
+
+class Deadline:
+    """
+    The point in time by which the current invocation has to be done.
+    """
+
+    def __init__(self, remaining_seconds: float):
+        self.__end = time.monotonic() + remaining_seconds
+
+    def get_remaining_seconds(self) -> float:
+        return max(0.0, self.__end - time.monotonic())
+
+    def has_expired(self) -> bool:
+        return self.get_remaining_seconds() == 0.0
+
+
+def start_invocation(context: Any):
+    """
+    Sets the deadline for the invocation being handled by the current thread.
+
+    :param context: the Lambda context, the deadline is taken from its remaining time.
+    """
+    get_remaining_time = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining_time is not None:
+        remaining = get_remaining_time() / 1000
+    else:
+        remaining = _DEFAULT_REMAINING_SECONDS
+    _local.deadline = Deadline(remaining)
+
+
+def get_deadline() -> Deadline:
+    deadline = getattr(_local, 'deadline', None)
+    return deadline if deadline is not None else Deadline(_DEFAULT_REMAINING_SECONDS)
+
+
+def bind(function: Callable[..., T]) -> Callable[..., T]:
+    """
+    Binds a function to the current thread's deadline, so it runs under it when handed to another thread.
+    """
+    deadline = get_deadline()
+
+    def run(*args, **kwargs) -> T:
+        previous = getattr(_local, 'deadline', None)
+        _local.deadline = deadline
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.deadline = previous
+
+    return run
+
+
+def calc_max_retry_seconds() -> float:
+    """
+    :return: how long retries can go on for, given the time the current invocation has left.
+    """
+    return max(0.0, get_deadline().get_remaining_seconds() - _RETRY_MARGIN_SECONDS)
@@ -65,8 +65,10 @@ class HttpRequest:
         self.headers = headers
         self.body = body
 
-    def _send(self, session: Session) -> Response:
+    def _send(self, session: Session, timeout: Optional[float] = None) -> Response:
         params = {}
+        if timeout is not None:
+            params['timeout'] = timeout
         if self.headers is not None and len(self.headers) > 0:
             params['headers'] = self.headers
         if self.body is not None:
@@ -121,11 +123,15 @@ def _create_session():
 
 
 class HttpClient:
-    def __init__(self):
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        :param timeout: optional timeout in seconds for connecting and for each read, no timeout if not given.
+        """
         self.__session = _create_session()
+        self.__timeout = timeout
 
     def exchange(self, req: HttpRequest) -> HttpResponse:
-        r = req._send(self.__session)
+        r = req._send(self.__session, self.__timeout)
         _examine(r)
         return HttpResponse(r)
 
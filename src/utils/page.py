@@ -0,0 +1,17 @@
+from typing import Generic, TypeVar, List, Optional
+
+T = TypeVar('T')
+
+
+class Page(Generic[T]):
+    """
+    One page of a listing, with the cursor to resume the listing after it.
+    """
+
+    def __init__(self, items: List[T], cursor: Optional[str]):
+        """
+        :param items: the items in the page.
+        :param cursor: passed back to resume after this page, None if this is the last page.
+        """
+        self.items = items
+        self.cursor = cursor
@@ -0,0 +1,147 @@
+import random
+import threading
+import time
+from typing import Callable, TypeVar, Dict, Optional, Any
+
+from utils import loghelper
+
+logger = loghelper.get_logger(__name__)
+
+T = TypeVar('T')
+
+
+class RetryPolicy:
+    def __init__(self,
+                 max_attempts: int = 6,
+                 base_delay_seconds: float = 0.05,
+                 max_delay_seconds: float = 2.0,
+                 deadline_seconds: float = 10.0):
+        """
+        :param max_attempts: the maximum number of attempts, including the first one.
+        :param base_delay_seconds: the delay before the first retry, it doubles for each retry after that.
+        :param max_delay_seconds: the maximum delay between attempts.
+        :param deadline_seconds: no retry is attempted if it would start after this much time has passed.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.deadline_seconds = deadline_seconds
+
+    def calc_delay(self, attempt: int) -> float:
+        # Full jitter, so callers that were throttled together do not come back together
+        return random.uniform(0, min(self.base_delay_seconds * (2 ** attempt), self.max_delay_seconds))
+
+
+class RetryMetrics:
+    """
+    Counts the retries for an operation, safe to share between threads.
+    """
+
+    def __init__(self):
+        self.__mutex = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.exhausted = 0
+        self.retries_by_error: Dict[str, int] = {}
+        self.__reported: Dict[str, Any] = self.__to_dict()
+
+    def record_call(self):
+        with self.__mutex:
+            self.calls += 1
+
+    def record_retry(self, error_code: str):
+        with self.__mutex:
+            self.retries += 1
+            self.retries_by_error[error_code] = self.retries_by_error.get(error_code, 0) + 1
+
+    def record_exhausted(self):
+        with self.__mutex:
+            self.exhausted += 1
+
+    def __to_dict(self) -> Dict[str, Any]:
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'exhausted': self.exhausted,
+            'retriesByError': dict(self.retries_by_error)
+        }
+
+    def to_dict(self) -> dict:
+        with self.__mutex:
+            return self.__to_dict()
+
+    def take_delta(self) -> dict:
+        """
+        :return: the counts recorded since the previous call, so each invocation can report its own.
+        """
+        with self.__mutex:
+            current = self.__to_dict()
+            reported = self.__reported
+            self.__reported = current
+        by_error = {}
+        for code, count in current['retriesByError'].items():
+            if count > reported['retriesByError'].get(code, 0):
+                by_error[code] = count - reported['retriesByError'].get(code, 0)
+        return {
+            'calls': current['calls'] - reported['calls'],
+            'retries': current['retries'] - reported['retries'],
+            'exhausted': current['exhausted'] - reported['exhausted'],
+            'retriesByError': by_error
+        }
+
+
+def _get_error_code(ex: Exception) -> str:
+    response = getattr(ex, 'response', None)
+    if type(response) is dict:
+        code = response.get('Error', {}).get('Code')
+        if code is not None:
+            return code
+    return ex.__class__.__name__
+
+
+def call_with_retry(function_to_call: Callable[[], T],
+                    is_retryable: Callable[[Exception], bool],
+                    policy: RetryPolicy,
+                    metrics: Optional[RetryMetrics] = None,
+                    operation_name: str = "call",
+                    get_retry_after: Optional[Callable[[Exception], Optional[float]]] = None,
+                    max_seconds: Optional[float] = None) -> T:
+    """
+    Calls the given function, retrying with exponential backoff while it raises retryable errors.
+
+    :param function_to_call: the function to call.
+    :param is_retryable: decides whether an error is retryable.
+    :param policy: the retry policy.
+    :param metrics: optional metrics to record the retries in.
+    :param operation_name: used for logging.
+    :param get_retry_after: optionally gets the seconds the server asked us to wait from an error, we never retry
+    sooner than that.
+    :param max_seconds: optionally shortens the policy's deadline, for example to the time the invocation has left.
+    :return: the result of the function.
+    """
+    deadline_seconds = policy.deadline_seconds if max_seconds is None else min(policy.deadline_seconds, max_seconds)
+    deadline = time.monotonic() + deadline_seconds
+    attempt = 0
+    if metrics is not None:
+        metrics.record_call()
+    while True:
+        try:
+            return function_to_call()
+        except Exception as ex:
+            if not is_retryable(ex):
+                raise ex
+            attempt += 1
+            delay = policy.calc_delay(attempt - 1)
+            retry_after = get_retry_after(ex) if get_retry_after is not None else None
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if attempt >= policy.max_attempts or time.monotonic() + delay > deadline:
+                if metrics is not None:
+                    metrics.record_exhausted()
+                logger.error(f"Giving up on {operation_name} after {attempt} attempt(s): {ex}")
+                raise ex
+            error_code = _get_error_code(ex)
+            if metrics is not None:
+                metrics.record_retry(error_code)
+            logger.info(f"Retrying {operation_name} after {error_code}, attempt {attempt} ...")
+        time.sleep(delay)
@@ -0,0 +1,57 @@
+from typing import Generic, TypeVar, List, Tuple
+
+T = TypeVar('T')
+
+
+class TimerWheel(Generic[T]):
+    """
+    Hashed timer wheel with one slot per tick.
+
+    A timer goes in the slot for its tick modulo the number of slots, so scheduling and expiring are O(1) per timer.
+    Timers more than one revolution out share a slot with nearer ones and are kept until their own tick comes around.
+    """
+
+    def __init__(self, start_tick: int, slot_count: int = 64):
+        assert slot_count > 0
+        self.__slots: List[List[Tuple[int, T]]] = [[] for _ in range(slot_count)]
+        self.__current_tick = start_tick
+        self.__size = 0
+
+    def get_current_tick(self) -> int:
+        return self.__current_tick
+
+    def schedule(self, tick: int, item: T):
+        """
+        Schedules an item to expire at the given tick.
+
+        :param tick: the tick, which cannot be before the current tick.
+        :param item: the item.
+        """
+        if tick < self.__current_tick:
+            raise ValueError(f"Tick {tick} is before the current tick {self.__current_tick}.")
+        self.__slots[tick % len(self.__slots)].append((tick, item))
+        self.__size += 1
+
+    def advance(self) -> List[T]:
+        """
+        Expires the current tick and moves on to the next one.
+
+        :return: the items scheduled for the tick that was current, in the order they were scheduled.
+        """
+        index = self.__current_tick % len(self.__slots)
+        slot = self.__slots[index]
+        due = []
+        if len(slot) > 0:
+            pending = []
+            for tick, item in slot:
+                if tick == self.__current_tick:
+                    due.append(item)
+                else:
+                    pending.append((tick, item))
+            self.__slots[index] = pending
+            self.__size -= len(due)
+        self.__current_tick += 1
+        return due
+
+    def __len__(self) -> int:
+        return self.__size
@@ -0,0 +1,86 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from utils import loghelper, exception_utils
+
+logger = loghelper.get_logger(__name__)
+
+
+class AccessToken:
+    def __init__(self, token: str, expires_at: float):
+        self.token = token
+        # Epoch seconds
+        self.expires_at = expires_at
+
+
+class TokenRefresher:
+    """
+    Caches an access token and gets a new one shortly before it expires.
+
+    While the current token is valid callers never wait, once it gets within the refresh margin of expiring a
+    background thread gets the new one.  Callers only wait when there is no valid token at all.  Only one refresh
+    runs at a time, callers that need a token while it runs wait for the same result.
+    """
+
+    def __init__(self, fetch: Callable[[], AccessToken], refresh_margin_seconds: float):
+        self.__fetch = fetch
+        self.__refresh_margin_seconds = refresh_margin_seconds
+        self.__mutex = threading.Lock()
+        self.__token: Optional[AccessToken] = None
+        self.__pending: Optional[Future] = None
+        self.__refresh_count = 0
+
+    def get_token(self) -> str:
+        """
+        :return: a valid access token.
+        """
+        with self.__mutex:
+            token = self.__token
+            now = time.time()
+            if token is not None and now < token.expires_at - self.__refresh_margin_seconds:
+                return token.token
+            pending = self.__start_refresh()
+        if token is not None and now < token.expires_at:
+            return token.token
+        return pending.result().token
+
+    def invalidate(self, token: str):
+        """
+        Drops the token once it has been rejected, so the next get_token waits for a new one.
+
+        :param token: the rejected token, nothing is done when it was already replaced.
+        """
+        with self.__mutex:
+            if self.__token is not None and self.__token.token == token:
+                self.__token = None
+
+    def get_refresh_count(self) -> int:
+        with self.__mutex:
+            return self.__refresh_count
+
+    def __start_refresh(self) -> Future:
+        # Must hold the mutex
+        if self.__pending is None:
+            self.__pending = Future()
+            threading.Thread(target=self.__refresh,
+                             args=(self.__pending,),
+                             name="token-refresh",
+                             daemon=True).start()
+        return self.__pending
+
+    def __refresh(self, pending: Future):
+        try:
+            token = self.__fetch()
+        except Exception as ex:
+            logger.error(f"Failed to refresh access token: {exception_utils.dump_ex()}")
+            with self.__mutex:
+                self.__pending = None
+            pending.set_exception(ex)
+            return
+        with self.__mutex:
+            self.__token = token
+            self.__pending = None
+            self.__refresh_count += 1
+        pending.set_result(token)
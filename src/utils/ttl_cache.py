@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, TypeVar, Any, Tuple, Optional
+
+K = TypeVar('K')
+V = TypeVar('V')
+
+
+class TtlCache(Generic[K, V]):
+    """
+    Thread-safe cache whose entries expire after a time to live.
+
+    The cache is bounded, when it is full the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        assert max_size > 0
+        self.__max_size = max_size
+        self.__ttl_seconds = ttl_seconds
+        self.__entries: OrderedDict[K, Tuple[float, V]] = OrderedDict()
+        self.__mutex = threading.Lock()
+
+    def get(self, key: K, default: Any = None) -> Any:
+        with self.__mutex:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self.__entries[key]
+                return default
+            self.__entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: K, value: V, ttl_seconds: Optional[float] = None):
+        """
+        Adds or replaces an entry.
+
+        :param key: the key.
+        :param value: the value.
+        :param ttl_seconds: how long the entry lives, the cache's time to live if not given.
+        """
+        expires = time.monotonic() + (ttl_seconds if ttl_seconds is not None else self.__ttl_seconds)
+        with self.__mutex:
+            self.__entries[key] = (expires, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    def remove(self, key: K) -> bool:
+        with self.__mutex:
+            return self.__entries.pop(key, None) is not None
+
+    def __len__(self) -> int:
+        with self.__mutex:
+            return len(self.__entries)
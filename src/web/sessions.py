@@ -1,6 +1,6 @@
 from instance import Instance
-from request import HttpRequest, from_json, get_required_parameter, assert_empty, BadRequestException, \
-    EntityExistsException, Response, NotFoundException, GoneException
+from request import HttpRequest, from_json, get_required_parameter, get_parameter, assert_empty, \
+    BadRequestException, EntityExistsException, Response, NotFoundException, GoneException
 from session_repo import Session
 from utils import loghelper
 from utils.validation_utils import validate_session_id
@@ -21,15 +21,28 @@ def create_session(instance: Instance,
     body = from_json(request.body)
     session_id = get_required_parameter(body, "sessionId", str, remove=True)
     fcm_token = get_required_parameter(body, "fcmToken", str, remove=True)
-    interval: int = get_required_parameter(body, "intervalMinutes", int, remove=True)
+    interval_seconds: int = get_parameter(body, "intervalSeconds", int, remove=True)
+    if interval_seconds is None:
+        interval: int = get_required_parameter(body, "intervalMinutes", int, remove=True)
+    else:
+        interval = get_parameter(body, "intervalMinutes", int, remove=True)
+        if interval is not None:
+            raise BadRequestException("Only one of intervalMinutes and intervalSeconds can be given.")
     assert_empty(body)
 
     validate_session_id(session_id)
 
-    if interval < 1 or interval > 1440:
-        raise BadRequestException(f"Invalid intervalMinutes: {interval}, must be between 1 and 1440.")
+    if interval_seconds is None:
+        if interval < 1 or interval > 1440:
+            raise BadRequestException(f"Invalid intervalMinutes: {interval}, must be between 1 and 1440.")
+        interval *= 60
+    else:
+        if interval_seconds < 1 or interval_seconds > 86400:
+            raise BadRequestException(f"Invalid intervalSeconds: {interval_seconds}, must be between 1 and 86400.")
+        if not instance.is_interval_supported(interval_seconds):
+            raise BadRequestException(f"Unsupported intervalSeconds: {interval_seconds}.")
+        interval = interval_seconds
 
-    interval *= 60
     message = instance.test_push_notification(fcm_token)
     if message is not None:
         raise BadRequestException(f"Invalid fcmToken: {message}.")
@@ -40,17 +53,25 @@ def create_session(instance: Instance,
         interval
     )
 
-    if not instance.create_session(session):
-        raise EntityExistsException(f"Session with id {session_id} already exists.")
-    good = False
-    try:
-        good = instance.create_schedule(session_id, interval)
-        if not good:
+    with instance.begin_unit_of_work() as work:
+        # The session write is buffered, so there is nothing to undo if the schedule cannot be created
+        instance.create_session(session)
+        if not instance.create_schedule(session):
+            work.discard()
+            # Usually a duplicate session, whose schedule is the one that exists, only this rare path reads
+            if instance.find_session(session_id) is not None:
+                raise EntityExistsException(f"Session with id {session_id} already exists.")
             logger.error(f"Schedule for session id {session_id} already exists.")
             raise EntityExistsException("Schedule already exists.")
-    finally:
-        if not good:
-            instance.delete_session(session_id)
+        committed = False
+        try:
+            committed = work.commit()
+        finally:
+            if not committed:
+                # The conditional put failed, the schedule we just created is the only thing to undo
+                instance.delete_schedule(session_id)
+        if not committed:
+            raise EntityExistsException(f"Session with id {session_id} already exists.")
 
     return Response.no_content()
 
@@ -72,9 +93,8 @@ def keep_session_alive(instance: Instance, request: HttpRequest, sessionId: str)
                 response_codes=(204,),
                 method=Method.DELETE)
 def delete_session(instance: Instance, sessionId: str):
-    session = instance.find_session(sessionId)
-    if session is None:
+    # A single delete, which tells us whether the session existed
+    if not instance.delete_session(sessionId):
         raise NotFoundException(f"Session with id {sessionId} does not exist.")
-    instance.delete_session(sessionId)
     instance.delete_schedule(sessionId)
     return Response.no_content()
@@ -14,3 +14,27 @@ resource "aws_dynamodb_table" "s_s_keepalive_session" {
   }
 
 }
+
+resource "aws_dynamodb_table" "s_s_keepalive_schedule_bucket" {
+  name         = "SSKeepaliveScheduleBucket"
+  hash_key     = "sessionId"
+  billing_mode = "PAY_PER_REQUEST"
+
+  attribute {
+    name = "sessionId"
+    type = "S"
+  }
+
+  attribute {
+    name = "bucketId"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name            = "bucketId-index"
+    hash_key        = "bucketId"
+    range_key       = "sessionId"
+    projection_type = "KEYS_ONLY"
+  }
+
+}
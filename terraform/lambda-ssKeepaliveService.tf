@@ -16,12 +16,29 @@ data "aws_iam_policy_document" "ss_keepalive_service" {
 
   statement {
     effect    = "Allow"
-    resources = [ aws_dynamodb_table.s_s_keepalive_session.arn ]
+    resources = [ aws_dynamodb_table.s_s_keepalive_session.arn,
+                  "${aws_dynamodb_table.s_s_keepalive_session.arn}/index/*" ]
     actions   = [
       "dynamodb:GetItem",
       "dynamodb:PutItem",
       "dynamodb:UpdateItem",
-      "dynamodb:DeleteItem"
+      "dynamodb:DeleteItem",
+      "dynamodb:BatchWriteItem",
+      "dynamodb:BatchGetItem",
+      "dynamodb:Query",
+      "dynamodb:Scan"
+    ]
+  }
+
+  statement {
+    effect    = "Allow"
+    resources = [ aws_dynamodb_table.s_s_keepalive_schedule_bucket.arn,
+                  "${aws_dynamodb_table.s_s_keepalive_schedule_bucket.arn}/index/*" ]
+    actions   = [
+      "dynamodb:GetItem",
+      "dynamodb:PutItem",
+      "dynamodb:DeleteItem",
+      "dynamodb:Query"
     ]
   }
 
@@ -72,9 +89,12 @@ resource "aws_lambda_function" "ss_keepalive_service" {
 
   environment {
     variables = {
-      SS_KEEPALIVE_SCHEDULE_GROUP          = "NotificationGroup"
-      SS_KEEPALIVE_SCHEDULE_GROUP_ROLE_ARN = "${aws_iam_role.notification_group.arn}"
-      SS_KEEPALIVE_ERROR_TOPIC_ARN         = "${aws_sns_topic.keepalive_error.arn}"
+      SS_KEEPALIVE_SCHEDULE_GROUP                 = "NotificationGroup"
+      SS_KEEPALIVE_SCHEDULE_GROUP_ROLE_ARN        = "${aws_iam_role.notification_group.arn}"
+      SS_KEEPALIVE_SCHEDULE_GROUP_SHARDS          = var.schedule_group_shards
+      SS_KEEPALIVE_SCHEDULE_GROUP_PREVIOUS_SHARDS = var.schedule_group_previous_shards
+      SS_KEEPALIVE_ERROR_TOPIC_ARN                = "${aws_sns_topic.keepalive_error.arn}"
+      SS_KEEPALIVE_PUSH_TRANSPORT                 = var.push_transport
     }
   }
   depends_on = [ aws_iam_role_policy_attachment.ss_keepalive_service ]
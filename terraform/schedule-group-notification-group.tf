@@ -2,6 +2,17 @@ resource "aws_scheduler_schedule_group" "notification_group" {
   name = "NotificationGroup"
 }
 
+locals {
+  # The groups of the previous shard count are kept until their schedules have ended
+  schedule_group_shard_count = max(var.schedule_group_shards, var.schedule_group_previous_shards)
+}
+
+# With more than one shard, the schedules go in NotificationGroup-0 .. NotificationGroup-(n-1)
+resource "aws_scheduler_schedule_group" "notification_group_shard" {
+  count = local.schedule_group_shard_count > 1 ? local.schedule_group_shard_count : 0
+  name  = "NotificationGroup-${count.index}"
+}
+
 data "aws_iam_policy_document" "notification_group" {
   statement {
     effect    = "Allow"
@@ -19,3 +19,21 @@ variable "cert_arn" {
   type        = string
   description = "The ARN of the ACM certificate to use for API Gateway."
 }
+
+variable "schedule_group_shards" {
+  type        = number
+  default     = 1
+  description = "Number of schedule groups to spread the keepalive schedules over"
+}
+
+variable "schedule_group_previous_shards" {
+  type        = number
+  default     = 1
+  description = "The schedule_group_shards value before it was last changed, existing schedules are still found in those groups"
+}
+
+variable "push_transport" {
+  type        = string
+  default     = "firebase"
+  description = "How push notifications are sent, firebase for firebase_admin or http for the FCM HTTP v1 API directly"
+}
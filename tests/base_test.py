@@ -39,6 +39,10 @@ FUNCTION_ARN = "arn:aws:lambda:us-west-1:123456789012:function:ssKeepaliveServic
 class Context:
     def __init__(self):
         self.invoked_function_arn = FUNCTION_ARN
+        self.remaining_millis = 90000
+
+    def get_remaining_time_in_millis(self) -> int:
+        return self.remaining_millis
 
 
 _CONTEXT = Context()
@@ -79,6 +83,8 @@ def _setup_ddb(client: MockDynamoDbClient) -> MockDynamoDbClient:
     part = KeyPart('sessionId', "S")
     hash_key = KeyDefinition([part])
     client.add_manual_table("SSKeepaliveSession", hash_key)
+    client.add_manual_table("SSKeepaliveScheduleBucket", hash_key)
+    client.add_manual_index("SSKeepaliveScheduleBucket", "bucketId-index", "bucketId", "sessionId")
     return client
 
 
@@ -117,8 +123,8 @@ class BaseTest(BetterTestCase):
         self.instance = get_bean_instance(BeanName.INSTANCE)
 
     @staticmethod
-    def invoke_event(event: Dict[str, Any]):
-        return app.handler(event, None)
+    def invoke_event(event: Dict[str, Any], context: Context = _CONTEXT):
+        return app.handler(event, context)
 
     def __construct_event(self,
                           path: str,
@@ -158,7 +164,7 @@ class BaseTest(BetterTestCase):
         if resp_json is None:
             resp_dict = {'statusCode': 200}
         else:
-            resp_dict = json.loads(resp_json)
+            resp_dict = resp_json if isinstance(resp_json, dict) else json.loads(resp_json)
         resp = InvokeResponse(resp_dict)
         resp.assert_result(expected_status_code, expected_error_message)
         return resp
@@ -166,6 +172,7 @@ class BaseTest(BetterTestCase):
     def tearDown(self) -> None:
         beans.reset()
         messaging.reset()
+        firebase_admin.reset()
 
     @staticmethod
     def pop_push_notification() -> Invocation:
@@ -184,3 +191,7 @@ class BaseTest(BetterTestCase):
     @staticmethod
     def add_invalid_push_token(token: str):
         messaging.add_invalid_token(token)
+
+    @staticmethod
+    def add_unregistered_push_token(token: str):
+        messaging.add_unregistered_token(token)
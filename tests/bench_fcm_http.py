@@ -0,0 +1,66 @@
+"""
+Measures the push throughput of the FCM HTTP v1 transport against the local stand-in server.
+
+Usage: python bench_fcm_http.py [message-count] [latency-millis]
+"""
+import sys
+import time
+from typing import Any
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from bean import Bean
+from push_notifier import PushMessage
+from push_notifier.fcm_http_notifier import FcmHttpPushNotifier
+from secrets_repo import GcpCredentials
+from support.fcm_server import FcmServer
+from utils.http_client import HttpClient
+
+
+class _CredsBean(Bean):
+    def __init__(self, creds: GcpCredentials):
+        self.creds = creds
+
+    def get_instance(self) -> Any:
+        return self.creds
+
+
+def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    server = FcmServer(key.public_key(), latency)
+    server.start()
+    try:
+        creds = GcpCredentials({
+            'project_id': "bench",
+            'private_key': key.private_bytes(serialization.Encoding.PEM,
+                                             serialization.PrivateFormat.PKCS8,
+                                             serialization.NoEncryption()).decode('utf-8'),
+            'client_email': "bench@bench.iam.gserviceaccount.com",
+            'token_uri': server.get_token_uri()
+        })
+        notifier = FcmHttpPushNotifier(_CredsBean(creds), HttpClient(10), server.get_url())
+
+        started = time.monotonic()
+        notifier.warm_up()
+        warm_up = time.monotonic() - started
+
+        messages = list(map(lambda i: PushMessage(f"session-{i}", f"token-{i}", {'type': 'keepalive'}),
+                            range(message_count)))
+        started = time.monotonic()
+        results = notifier.notify_many(messages)
+        elapsed = time.monotonic() - started
+    finally:
+        server.stop()
+
+    failed = len([r for r in results if not r.success])
+    print(f"{message_count} messages, {latency * 1000:.0f}ms per send")
+    print(f"  Warm-up:     {warm_up * 1000:>8.1f} ms")
+    print(f"  Sending:     {elapsed * 1000:>8.1f} ms, {message_count / elapsed:.0f} messages/s, {failed} failed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Estimates the peak Lambda concurrency caused by a burst of sessions, with and without a spread policy.
+
+Usage: python bench_schedule_spread.py [session-count] [burst-seconds] [invocation-millis]
+"""
+import random
+import sys
+from datetime import datetime
+from typing import List, Dict, Tuple
+
+from scheduler.spread_policy import SpreadPolicy
+
+_HOURS = 24
+
+_INTERVAL_MINUTES = (1, 5, 15, 30, 60)
+
+_POLICY = SpreadPolicy.from_json('[{"maxIntervalMinutes": 5, "startJitterSeconds": 60}, '
+                                 '{"maxIntervalMinutes": 1440, "flexWindowMinutes": 5, "startJitterSeconds": 300}]')
+
+
+def _simulate_fires(policy: SpreadPolicy, sessions: List[Tuple[float, int]]) -> Tuple[List[float], Dict[int, int]]:
+    """
+    Simulates the fire times, in seconds from the start of the burst, of sessions created during the burst.
+
+    :param sessions: when each session was created, in seconds from the start of the burst, and its interval.
+    :return: the fire times, and the number of fires per interval.
+    """
+    epoch = datetime.utcfromtimestamp(0)
+    fires = []
+    by_interval = dict.fromkeys(_INTERVAL_MINUTES, 0)
+    end = _HOURS * 3600
+    for created, minutes in sessions:
+        start = (policy.calc_start_date(datetime.utcfromtimestamp(created), minutes) - epoch).total_seconds()
+        rate = policy.calc_rate_minutes(minutes) * 60
+        window = policy.build_flex_window(minutes).get("MaximumWindowInMinutes", 0) * 60
+        scheduled = start
+        while scheduled < end:
+            fires.append(scheduled + random.uniform(0, window))
+            by_interval[minutes] += 1
+            scheduled += rate
+    fires.sort()
+    return fires, by_interval
+
+
+def _peak_concurrency(fires: List[float], duration: float) -> int:
+    peak = 0
+    first = 0
+    for index in range(len(fires)):
+        # Invocations that started within the last duration seconds are still running
+        while fires[first] <= fires[index] - duration:
+            first += 1
+        peak = max(peak, index - first + 1)
+    return peak
+
+
+def main():
+    session_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    burst_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+    duration = (float(sys.argv[3]) if len(sys.argv) > 3 else 300) / 1000
+    random.seed(1440)
+
+    # The same sessions for both, so the invocations can be compared per interval
+    sessions = list(map(lambda _: (random.uniform(0, burst_seconds), random.choice(_INTERVAL_MINUTES)),
+                        range(session_count)))
+    baseline, baseline_by_interval = _simulate_fires(SpreadPolicy(), sessions)
+    spread, spread_by_interval = _simulate_fires(_POLICY, sessions)
+    baseline_peak = _peak_concurrency(baseline, duration)
+    spread_peak = _peak_concurrency(spread, duration)
+    print(f"{session_count} sessions created within {burst_seconds:.0f}s, {duration * 1000:.0f}ms per invocation, "
+          f"{_HOURS} hours")
+    print(f"  Invocations:       {len(baseline):>8} -> {len(spread):>8}")
+    print(f"  Peak concurrency:  {baseline_peak:>8} -> {spread_peak:>8} "
+          f"({100 * (1 - spread_peak / baseline_peak):.0f}% lower)")
+    for minutes in _INTERVAL_MINUTES:
+        before = baseline_by_interval[minutes]
+        after = spread_by_interval[minutes]
+        print(f"  {minutes:>4} minute(s):     {before:>8} -> {after:>8} invocations "
+              f"({100 * (after / before - 1):+.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,8 @@ import abc
 from typing import Dict, Any, Iterable, List, Callable, Optional
 
 from botomocks.exceptions import AwsResourceNotFoundResponseException, AwsInvalidRequestResponseException, \
-    AwsInvalidParameterResponseException, AwsConflictResponseException
+    AwsInvalidParameterResponseException, AwsConflictResponseException, AwsThrottlingResponseException, \
+    AwsInternalServerResponseException
 
 
 class KeyId:
@@ -45,6 +46,14 @@ def raise_conflict_exception(operation_name: str, message: str):
     raise AwsConflictResponseException(operation_name, message)
 
 
+def raise_throttling_exception(operation_name: str):
+    raise AwsThrottlingResponseException(operation_name, "Rate exceeded")
+
+
+def raise_internal_server_exception(operation_name: str):
+    raise AwsInternalServerResponseException(operation_name, "Internal server error")
+
+
 class MockPageIterator:
     def __init__(self, results: Dict[str, Any]):
         self.results = results
@@ -621,6 +621,35 @@ def _get_attribute_value(value: Dict[str, Any]):
     return value[keys[0]]
 
 
+def _to_comparable(value: Optional[Dict[str, Any]]) -> Any:
+    if value is None:
+        return None
+    att_type, att_value = next(iter(value.items()))
+    if att_type == "N":
+        return float(att_value)
+    return att_value
+
+
+class IndexDefinition:
+    def __init__(self, name: str, hash_attribute: str, range_attribute: Optional[str], keys_only: bool):
+        self.name = name
+        self.hash_attribute = hash_attribute
+        self.range_attribute = range_attribute
+        self.keys_only = keys_only
+
+    def contains(self, row: Dict[str, Dict[str, Any]]) -> bool:
+        # Indexes are sparse, rows without the key attributes are not in the index
+        if self.hash_attribute not in row:
+            return False
+        return self.range_attribute is None or self.range_attribute in row
+
+    def get_attribute_names(self) -> List[str]:
+        names = [self.hash_attribute]
+        if self.range_attribute is not None:
+            names.append(self.range_attribute)
+        return names
+
+
 class Table:
     def __init__(self, name: str,
                  hash_key: KeyDefinition,
@@ -629,6 +658,13 @@ class Table:
         self.range_key = range_key
         self.name = name
         self.rows: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.indexes: Dict[str, IndexDefinition] = {}
+
+    def get_key_attribute_names(self) -> List[str]:
+        names = list(map(lambda p: p.attribute_name, self.hash_key.parts))
+        if self.range_key is not None:
+            names.extend(map(lambda p: p.attribute_name, self.range_key.parts))
+        return names
 
     def __build_key(self, row: Dict[str, Dict[str, Any]]):
         key = self.hash_key.build_key(row)
@@ -678,6 +714,27 @@ class EqualCondition(Condition):
         return record.get(self.name) == value
 
 
+_COMPARATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b
+}
+
+
+class ComparisonCondition(Condition):
+    def __init__(self, name: str, operation: str, bind_name: str):
+        self.name = name
+        self.comparator = _COMPARATORS[operation]
+        self.bind_name = bind_name
+
+    def check(self, record: Dict[str, Any], attributes: Dict[str, Any]):
+        value = record.get(self.name)
+        if value is None:
+            return False
+        return self.comparator(_to_comparable(value), _to_comparable(attributes[self.bind_name]))
+
+
 class AttributeExistsCondition(Condition):
     def __init__(self, name: str):
         self.name = name
@@ -712,6 +769,8 @@ def _parse_conditions(expr: str) -> Conditions:
         if parsed.right is not None:
             if parsed.operation == '=':
                 condition_list.append(EqualCondition(parsed.left, parsed.right))
+            elif parsed.operation in _COMPARATORS:
+                condition_list.append(ComparisonCondition(parsed.left, parsed.operation, parsed.right))
             else:
                 raise NotImplementedError(f"{parsed.operation} not supported.")
         elif parsed.operation == "attribute_exists":
@@ -799,6 +858,16 @@ class MockDynamoDbClient:
         self.update_count = 0
         self.__update_callback: Optional[Callable] = None
         self.__delete_callback: Optional[Callable] = None
+        self.__transaction_failures: List[Exception] = []
+        self.transaction_tokens: List[Optional[str]] = []
+        # The number of batch_write_item() calls to come that process nothing
+        self.unprocessed_batch_writes = 0
+
+    def add_transaction_failure(self, ex: Exception):
+        """
+        Causes the next call to transact_write_items() to raise the given exception.
+        """
+        self.__transaction_failures.append(ex)
 
     def set_update_callback(self, callback: Optional[Callable]):
         self.__update_callback = callback
@@ -810,6 +879,12 @@ class MockDynamoDbClient:
         t = Table(name, hash_key, range_key)
         self.tables[name] = t
 
+    def add_manual_index(self, table_name: str, index_name: str, hash_attribute: str,
+                         range_attribute: Optional[str] = None,
+                         keys_only: bool = True):
+        index = IndexDefinition(index_name, hash_attribute, range_attribute, keys_only)
+        self.__get_table(table_name).indexes[index_name] = index
+
     def __get_table(self, name: str) -> Table:
         t = self.tables.get(name)
         if t is None:
@@ -820,11 +895,16 @@ class MockDynamoDbClient:
         table_name = kwargs.pop('TableName')
         item = kwargs.pop('Item')
         expr = kwargs.pop('ConditionExpression', None)
+        expr_attributes = kwargs.pop("ExpressionAttributeValues", None)
         kwargs.pop('ReturnConsumedCapacity', None)
         kwargs.pop('ReturnItemCollectionMetrics', None)
         assert_empty(kwargs)
-        replace = expr is None
-        self.__get_table(table_name).add(item, replace)
+        t = self.__get_table(table_name)
+        if expr is not None:
+            current = t.find_by_example(item)
+            conditions = _parse_conditions(expr)
+            conditions.validate("PutItem", current or {}, expr_attributes or {})
+        t.add(item)
         return {}
 
     def update_item(self, **kwargs):
@@ -900,11 +980,15 @@ class MockDynamoDbClient:
 
     def transact_write_items(self, **kwargs):
         items: List[Dict[str, Any]] = kwargs.pop('TransactItems')
+        token = kwargs.pop('ClientRequestToken', None)
         if len(items) == 0:
             return None
         if len(items) > 100:
             raise AssertionError("too many items")
         assert_empty(kwargs)
+        self.transaction_tokens.append(token)
+        if len(self.__transaction_failures) > 0:
+            raise self.__transaction_failures.pop(0)
         save_tables = deepcopy(self.tables)
         ok = False
         try:
@@ -931,7 +1015,7 @@ class MockDynamoDbClient:
                     raise ex
                 except AwsExceptionResponseException as ex:
                     cancel_reasons.append({'Code': f"{ex.response['Error']['Code']}",
-                                           'Message': {ex.response['Error']['Message']}})
+                                           'Message': ex.response['Error']['Message']})
                     error_count += 1
             if error_count > 0:
                 raise AwsTransactionCanceledException(cancel_reasons)
@@ -939,34 +1023,122 @@ class MockDynamoDbClient:
         finally:
             if not ok:
                 self.tables = save_tables
+        return {}
 
     def scan(self, **kwargs):
         table_name = kwargs.pop('TableName')
-        select = kwargs.pop('Select')
-        assert select == "ALL_ATTRIBUTES"
+        select = kwargs.pop('Select', None)
+        assert select is None or select == "ALL_ATTRIBUTES"
+        limit = kwargs.pop('Limit', None)
+        start_key: Optional[Dict[str, Any]] = kwargs.pop('ExclusiveStartKey', None)
+        filter_exp = kwargs.pop('FilterExpression', None)
+        exp_attributes: Dict[str, Dict[str, Any]] = kwargs.pop('ExpressionAttributeValues', {})
+        assert_empty(kwargs)
+
         t = self.__get_table(table_name)
-        cloned = list(map(lambda row: row.copy(), t.rows.values()))
-        return {
-            'Items': cloned
-        }
+        key_names = t.get_key_attribute_names()
+        rows = list(t.rows.values())
+        if start_key is not None:
+            for i in range(len(rows)):
+                if all(map(lambda kv: rows[i].get(kv[0]) == kv[1], start_key.items())):
+                    rows = rows[i + 1::]
+                    break
+
+        result = {}
+        if limit is not None and len(rows) > limit:
+            rows = rows[0:limit:]
+            result['LastEvaluatedKey'] = {name: rows[-1][name] for name in key_names}
+        if filter_exp is not None:
+            # Like DynamoDB, the filter is applied after the limit
+            conditions = _parse_conditions(filter_exp)
+            rows = list(filter(lambda row: all(map(lambda c: c.check(row, exp_attributes), conditions.conditions)),
+                               rows))
+        result['Items'] = list(map(lambda row: deepcopy(row), rows))
+        return result
 
     def query(self, **kwargs):
         table_name = kwargs.pop('TableName')
-        select = kwargs.pop('Select')
-        assert select == "ALL_ATTRIBUTES"
-
+        index_name = kwargs.pop('IndexName', None)
+        select = kwargs.pop('Select', None)
+        assert select is None or select in ("ALL_ATTRIBUTES", "ALL_PROJECTED_ATTRIBUTES")
+        kwargs.pop('ConsistentRead', None)
+        limit = kwargs.pop('Limit', None)
+        start_key: Optional[Dict[str, Any]] = kwargs.pop('ExclusiveStartKey', None)
         key_condition_exp = kwargs.pop('KeyConditionExpression')
         exp_attributes: Dict[str, Dict[str, Any]] = kwargs.pop('ExpressionAttributeValues')
 
         assert_empty(kwargs)
 
-        expr = _parse_condition_expression(key_condition_exp)
-
-        partition_key = {expr.left: exp_attributes.pop(expr.right)}
-
         t = self.__get_table(table_name)
+        conditions = _parse_conditions(key_condition_exp)
+        key_names = t.get_key_attribute_names()
+        index = None
+        if index_name is not None:
+            index = t.indexes.get(index_name)
+            if index is None:
+                raise_invalid_parameter("Query", f"Unknown index {index_name}")
+            rows = filter(index.contains, t.rows.values())
+            sort_attribute = index.range_attribute
+        else:
+            rows = t.rows.values()
+            sort_attribute = key_names[1] if len(key_names) > 1 else None
+
+        matched = list(filter(lambda row: all(map(lambda c: c.check(row, exp_attributes), conditions.conditions)),
+                              rows))
+        if sort_attribute is not None:
+            matched.sort(key=lambda row: _to_comparable(row.get(sort_attribute)))
+
+        if start_key is not None:
+            for i in range(len(matched)):
+                row = matched[i]
+                if all(map(lambda kv: row.get(kv[0]) == kv[1], start_key.items())):
+                    matched = matched[i + 1::]
+                    break
+
+        result = {}
+        if limit is not None and len(matched) > limit:
+            matched = matched[0:limit:]
+            last = matched[-1]
+            last_key_names = key_names if index is None else key_names + index.get_attribute_names()
+            result['LastEvaluatedKey'] = {name: last[name] for name in last_key_names}
+
+        if index is not None and index.keys_only:
+            projected = key_names + index.get_attribute_names()
+            matched = list(map(lambda row: {name: row[name] for name in projected}, matched))
+        else:
+            matched = list(map(lambda row: deepcopy(row), matched))
+
+        result['Items'] = matched
+        return result
 
-        cloned = list(map(lambda row: row.copy(), t.query(partition_key)))
-        return {
-            'Items': cloned
-        }
+    def batch_get_item(self, **kwargs):
+        request_items: Dict[str, Dict[str, Any]] = kwargs.pop('RequestItems')
+        assert_empty(kwargs)
+        count = sum(map(lambda r: len(r['Keys']), request_items.values()))
+        if count > 100:
+            raise DynamoDbValidationException("Too many items requested for the BatchGetItem call")
+        responses = {}
+        for table_name, request in request_items.items():
+            t = self.__get_table(table_name)
+            rows = filter(lambda row: row is not None, map(t.get, request['Keys']))
+            responses[table_name] = list(map(deepcopy, rows))
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, **kwargs):
+        request_items: Dict[str, List[Dict[str, Any]]] = kwargs.pop('RequestItems')
+        assert_empty(kwargs)
+        count = sum(map(len, request_items.values()))
+        if count > 25:
+            raise DynamoDbValidationException("Too many items requested for the BatchWriteItem call")
+        if self.unprocessed_batch_writes > 0:
+            self.unprocessed_batch_writes -= 1
+            return {'UnprocessedItems': request_items}
+        for table_name, requests in request_items.items():
+            t = self.__get_table(table_name)
+            for request in requests:
+                put = request.get('PutRequest')
+                if put is not None:
+                    t.add(put['Item'])
+                else:
+                    t.remove(request['DeleteRequest']['Key'])
+        return {'UnprocessedItems': {}}
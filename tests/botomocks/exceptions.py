@@ -48,6 +48,28 @@ class AwsResourceNotFoundResponseException(AwsExceptionResponseException):
                                                                    **kwargs)
 
 
+class AwsThrottlingResponseException(AwsExceptionResponseException):
+    def __init__(self, operation_name: str, message: str,
+                 error_code: str = "ThrottlingException",
+                 **kwargs):
+        super(AwsThrottlingResponseException, self).__init__(operation_name=operation_name,
+                                                             status_code=400,
+                                                             error_code=error_code,
+                                                             error_message=message,
+                                                             **kwargs)
+
+
+class AwsInternalServerResponseException(AwsExceptionResponseException):
+    def __init__(self, operation_name: str, message: str,
+                 error_code: str = "InternalServerException",
+                 **kwargs):
+        super(AwsInternalServerResponseException, self).__init__(operation_name=operation_name,
+                                                                 status_code=500,
+                                                                 error_code=error_code,
+                                                                 error_message=message,
+                                                                 **kwargs)
+
+
 class AwsConflictResponseException(AwsExceptionResponseException):
     def __init__(self, operation_name: str, message: str,
                  error_code: str = "ConflictException",
@@ -108,7 +130,7 @@ class ConditionalCheckFailedException(AwsExceptionResponseException):
     def __init__(self, operation_name: str):
         super(ConditionalCheckFailedException, self).__init__(operation_name=operation_name,
                                                               status_code=409,
-                                                              error_code="ConditionCheckFailed",
+                                                              error_code="ConditionalCheckFailed",
                                                               error_message="Condition check failed.")
 
 
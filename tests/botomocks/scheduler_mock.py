@@ -1,7 +1,9 @@
-from datetime import datetime
+import threading
+from datetime import datetime, timezone, timedelta
 from typing import Optional, Dict
 
-from botomocks import BaseMockClient, assert_empty, raise_conflict_exception, KeyId, raise_not_found
+from botomocks import BaseMockClient, assert_empty, raise_conflict_exception, KeyId, raise_not_found, \
+    raise_throttling_exception, raise_internal_server_exception, raise_invalid_parameter
 from request import get_required_parameter, get_parameter
 
 
@@ -19,53 +21,202 @@ class Schedule:
     group_name: Optional[str]
     schedule_expression: str
     start_date: Optional[datetime]
+    end_date: Optional[datetime]
+    action_after_completion: Optional[str]
     target: Target
     flexible_time_window: Dict[str, str]
+    client_token: Optional[str]
 
     def __init__(self, node: dict):
         node = dict(node)
+        self.client_token = get_parameter(node, "ClientToken", str, remove=True)
+        self.creation_date = datetime.now(timezone.utc)
         self.name = get_required_parameter(node, "Name", str, remove=True)
         self.group_name = get_parameter(node, "GroupName", str, remove=True)
         self.schedule_expression = get_required_parameter(node, "ScheduleExpression", str, remove=True)
         self.target = Target(get_required_parameter(node, "Target", dict, remove=True))
         self.start_date = get_parameter(node, "StartDate", datetime, remove=True)
+        self.end_date = get_parameter(node, "EndDate", datetime, remove=True)
+        self.action_after_completion = get_parameter(node, "ActionAfterCompletion", str, remove=True)
+        assert self.action_after_completion in (None, "NONE", "DELETE")
         self.flexible_time_window = get_required_parameter(node, "FlexibleTimeWindow", dict, remove=True)
 
         assert_empty(node)
 
 
+class ListSchedulesPaginator:
+    def __init__(self, client: 'MockSchedulerClient'):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        kwargs = dict(kwargs)
+        config = kwargs.pop('PaginationConfig', {})
+        if 'PageSize' in config:
+            kwargs['MaxResults'] = config['PageSize']
+        while True:
+            page = self.client.list_schedules(**kwargs)
+            yield page
+            next_token = page.get('NextToken')
+            if next_token is None:
+                break
+            kwargs['NextToken'] = next_token
+
+
 class MockSchedulerClient(BaseMockClient):
 
     def __init__(self):
         super().__init__()
         self.schedules: Dict[KeyId, Schedule] = {}
         self.__raise_exists_on_next_create = False
+        self.update_count = 0
+        self.delete_count = 0
+        self.throttle_count = 0
+        self.__throttles_remaining = 0
+        self.__internal_errors_remaining = 0
+        self.__lost_responses_remaining = 0
+        self.__mutex = threading.RLock()
 
     def set_raise_exists_on_next_create(self):
         self.__raise_exists_on_next_create = True
 
+    def add_throttles(self, count: int):
+        """
+        Causes the next count calls to fail with a ThrottlingException.
+        """
+        with self.__mutex:
+            self.__throttles_remaining += count
+
+    def add_internal_errors(self, count: int):
+        """
+        Causes the next count calls to fail with an InternalServerException.
+        """
+        with self.__mutex:
+            self.__internal_errors_remaining += count
+
+    def add_lost_responses(self, count: int):
+        """
+        Causes the next count creates to succeed, but fail with an InternalServerException as if the response was
+        lost.
+        """
+        with self.__mutex:
+            self.__lost_responses_remaining += count
+
+    def __check_throttle(self, operation_name: str):
+        with self.__mutex:
+            if self.__throttles_remaining > 0:
+                self.__throttles_remaining -= 1
+                self.throttle_count += 1
+                raise_throttling_exception(operation_name)
+            if self.__internal_errors_remaining > 0:
+                self.__internal_errors_remaining -= 1
+                raise_internal_server_exception(operation_name)
+
+    @staticmethod
+    def __check_start_date(operation_name: str, schedule: Schedule):
+        if schedule.start_date is None:
+            return
+        now = datetime.now(schedule.start_date.tzinfo) if schedule.start_date.tzinfo is not None \
+            else datetime.utcnow()
+        if schedule.start_date < now - timedelta(minutes=5):
+            raise_invalid_parameter(operation_name, "The StartDate you specify cannot be earlier than 5 minutes ago.")
+
     def find_schedule_by_session(self, group_name: str, session_id: str):
         name = f"ss-keepalive-{session_id}"
         key_id = KeyId(group_name, name)
         return self.schedules.get(key_id)
 
     def create_schedule(self, **kwargs):
+        self.__check_throttle("CreateSchedule")
+        schedule = Schedule(kwargs)
+        self.__check_start_date("CreateSchedule", schedule)
+        key_id = KeyId(schedule.group_name or "default", schedule.name)
+        with self.__mutex:
+            existing = self.schedules.get(key_id)
+            if existing is not None and schedule.client_token is not None and \
+                    existing.client_token == schedule.client_token:
+                # Retry of a create that made it through
+                return {}
+            if existing is not None or self.__raise_exists_on_next_create:
+                self.__raise_exists_on_next_create = False
+                raise_conflict_exception("CreateSchedule",
+                                         f"Schedule with name {schedule.name} already exists.")
+            self.schedules[key_id] = schedule
+            if self.__lost_responses_remaining > 0:
+                self.__lost_responses_remaining -= 1
+                raise_internal_server_exception("CreateSchedule")
+        return {}
+
+    def get_schedule(self, **kwargs):
+        self.__check_throttle("GetSchedule")
+        group_name = kwargs.pop("GroupName", "default")
+        name = kwargs.pop("Name")
+        assert_empty(kwargs)
+        with self.__mutex:
+            schedule = self.schedules.get(KeyId(group_name, name))
+        if schedule is None:
+            raise_not_found("GetSchedule", "Schedule not found")
+        result = {
+            'Name': schedule.name,
+            'GroupName': group_name,
+            'ScheduleExpression': schedule.schedule_expression,
+            'StartDate': schedule.start_date,
+            'FlexibleTimeWindow': schedule.flexible_time_window
+        }
+        if schedule.end_date is not None:
+            result['EndDate'] = schedule.end_date
+        return result
+
+    def update_schedule(self, **kwargs):
+        self.__check_throttle("UpdateSchedule")
         schedule = Schedule(kwargs)
+        self.__check_start_date("UpdateSchedule", schedule)
         key_id = KeyId(schedule.group_name or "default", schedule.name)
-        if key_id in self.schedules or self.__raise_exists_on_next_create:
-            self.__raise_exists_on_next_create = False
-            raise_conflict_exception("CreateSchedule",
-                                     f"Schedule with name {schedule.name} already exists.")
-        self.schedules[key_id] = schedule
+        with self.__mutex:
+            existing = self.schedules.get(key_id)
+            if existing is None:
+                raise_not_found("UpdateSchedule", "Schedule not found")
+            self.update_count += 1
+            schedule.creation_date = existing.creation_date
+            self.schedules[key_id] = schedule
 
     def delete_schedule(self, **kwargs):
+        self.__check_throttle("DeleteSchedule")
         group_name = kwargs.pop("GroupName", "default")
         name = kwargs.pop("Name")
         assert_empty(kwargs)
         key_id = KeyId(group_name, name)
-        removed = self.schedules.pop(key_id, None)
+        with self.__mutex:
+            self.delete_count += 1
+            removed = self.schedules.pop(key_id, None)
         if removed is None:
-            raise_not_found("Schedule not found")
+            raise_not_found("DeleteSchedule", "Schedule not found")
+
+    def list_schedules(self, **kwargs):
+        self.__check_throttle("ListSchedules")
+        group_name = kwargs.pop("GroupName", "default")
+        prefix = kwargs.pop("NamePrefix", "")
+        max_results = kwargs.pop("MaxResults", 100)
+        start = int(kwargs.pop("NextToken", "0"))
+        assert_empty(kwargs)
+        assert 1 <= max_results <= 100
+        with self.__mutex:
+            matched = sorted(filter(lambda s: (s.group_name or "default") == group_name and s.name.startswith(prefix),
+                                    self.schedules.values()),
+                             key=lambda s: s.name)
+        page = matched[start:start + max_results:]
+        result = {
+            'Schedules': list(map(lambda s: {
+                'Name': s.name,
+                'GroupName': s.group_name,
+                'State': 'ENABLED',
+                'CreationDate': s.creation_date,
+                'Target': {'Arn': s.target.arn}
+            }, page))
+        }
+        if start + max_results < len(matched):
+            result['NextToken'] = str(start + max_results)
+        return result
 
     def create_paginator(self, operation_name: str):
-        pass
+        assert operation_name == 'list_schedules', f"Unsupported paginator: {operation_name}"
+        return ListSchedulesPaginator(self)
@@ -45,6 +45,7 @@ assert instance.delete_session(session_id)
 assert not instance.delete_session(session_id)
 
 instance.delete_schedule(session_id)
-instance.create_schedule(session_id, 60)
-instance.create_schedule(session_id, 60)
+session.interval_seconds = 60
+instance.create_schedule(session)
+instance.create_schedule(session)
 instance.delete_schedule(session_id)
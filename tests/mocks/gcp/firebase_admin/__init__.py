@@ -1,11 +1,41 @@
+import datetime
+import threading
+
 from mocks.gcp.firebase_admin import messaging as m
-from firebase_admin.credentials import Certificate
+from firebase_admin.credentials import Certificate, AccessTokenInfo
 
 messaging = m
 
 cert_captured: Certificate = None
 
+# The number of access tokens minted
+token_requests = 0
+
+_mutex = threading.Lock()
+
+
+class _Credential:
+    def get_access_token(self) -> AccessTokenInfo:
+        global token_requests
+        with _mutex:
+            token_requests += 1
+            count = token_requests
+        return AccessTokenInfo(f"access-token-{count}",
+                               datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+
+
+class _App:
+    def __init__(self, cert: Certificate):
+        self.cert = cert
+        self.credential = _Credential()
+
 
 def initialize_app(cert: Certificate):
+    global cert_captured
     cert_captured = cert
-    return {}
+    return _App(cert)
+
+
+def reset():
+    global token_requests
+    token_requests = 0
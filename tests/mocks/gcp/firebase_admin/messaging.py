@@ -1,6 +1,8 @@
-from typing import List
+import threading
+from typing import List, Optional
 
-from firebase_admin.messaging import Message
+from firebase_admin import exceptions
+from firebase_admin.messaging import Message, BatchResponse, SendResponse, UnregisteredError, QuotaExceededError
 
 
 class Invocation:
@@ -15,15 +17,61 @@ captured: List[Invocation] = []
 
 invalid_tokens = set()
 
+unregistered_tokens = set()
+
+# The number of messages sent, successfully or not
+send_count = 0
+
+# The number of messages in each send_each call
+batch_sizes: List[int] = []
+
+# Raised by the next sends, one each
+transient_errors: List[Exception] = []
+
+# Raised by the next send_each calls, for the whole call
+call_errors: List[Exception] = []
+
+_mutex = threading.Lock()
+
+
+class _HttpResponse:
+    def __init__(self, headers: dict):
+        self.headers = headers
+
 
 def send(message: Message, dry_run=False, app=None):
+    global send_count
     assert message.token is not None, "No token"
+    with _mutex:
+        send_count += 1
+        error = transient_errors.pop(0) if len(transient_errors) > 0 else None
+    if error is not None:
+        raise error
     if message.token in invalid_tokens:
         raise ValueError(f"Invalid token: {message.token}")
+    if message.token in unregistered_tokens:
+        raise UnregisteredError(f"Requested entity was not found: {message.token}")
 
     captured.append(Invocation(message, dry_run))
 
 
+def send_each(messages: List[Message], dry_run=False, app=None) -> BatchResponse:
+    assert len(messages) <= 500, "Too many messages"
+    batch_sizes.append(len(messages))
+    with _mutex:
+        error = call_errors.pop(0) if len(call_errors) > 0 else None
+    if error is not None:
+        raise error
+    responses = []
+    for message in messages:
+        try:
+            send(message, dry_run=dry_run)
+            responses.append(SendResponse({'name': f"projects/test/messages/{len(captured)}"}, None))
+        except Exception as ex:
+            responses.append(SendResponse(None, ex))
+    return BatchResponse(responses)
+
+
 def pop_invocation() -> Invocation:
     return captured.pop(0)
 
@@ -32,10 +80,32 @@ def add_invalid_token(token: str):
     invalid_tokens.add(token)
 
 
+def add_unregistered_token(token: str):
+    unregistered_tokens.add(token)
+
+
+def add_transient_errors(count: int, quota_exceeded: bool = False, retry_after: Optional[int] = None):
+    headers = {'Retry-After': str(retry_after)} if retry_after is not None else {}
+    with _mutex:
+        for _ in range(count):
+            if quota_exceeded:
+                transient_errors.append(QuotaExceededError("Quota exceeded.", http_response=_HttpResponse(headers)))
+            else:
+                transient_errors.append(exceptions.UnavailableError("Service unavailable.",
+                                                                    http_response=_HttpResponse(headers)))
+
+
 def assert_no_invocations():
     if len(captured) > 0:
         raise AssertionError("We captured invocations.")
 
+
 def reset():
+    global send_count
+    send_count = 0
     captured.clear()
     invalid_tokens.clear()
+    unregistered_tokens.clear()
+    transient_errors.clear()
+    call_errors.clear()
+    batch_sizes.clear()
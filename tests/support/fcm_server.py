@@ -0,0 +1,150 @@
+"""
+Local stand-in for the Google OAuth2 token endpoint and the FCM HTTP v1 send endpoint, so the HTTP transport can be
+tested and benchmarked offline.
+"""
+import base64
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Optional, Dict, Any, Tuple
+from urllib.parse import parse_qs
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+
+TOKEN_PATH = "/token"
+
+_FCM_ERROR_TYPE = "type.googleapis.com/google.firebase.fcm.v1.FcmError"
+
+
+def _b64_decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+class FcmServer:
+    def __init__(self, public_key: Optional[RSAPublicKey] = None, latency_seconds: float = 0.0):
+        """
+        :param public_key: optional key to verify the JWT signatures with.
+        :param latency_seconds: how long each send takes.
+        """
+        self.public_key = public_key
+        self.latency_seconds = latency_seconds
+        # The message of each send, with validate_only
+        self.messages: List[Dict[str, Any]] = []
+        self.unregistered_tokens = set()
+        # The HTTP status code and Retry-After of the errors to return for the next sends, one each
+        self.transient_errors: List[Tuple[int, Optional[int]]] = []
+        self.token_requests = 0
+        self.__access_tokens = set()
+        self.__mutex = threading.Lock()
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), self.__build_handler())
+        self.__server.daemon_threads = True
+        self.__thread: Optional[threading.Thread] = None
+
+    def get_url(self) -> str:
+        return f"http://127.0.0.1:{self.__server.server_address[1]}"
+
+    def get_token_uri(self) -> str:
+        return self.get_url() + TOKEN_PATH
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__server.serve_forever, name="fcm-server", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+    def add_transient_errors(self, count: int, status_code: int = 503, retry_after: Optional[int] = None):
+        with self.__mutex:
+            self.transient_errors.extend([(status_code, retry_after)] * count)
+
+    def revoke_access_tokens(self):
+        """
+        Rejects the access tokens handed out so far, as if the service account key had been rotated.
+        """
+        with self.__mutex:
+            self.__access_tokens.clear()
+
+    def handle_token_request(self, body: str) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        params = parse_qs(body)
+        assertion = params.get('assertion', [""])[0]
+        parts = assertion.split(".")
+        if params.get('grant_type') != ["urn:ietf:params:oauth:grant-type:jwt-bearer"] or len(parts) != 3:
+            return 400, {'error': "invalid_request"}, {}
+        claims = json.loads(_b64_decode(parts[1]))
+        if self.public_key is not None:
+            try:
+                self.public_key.verify(_b64_decode(parts[2]),
+                                       f"{parts[0]}.{parts[1]}".encode('ascii'),
+                                       padding.PKCS1v15(),
+                                       hashes.SHA256())
+            except InvalidSignature:
+                return 400, {'error': "invalid_grant", 'error_description': "Invalid JWT Signature."}, {}
+        with self.__mutex:
+            self.token_requests += 1
+            access_token = f"access-token-{self.token_requests}"
+            self.__access_tokens.add(access_token)
+        return 200, {'access_token': access_token,
+                     'expires_in': claims['exp'] - claims['iat'],
+                     'token_type': "Bearer"}, {}
+
+    def handle_send_request(self,
+                            authorization: Optional[str],
+                            body: str) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        if authorization is None or authorization[len("Bearer "):] not in self.__access_tokens:
+            return 401, {'error': {'code': 401, 'message': "Request had invalid authentication credentials.",
+                                   'status': "UNAUTHENTICATED"}}, {}
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+        record = json.loads(body)
+        token = record['message']['token']
+        with self.__mutex:
+            error = self.transient_errors.pop(0) if len(self.transient_errors) > 0 else None
+            if error is None and token not in self.unregistered_tokens:
+                self.messages.append(record)
+        if error is not None:
+            status_code, retry_after = error
+            headers = {'Retry-After': str(retry_after)} if retry_after is not None else {}
+            return status_code, {'error': {'code': status_code, 'message': "The service is currently unavailable.",
+                                           'status': "UNAVAILABLE"}}, headers
+        if token in self.unregistered_tokens:
+            return 404, {'error': {'code': 404, 'message': "Requested entity was not found.", 'status': "NOT_FOUND",
+                                   'details': [{'@type': _FCM_ERROR_TYPE, 'errorCode': "UNREGISTERED"}]}}, {}
+        return 200, {'name': f"projects/test/messages/{len(self.messages)}"}, {}
+
+    def __build_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in one write, otherwise Nagle and delayed ACKs stall each response
+            wbufsize = -1
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode('utf-8')
+                if self.path == TOKEN_PATH:
+                    status_code, record, headers = server.handle_token_request(body)
+                elif self.path.endswith("/messages:send"):
+                    status_code, record, headers = server.handle_send_request(self.headers.get('Authorization'),
+                                                                              body)
+                else:
+                    status_code, record, headers = 404, {'error': {'code': 404, 'status': "NOT_FOUND"}}, {}
+                content = json.dumps(record).encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('Content-Type', "application/json")
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format: str, *args: Any):
+                pass
+
+        return Handler
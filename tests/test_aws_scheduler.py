@@ -0,0 +1,196 @@
+import time
+from datetime import datetime, timedelta
+
+from aws import is_throttling_exception
+from better_test_case import BetterTestCase
+from botomocks import KeyId
+from botomocks.scheduler_mock import MockSchedulerClient
+from scheduler.aws_scheduler import AwsScheduler
+from scheduler.spread_policy import SpreadPolicy
+from session_repo import Session
+from utils import deadline
+from utils.date_utils import get_system_time_in_seconds
+
+_GROUP_NAME = "NotificationGroup"
+
+_FUNCTION_ARN = "arn:aws:lambda:us-west-1:123456789012:function:ssKeepaliveService"
+
+
+def _new_session(session_id: str) -> Session:
+    return Session(session_id, "some-token", 60, get_system_time_in_seconds() + 100)
+
+
+class AwsSchedulerTest(BetterTestCase):
+
+    def setUp(self) -> None:
+        self.client = MockSchedulerClient()
+        self.scheduler = AwsScheduler(self.client, _GROUP_NAME, "role-arn")
+
+    def test_bulk(self):
+        sessions = list(map(lambda i: _new_session(f"session-{i}"), range(50)))
+        self.client.add_throttles(10)
+        results = self.scheduler.create_schedules(_FUNCTION_ARN, sessions)
+        self.assertEqual(10, self.client.throttle_count)
+        self.assertEqual(list(map(lambda s: s.session_id, sessions)), list(map(lambda r: r.session_id, results)))
+        self.assertTrue(all(map(lambda r: r.success and r.error is None, results)))
+        self.assertEqual(50, len(self.client.schedules))
+
+        # Already exists
+        results = self.scheduler.create_schedules(_FUNCTION_ARN, sessions[0:2:])
+        self.assertEqual([False, False], list(map(lambda r: r.success, results)))
+        self.assertIsNone(results[0].error)
+
+        # Resuming the listing after the first page
+        created_before = get_system_time_in_seconds() + 10
+        pages = list(self.scheduler.list_session_ids(created_before, 30))
+        self.assertEqual([30, 20], list(map(lambda page: len(page.items), pages)))
+        self.assertIsNone(pages[-1].cursor)
+        resumed = list(self.scheduler.list_session_ids(created_before, 30, cursor=pages[0].cursor))
+        self.assertEqual(pages[1].items, resumed[0].items)
+
+        session_ids = list(map(lambda s: s.session_id, sessions[0:10:])) + ["unknown"]
+        self.client.add_throttles(5)
+        results = self.scheduler.delete_schedules(session_ids)
+        self.assertEqual([True] * 10 + [False], list(map(lambda r: r.success, results)))
+        self.assertEqual(40, len(self.client.schedules))
+
+    def test_shards(self):
+        scheduler = AwsScheduler(self.client, _GROUP_NAME, "role-arn", shard_count=4)
+        sessions = list(map(lambda i: _new_session(f"session-{i}"), range(40)))
+        results = scheduler.create_schedules(_FUNCTION_ARN, sessions)
+        self.assertTrue(all(map(lambda r: r.success, results)))
+        groups = set(map(lambda key: key[0], self.client.schedules.keys()))
+        self.assertEqual({f"{_GROUP_NAME}-{i}" for i in range(4)}, groups)
+
+        created_before = get_system_time_in_seconds() + 10
+        listed = []
+        for shard in range(scheduler.get_shard_count()):
+            for page in scheduler.list_session_ids(created_before, 100, shard):
+                listed.extend(page.items)
+        self.assertEqual(sorted(map(lambda s: s.session_id, sessions)), sorted(listed))
+
+        self.assertTrue(scheduler.has_schedule("session-7"))
+        self.assertTrue(scheduler.update_schedule(_FUNCTION_ARN, sessions[7], None))
+        self.assertTrue(scheduler.delete_schedule("session-7"))
+        self.assertFalse(scheduler.has_schedule("session-7"))
+        self.assertEqual(39, len(self.client.schedules))
+
+    def test_shard_count_change(self):
+        sessions = list(map(lambda i: _new_session(f"session-{i}"), range(20)))
+        self.scheduler.create_schedules(_FUNCTION_ARN, sessions)
+
+        # The schedules made before sharding stay in the base group and are still found there
+        scheduler = AwsScheduler(self.client, _GROUP_NAME, "role-arn", shard_count=4)
+        self.assertEqual(5, scheduler.get_shard_count())
+        self.assertEqual(_GROUP_NAME, scheduler.get_group_name(4))
+        self.assertTrue(scheduler.has_schedule("session-1"))
+        self.assertTrue(scheduler.update_schedule(_FUNCTION_ARN, sessions[1], None))
+        self.assertIsNotNone(self.client.find_schedule_by_session(_GROUP_NAME, "session-1"))
+        created_before = get_system_time_in_seconds() + 10
+        listed = []
+        for shard in range(scheduler.get_shard_count()):
+            for page in scheduler.list_session_ids(created_before, 100, shard):
+                listed.extend(page.items)
+        self.assertEqual(sorted(map(lambda s: s.session_id, sessions)), sorted(listed))
+        self.assertTrue(scheduler.delete_schedule("session-1"))
+        self.assertFalse(scheduler.has_schedule("session-1"))
+        self.assertFalse(scheduler.delete_schedule("session-1"))
+
+        # From 4 shards to 8, this one moves from group 1 to group 5
+        self.assertTrue(scheduler.create_schedule(_FUNCTION_ARN, _new_session("moved")))
+        scheduler = AwsScheduler(self.client, _GROUP_NAME, "role-arn", shard_count=8, previous_shard_count=4)
+        self.assertEqual(8, scheduler.get_shard_count())
+        self.assertTrue(scheduler.has_schedule("moved"))
+        self.assertTrue(scheduler.delete_schedule("moved"))
+        self.assertFalse(scheduler.has_schedule("moved"))
+
+    def test_update_keeps_beat(self):
+        session = _new_session("session-1")
+        self.assertTrue(self.scheduler.create_schedule(_FUNCTION_ARN, session))
+        # Pretend the schedule was created a while ago, its start date can no longer be sent back as-is
+        schedule = self.client.find_schedule_by_session(_GROUP_NAME, "session-1")
+        start_date = datetime.utcnow() - timedelta(hours=3, seconds=20)
+        schedule.start_date = start_date
+        self.assertTrue(self.scheduler.update_schedule(_FUNCTION_ARN, session, None))
+        updated = self.client.find_schedule_by_session(_GROUP_NAME, "session-1")
+        self.assertGreaterEqual(updated.start_date, datetime.utcnow())
+        self.assertLess(updated.start_date, datetime.utcnow() + timedelta(minutes=1))
+        self.assertEqual(0, (updated.start_date - start_date).total_seconds() % 60)
+
+    def test_bulk_throttling_gives_up(self):
+        self.client.add_throttles(100)
+        results = self.scheduler.delete_schedules(["session-1"])
+        self.assertFalse(results[0].success)
+        self.assertTrue(is_throttling_exception(results[0].error))
+
+    def test_retries_within_deadline(self):
+        class Context:
+            @staticmethod
+            def get_remaining_time_in_millis() -> int:
+                return 2500
+
+        # The invocation has half a second left for retries, the workers of the bulk calls too
+        deadline.start_invocation(Context())
+        try:
+            self.client.add_throttles(100)
+            started = time.monotonic()
+            results = self.scheduler.delete_schedules(["session-1", "session-2"])
+            self.assertLess(time.monotonic() - started, 1.0)
+            self.assertTrue(all(map(lambda r: is_throttling_exception(r.error), results)))
+        finally:
+            deadline.start_invocation(None)
+
+    def test_retries(self):
+        self.client.add_throttles(2)
+        self.client.add_internal_errors(1)
+        self.assertTrue(self.scheduler.create_schedule(_FUNCTION_ARN, _new_session("session-1")))
+        metrics = self.scheduler.retry_metrics.to_dict()
+        self.assertEqual(3, metrics['retries'])
+        self.assertEqual({'ThrottlingException': 2, 'InternalServerException': 1}, metrics['retriesByError'])
+
+        # The first attempt made it through, the retry with the same token still succeeds
+        self.client.add_lost_responses(1)
+        self.assertTrue(self.scheduler.create_schedule(_FUNCTION_ARN, _new_session("session-2")))
+        self.assertFalse(self.scheduler.create_schedule(_FUNCTION_ARN, _new_session("session-2")))
+
+        self.client.add_internal_errors(1)
+        self.assertTrue(self.scheduler.delete_schedule("session-1"))
+        self.assertEqual(0, self.scheduler.retry_metrics.exhausted)
+
+        self.client.add_throttles(100)
+        with self.assertRaises(Exception) as context:
+            self.scheduler.delete_schedule("session-2")
+        self.assertTrue(is_throttling_exception(context.exception))
+        self.assertEqual(1, self.scheduler.retry_metrics.exhausted)
+
+    def test_spread_policy(self):
+        policy = SpreadPolicy.from_json('[{"maxIntervalMinutes": 1440, "flexWindowMinutes": 5, '
+                                        '"startJitterSeconds": 300}, '
+                                        '{"maxIntervalMinutes": 5, "startJitterSeconds": 30}]')
+        # Short intervals only get jitter
+        self.assertEqual({"Mode": "OFF"}, policy.build_flex_window(5))
+        self.assertEqual(5, policy.calc_rate_minutes(5))
+        now = datetime.utcnow()
+        start = policy.calc_start_date(now, 5)
+        self.assertTrue(now + timedelta(minutes=5, seconds=-30) <= start <= now + timedelta(minutes=5))
+
+        # The rate is shortened by the window, so a late fire is still within the interval
+        self.assertEqual({"Mode": "FLEXIBLE", "MaximumWindowInMinutes": 5}, policy.build_flex_window(60))
+        self.assertEqual(55, policy.calc_rate_minutes(60))
+        # The window is capped at a tenth of the interval, so it never multiplies the fires
+        self.assertEqual({"Mode": "OFF"}, policy.build_flex_window(6))
+        self.assertEqual(6, policy.calc_rate_minutes(6))
+        self.assertEqual({"Mode": "FLEXIBLE", "MaximumWindowInMinutes": 2}, policy.build_flex_window(29))
+        self.assertEqual(27, policy.calc_rate_minutes(29))
+
+        # Nothing configured for longer intervals
+        self.assertEqual({"Mode": "OFF"}, policy.build_flex_window(1441))
+        self.assertEqual(now + timedelta(minutes=1441), policy.calc_start_date(now, 1441))
+
+        scheduler = AwsScheduler(self.client, _GROUP_NAME, "role-arn", spread_policy=policy)
+        session = _new_session("session-1")
+        session.interval_seconds = 3600
+        scheduler.create_schedule(_FUNCTION_ARN, session)
+        schedule = self.client.schedules[KeyId(_GROUP_NAME, "ss-keepalive-session-1")]
+        self.assertEqual("rate(55 minutes)", schedule.schedule_expression)
+        self.assertEqual({"Mode": "FLEXIBLE", "MaximumWindowInMinutes": 5}, schedule.flexible_time_window)
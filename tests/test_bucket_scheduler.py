@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import datetime
+
+import bean.beans
+from aws.dynamodb import DynamoDb
+from base_test import BaseTest, NOTIFICATION_GROUP, FUNCTION_ARN, SCHEDULE_ROLE_ARN
+from bean import BeanName
+from botomocks import KeyId
+from scheduler.bucket_scheduler import BucketScheduler, to_bucket_id
+from session_repo import Session
+from utils.date_utils import get_system_time_in_seconds
+
+_BUCKET_SCHEDULE_NAME = "ss-keepalive-bucket-1-0"
+
+
+class BucketSchedulerTest(BaseTest):
+
+    def setUp(self) -> None:
+        os.environ['SS_KEEPALIVE_SCHEDULING_MODE'] = 'bucket'
+        super().setUp()
+
+    def tearDown(self) -> None:
+        os.environ.pop('SS_KEEPALIVE_SCHEDULING_MODE')
+        super().tearDown()
+
+    def test_bucket_ids(self):
+        self.assertEqual("1-0", to_bucket_id("some-token", 1))
+        bucket_ids = set(map(lambda i: to_bucket_id(f"token-{i}", 1440), range(1000)))
+        # Long intervals are capped at 60 phases
+        self.assertEqual(60, len(bucket_ids))
+
+    def test_buckets(self):
+        self.assertTrue(isinstance(bean.beans.get_bean_instance(BeanName.SCHEDULER), BucketScheduler))
+        for session_id in ("session-1", "session-2", "session-3"):
+            self.create_session(session_id)
+        # The token is only tested once
+        self.assertTrue(self.pop_push_notification().dry_run)
+        self.assert_no_push_notifications()
+
+        # One schedule for all of them
+        self.assertEqual(1, len(self.scheduler_mock.schedules))
+        schedule = self.scheduler_mock.schedules[KeyId(NOTIFICATION_GROUP, _BUCKET_SCHEDULE_NAME)]
+        self.assertEqual("rate(1 minutes)", schedule.schedule_expression)
+        self.assertGreater(schedule.start_date, datetime.utcnow())
+        self.assertEqual(0, schedule.start_date.second)
+        self.assertEqual(FUNCTION_ARN, schedule.target.arn)
+        event = json.loads(schedule.target.input)
+        self.assertEqual({'internalEvent': {'type': 'bucketKeepalive', 'bucketId': '1-0'}}, event)
+
+        self.assertEqual(["session-1", "session-2", "session-3"],
+                         sorted(self.instance.list_bucket_members("1-0")))
+
+        self.delete_session("session-2")
+        ddb: DynamoDb = bean.beans.get_bean_instance(BeanName.DYNAMODB)
+        ddb.update_item("SSKeepaliveSession",
+                        keys={"sessionId": "session-3"},
+                        item={'expireTime': get_system_time_in_seconds() - 10})
+
+        self.invoke_event(event)
+        notification = self.pop_push_notification()
+        self.assertEqual({'type': 'keepalive', 'sessionId': 'session-1'}, notification.data)
+        self.assert_no_push_notifications()
+        # The expired session was removed from the bucket
+        self.assertEqual(["session-1"], self.instance.list_bucket_members("1-0"))
+
+        # Session already in a bucket
+        self.create_session("session-1", expected_status_code=409,
+                            expected_error_message="Session with id session-1 already exists.")
+
+    def test_deleted_bucket_schedule(self):
+        self.create_session("session-1")
+        self.scheduler_mock.delete_schedule(GroupName=NOTIFICATION_GROUP, Name=_BUCKET_SCHEDULE_NAME)
+        # We still trust the schedule is there
+        self.create_session("session-2")
+        self.assertEqual(0, len(self.scheduler_mock.schedules))
+
+        # Once we stop trusting it, the next member brings it back
+        scheduler = BucketScheduler(self.scheduler_mock, NOTIFICATION_GROUP, SCHEDULE_ROLE_ARN,
+                                    bean.beans.get_bean_instance(BeanName.DYNAMODB), known_bucket_ttl_seconds=0)
+        self.assertTrue(scheduler.create_schedule(FUNCTION_ARN, Session("session-3", "some-token", 60)))
+        self.assertIsNotNone(self.scheduler_mock.schedules.get(KeyId(NOTIFICATION_GROUP, _BUCKET_SCHEDULE_NAME)))
+
+    def create_session(self, session_id: str, expected_status_code: int = 204, expected_error_message: str = None):
+        body = {'sessionId': session_id, 'fcmToken': "some-token", 'intervalMinutes': 1}
+        self.invoke_web_event(path="sessions", method="POST", body=body,
+                              expected_status_code=expected_status_code,
+                              expected_error_message=expected_error_message)
+
+    def delete_session(self, session_id: str):
+        self.invoke_web_event(path=f"sessions/{session_id}", method="DELETE", expected_status_code=204)
@@ -0,0 +1,38 @@
+import time
+
+from better_test_case import BetterTestCase
+from utils.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class CircuitBreakerTest(BetterTestCase):
+
+    def test_breaker(self):
+        breaker = CircuitBreaker("test", failure_threshold=3, open_seconds=0.1)
+        self.assertFalse(breaker.record_failure())
+        self.assertFalse(breaker.record_failure())
+        # A success resets the count
+        self.assertEqual(0, breaker.record_success())
+        self.assertFalse(breaker.record_failure())
+        self.assertFalse(breaker.record_failure())
+        self.assertTrue(breaker.record_failure())
+        self.assertEqual(OPEN, breaker.get_state())
+        self.assertFalse(breaker.allow_request())
+
+        # One probe at a time once it has been open long enough
+        time.sleep(0.1)
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(HALF_OPEN, breaker.get_state())
+        self.assertFalse(breaker.allow_request())
+        self.assertFalse(breaker.record_failure())
+        self.assertEqual(OPEN, breaker.get_state())
+        self.assertFalse(breaker.allow_request())
+
+        # A probe whose outcome never comes is given up on after the open time
+        time.sleep(0.1)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        time.sleep(0.1)
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(4, breaker.record_success())
+        self.assertEqual(CLOSED, breaker.get_state())
+        self.assertTrue(breaker.allow_request())
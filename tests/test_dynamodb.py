@@ -0,0 +1,88 @@
+from botocore.exceptions import ClientError
+
+from aws.dynamodb import DynamoDb, PutItemRequest, DeleteItemRequest, TransactionCancelledException, \
+    DynamoDbValidationException, MAX_TRANSACTION_ITEMS, UnprocessedItemsException
+from better_test_case import BetterTestCase
+from botomocks.dynamodb_mock import MockDynamoDbClient, KeyPart, KeyDefinition
+from botomocks.exceptions import AwsTransactionCanceledException
+
+_TABLE_NAME = "SomeTable"
+
+
+def _put(item_id: str) -> PutItemRequest:
+    return PutItemRequest(_TABLE_NAME, {'id': item_id, 'value': 1}, key_attributes=['id'])
+
+
+class DynamoDbTest(BetterTestCase):
+
+    def setUp(self) -> None:
+        self.client = MockDynamoDbClient()
+        self.client.add_manual_table(_TABLE_NAME, KeyDefinition([KeyPart('id', "S")]))
+        self.ddb = DynamoDb(self.client)
+
+    def test_transact_write_limits(self):
+        self.assertRaises(DynamoDbValidationException, lambda: self.ddb.transact_write([]))
+
+        items = list(map(lambda i: _put(f"id-{i}"), range(MAX_TRANSACTION_ITEMS + 1)))
+        self.assertRaises(DynamoDbValidationException, lambda: self.ddb.transact_write(items))
+
+        self.ddb.transact_write(items[0:MAX_TRANSACTION_ITEMS])
+        self.assertIsNotNone(self.ddb.find_item(_TABLE_NAME, {'id': 'id-99'}, consistent=True))
+
+    def test_batch_write_unprocessed(self):
+        self.ddb.transact_write([_put("one"), _put("two"), _put("three")])
+        self.client.unprocessed_batch_writes = 2
+        self.ddb.delete_items(_TABLE_NAME, [{'id': "one"}, {'id': "two"}])
+        self.assertIsNone(self.ddb.find_item(_TABLE_NAME, {'id': 'two'}, consistent=True))
+
+        # We do not keep at it forever
+        self.client.unprocessed_batch_writes = 100
+        self.assertRaises(UnprocessedItemsException, lambda: self.ddb.delete_items(_TABLE_NAME, [{'id': "three"}]))
+        self.client.unprocessed_batch_writes = 0
+
+    def test_transact_write_token(self):
+        self.ddb.transact_write([_put("one")])
+        self.ddb.transact_write([_put("two")], client_request_token="my-token")
+        generated = self.client.transaction_tokens[0]
+        self.assertIsNotNone(generated)
+        self.assertEqual("my-token", self.client.transaction_tokens[1])
+
+        # Throttling should cause a retry using the same token
+        self.client.transaction_tokens.clear()
+        self.client.add_transaction_failure(ClientError({'Error': {'Code': 'ThrottlingException',
+                                                                   'Message': 'Slow down'}},
+                                                        "TransactWriteItems"))
+        self.ddb.transact_write([_put("three")])
+        self.assertHasLength(2, self.client.transaction_tokens)
+        self.assertEqual(self.client.transaction_tokens[0], self.client.transaction_tokens[1])
+        self.assertEqual(1, self.ddb.get_last_response().throttle_count)
+
+    def test_transact_write_cancel_reasons(self):
+        self.ddb.transact_write([_put("exists")])
+
+        good = _put("new-one")
+        bad = _put("exists")
+        delete = DeleteItemRequest(_TABLE_NAME, {'id': 'not-there'})
+
+        ex: TransactionCancelledException = self.assertThrows(TransactionCancelledException,
+                                                              lambda: self.ddb.transact_write([good, bad, delete]))
+        self.assertEqual([bad, delete], ex.get_failed_requests())
+        self.assertTrue(ex.reasons[1].is_condition_failure())
+        self.assertIs(good, ex.reasons[0].request)
+        self.assertIsNone(ex.reasons[0].code)
+        self.assertEmpty(ex.get_conflicted_requests())
+
+        # Make sure nothing was written
+        self.assertIsNone(self.ddb.find_item(_TABLE_NAME, {'id': 'new-one'}, consistent=True))
+
+        # Conflicts can be retried on their own
+        self.client.add_transaction_failure(AwsTransactionCanceledException([
+            {'Code': 'None'},
+            {'Code': 'TransactionConflict', 'Message': 'Conflict'}
+        ]))
+        other = _put("other")
+        ex = self.assertThrows(TransactionCancelledException, lambda: self.ddb.transact_write([good, other]))
+        retry = ex.get_conflicted_requests()
+        self.assertEqual([other], retry)
+        self.ddb.transact_write(retry)
+        self.assertIsNotNone(self.ddb.find_item(_TABLE_NAME, {'id': 'other'}, consistent=True))
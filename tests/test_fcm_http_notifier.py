@@ -0,0 +1,109 @@
+import json
+import os
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from base_test import BaseTest
+from bean import BeanName
+from bean.beans import get_bean_instance
+from push_notifier import PushMessage, PushErrorCode
+from push_notifier.fcm_http_notifier import FcmHttpPushNotifier
+from support.fcm_server import FcmServer
+
+_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+class FcmHttpPushNotifierTest(BaseTest):
+
+    def setUp(self) -> None:
+        self.server = FcmServer(_KEY.public_key())
+        self.server.start()
+        os.environ['SS_KEEPALIVE_PUSH_TRANSPORT'] = 'http'
+        os.environ['SS_KEEPALIVE_FCM_URL'] = self.server.get_url()
+        super().setUp()
+        pem = _KEY.private_bytes(serialization.Encoding.PEM,
+                                 serialization.PrivateFormat.PKCS8,
+                                 serialization.NoEncryption()).decode('utf-8')
+        record = {
+            'type': "service_account",
+            'project_id': "test-project",
+            'private_key_id': "some-key",
+            'private_key': pem,
+            'client_email': "keepalive@test-project.iam.gserviceaccount.com",
+            'token_uri': self.server.get_token_uri()
+        }
+        self.sm_mock.update_secret(SecretId="ss-keepalive/GcpCertificate", SecretString=json.dumps(record))
+        self.notifier: FcmHttpPushNotifier = get_bean_instance(BeanName.PUSH_NOTIFIER)
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        os.environ.pop('SS_KEEPALIVE_PUSH_TRANSPORT')
+        os.environ.pop('SS_KEEPALIVE_FCM_URL')
+        super().tearDown()
+
+    def test_notify(self):
+        self.assertIsInstance(self.notifier, FcmHttpPushNotifier)
+        self.invoke_event({'internalEvent': {'type': 'warmup'}})
+        self.assertEqual(1, self.server.token_requests)
+
+        self.notifier.notify("some-token", {'type': 'keepalive'}, dry_run=True)
+        self.assertEqual({'message': {'token': "some-token", 'data': {'type': 'keepalive'}}, 'validate_only': True},
+                         self.server.messages.pop())
+
+        messages = list(map(lambda i: PushMessage(f"session-{i}", f"token-{i}", {'index': str(i)}), range(50)))
+        self.server.unregistered_tokens.add("token-7")
+        results = self.notifier.notify_many(messages)
+        self.assertEqual(list(map(lambda m: m.session_id, messages)), list(map(lambda r: r.session_id, results)))
+        failed = [r for r in results if not r.success]
+        self.assertEqual(["session-7"], list(map(lambda r: r.session_id, failed)))
+        self.assertEqual(PushErrorCode.UNREGISTERED, failed[0].error_code)
+        self.assertEqual(49, len(self.server.messages))
+        # Everything went out on the first token
+        self.assertEqual(1, self.server.token_requests)
+
+    def test_retries(self):
+        self.server.add_transient_errors(2)
+        self.notifier.notify("some-token", {'type': 'keepalive'})
+        self.assertEqual(1, len(self.server.messages))
+        self.assertEqual({'FcmException': 2}, self.notifier.retry_metrics.to_dict()['retriesByError'])
+
+        # We wait at least as long as we are told to
+        self.server.add_transient_errors(1, status_code=429, retry_after=1)
+        started = time.monotonic()
+        results = self.notifier.notify_many([PushMessage("session-1", "some-token", {'type': 'keepalive'})])
+        self.assertGreaterEqual(time.monotonic() - started, 1.0)
+        self.assertTrue(results[0].success)
+
+        self.server.add_transient_errors(10)
+        results = self.notifier.notify_many([PushMessage("session-1", "some-token", {'type': 'keepalive'})])
+        self.assertEqual(PushErrorCode.UNAVAILABLE, results[0].error_code)
+        self.server.transient_errors.clear()
+
+    def test_revoked_token(self):
+        self.notifier.warm_up()
+        self.server.revoke_access_tokens()
+        self.notifier.notify("some-token", {'type': 'keepalive'})
+        self.assertEqual(1, len(self.server.messages))
+        self.assertEqual(2, self.server.token_requests)
+
+        # The sends that fail together share the one new token
+        self.server.revoke_access_tokens()
+        messages = list(map(lambda i: PushMessage(f"session-{i}", f"token-{i}", {'index': str(i)}), range(50)))
+        results = self.notifier.notify_many(messages)
+        self.assertTrue(all(map(lambda r: r.success, results)))
+        self.assertEqual(3, self.server.token_requests)
+
+    def test_session(self):
+        body = {'sessionId': "session-1", 'fcmToken': "some-token", 'intervalMinutes': 1}
+        self.invoke_web_event(path="sessions", method="POST", body=body, expected_status_code=204)
+        self.assertTrue(self.server.messages.pop()['validate_only'])
+
+        self.assertTrue(self.instance.send_push_notification("some-token", "session-1").success)
+        self.assertEqual({'type': 'keepalive', 'sessionId': "session-1"}, self.server.messages.pop()['message']['data'])
+
+        # The session is dropped once FCM says the device is gone
+        self.server.unregistered_tokens.add("some-token")
+        self.assertFalse(self.instance.send_push_notification("some-token", "session-1").success)
+        self.assertIsNone(self.instance.find_session("session-1"))
@@ -0,0 +1,104 @@
+import time
+
+from firebase_admin import exceptions
+from firebase_admin.messaging import UnregisteredError, QuotaExceededError
+
+from base_test import BaseTest
+from bean import BeanName
+from bean.beans import get_bean_instance
+from mocks.gcp import firebase_admin
+from mocks.gcp.firebase_admin import messaging
+from push_notifier import PushMessage, PushErrorCode
+from push_notifier.gcp_notifier import GcpPushNotifier, classify_error
+
+
+class GcpPushNotifierTest(BaseTest):
+
+    def test_notify_many(self):
+        notifier: GcpPushNotifier = get_bean_instance(BeanName.PUSH_NOTIFIER)
+        messages = list(map(lambda i: PushMessage(f"session-{i}", f"token-{i}", {'index': str(i)}), range(2300)))
+        messaging.add_invalid_token("token-3")
+        messaging.add_invalid_token("token-2299")
+
+        results = notifier.notify_many(messages)
+        # The batches are sent concurrently, so in any order
+        self.assertEqual([300, 500, 500, 500, 500], sorted(messaging.batch_sizes))
+        self.assertEqual(list(map(lambda m: m.session_id, messages)), list(map(lambda r: r.session_id, results)))
+        failed = [r for r in results if not r.success]
+        self.assertEqual(["session-3", "session-2299"], list(map(lambda r: r.session_id, failed)))
+        self.assertEqual([PushErrorCode.UNKNOWN] * 2, list(map(lambda r: r.error_code, failed)))
+        self.assertIsNone(results[0].error_code)
+        self.assertEqual(2298, len(messaging.captured))
+
+    def test_call_errors(self):
+        notifier: GcpPushNotifier = get_bean_instance(BeanName.PUSH_NOTIFIER)
+        messages = list(map(lambda i: PushMessage(f"session-{i}", f"token-{i}", {'type': 'keepalive'}), range(3)))
+        # A rejected call is not the fault of the tokens in it
+        messaging.call_errors.append(exceptions.InvalidArgumentError("Request contains an invalid argument."))
+        results = notifier.notify_many(messages)
+        self.assertEqual([PushErrorCode.UNKNOWN] * 3, list(map(lambda r: r.error_code, results)))
+
+        # Transient ones are retried
+        messaging.call_errors.append(exceptions.UnavailableError("Service unavailable."))
+        results = notifier.notify_many(messages)
+        self.assertTrue(all(map(lambda r: r.success, results)))
+        self.assertEqual(3, len(messaging.captured))
+
+    def test_classify_error(self):
+        self.assertEqual(PushErrorCode.UNREGISTERED, classify_error(UnregisteredError("gone")))
+        self.assertEqual(PushErrorCode.QUOTA_EXCEEDED, classify_error(QuotaExceededError("slow down")))
+        self.assertEqual(PushErrorCode.INVALID_ARGUMENT,
+                         classify_error(exceptions.InvalidArgumentError("bad token")))
+        self.assertEqual(PushErrorCode.UNAVAILABLE, classify_error(exceptions.UnavailableError("down")))
+        self.assertEqual(PushErrorCode.UNKNOWN, classify_error(ValueError("what")))
+
+    def test_retries(self):
+        notifier: GcpPushNotifier = get_bean_instance(BeanName.PUSH_NOTIFIER)
+        messaging.add_transient_errors(2)
+        notifier.notify("some-token", {'type': 'keepalive'})
+        self.assertEqual("some-token", messaging.pop_invocation().token)
+        self.assertEqual({'UnavailableError': 2}, notifier.retry_metrics.to_dict()['retriesByError'])
+
+        # We wait at least as long as we are told to
+        messaging.add_transient_errors(1, quota_exceeded=True, retry_after=1)
+        started = time.monotonic()
+        notifier.notify("some-token", {'type': 'keepalive'})
+        self.assertGreaterEqual(time.monotonic() - started, 1.0)
+        messaging.pop_invocation()
+
+        # Only the failed messages are sent again
+        messages = list(map(lambda i: PushMessage(f"session-{i}", f"token-{i}", {'type': 'keepalive'}), range(10)))
+        messaging.add_transient_errors(3)
+        results = notifier.notify_many(messages)
+        self.assertTrue(all(map(lambda r: r.success, results)))
+        self.assertEqual([10, 3], messaging.batch_sizes)
+        self.assertEqual(10, len(messaging.captured))
+
+    def test_retries_give_up(self):
+        notifier: GcpPushNotifier = get_bean_instance(BeanName.PUSH_NOTIFIER)
+        messaging.add_transient_errors(10)
+        self.assertRaises(exceptions.UnavailableError, lambda: notifier.notify("some-token", {'type': 'keepalive'}))
+        messaging.transient_errors.clear()
+
+        # Not enough time left in the invocation to honor the Retry-After
+        messaging.add_transient_errors(1, retry_after=30)
+        started = time.monotonic()
+        results = notifier.notify_many([PushMessage("session-1", "some-token", {'type': 'keepalive'})])
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(PushErrorCode.UNAVAILABLE, results[0].error_code)
+        self.assertEqual(2, notifier.retry_metrics.to_dict()['exhausted'])
+
+    def test_warm_up(self):
+        notifier: GcpPushNotifier = get_bean_instance(BeanName.PUSH_NOTIFIER)
+        self.assertIsNone(notifier.app)
+        self.invoke_event({'internalEvent': {'type': 'warmup'}})
+        self.assertIsNotNone(notifier.app)
+        self.assertEqual(1, firebase_admin.token_requests)
+        self.assertEqual("some-private-key", firebase_admin.cert_captured['content']['private_key'])
+
+        # The first push notification finds everything ready
+        notifier.notify("some-token", {'type': 'keepalive'})
+        self.assertEqual("some-token", messaging.pop_invocation().token)
+        self.assertIs(firebase_admin.cert_captured, notifier.app.cert)
+        self.assertEqual(1, firebase_admin.token_requests)
+        self.assertEqual(1, notifier.token_refresher.get_refresh_count())
@@ -1,6 +1,11 @@
 from base_test import BaseTest
+from bean import BeanName
+from bean.beans import get_bean_instance
+from mocks.gcp.firebase_admin import messaging
 from request import GoneException
+from push_notifier import PushErrorCode
 from session_repo import Session
+from utils.retry import RetryPolicy
 
 
 class InstanceTest(BaseTest):
@@ -19,3 +24,113 @@ class InstanceTest(BaseTest):
         )
 
         self.assertRaises(GoneException, lambda: self.instance.extend_session(session))
+
+    def test_send_push_notifications(self):
+        sessions = list(map(lambda i: Session(f"session-{i}", f"token-{i}", 60), range(1200)))
+        messaging.add_invalid_token("token-700")
+        results = self.instance.send_push_notifications(sessions)
+        # One call per 500 devices
+        self.assertEqual([500, 500, 200], messaging.batch_sizes)
+        self.assertEqual(list(map(lambda s: s.session_id, sessions)), list(map(lambda r: r.session_id, results)))
+        self.assertEqual(["session-700"], [r.session_id for r in results if not r.success])
+        self.assertIsNotNone(results[700].error)
+        self.assertEqual(1199, len(messaging.captured))
+        self.assertEqual({'type': 'keepalive', 'sessionId': 'session-0'}, messaging.pop_invocation().data)
+        self.assertEqual("Failed to send 1 of 1200 push notification(s)", self.pop_notification().subject)
+
+    def test_coalescing(self):
+        sessions = [Session("session-1", "token-1", 60),
+                    Session("session-2", "token-2", 60),
+                    Session("session-3", "token-1", 60),
+                    Session("session-4", "gone-token", 60),
+                    Session("session-5", "gone-token", 60)]
+        messaging.add_unregistered_token("gone-token")
+        results = self.instance.send_push_notifications(sessions)
+        # One push per device
+        self.assertEqual([3], messaging.batch_sizes)
+        self.assertEqual({'token-1': {'type': 'keepalive', 'sessionId': 'session-1',
+                                      'sessionIds': 'session-1,session-3'},
+                          'token-2': {'type': 'keepalive', 'sessionId': 'session-2'}},
+                         dict(map(lambda i: (i.token, i.data), messaging.captured)))
+        self.assertEqual(list(map(lambda s: s.session_id, sessions)), list(map(lambda r: r.session_id, results)))
+        self.assertEqual([None, None, None, PushErrorCode.UNREGISTERED, PushErrorCode.UNREGISTERED],
+                         list(map(lambda r: r.error_code, results)))
+        # The device is gone, which is not worth a notification, and its token is remembered
+        self.assert_no_notifications()
+        self.assertIsNotNone(self.instance.test_push_notification("gone-token"))
+        self.assertEqual(2, len(messaging.captured))
+
+    def test_coalescing_limit(self):
+        session_ids = list(map(lambda i: f"{i:064d}", range(200)))
+        sessions = list(map(lambda session_id: Session(session_id, "token-1", 60), session_ids))
+        results = self.instance.send_push_notifications(sessions)
+        self.assertTrue(all(map(lambda r: r.success, results)))
+        records = list(map(lambda i: i.data, messaging.captured))
+        self.assertEqual(4, len(records))
+        for record in records:
+            self.assertLessEqual(sum(map(lambda item: len(item[0]) + len(item[1]), record.items())), 4096)
+            self.assertEqual(record['sessionId'], record['sessionIds'].split(",")[0])
+        # Every session goes out exactly once
+        self.assertEqual(session_ids, ",".join(map(lambda r: r['sessionIds'], records)).split(","))
+
+    def test_token_cache(self):
+        self.assertIsNone(self.instance.test_push_notification("good-token"))
+        self.assertTrue(messaging.pop_invocation().dry_run)
+        self.assertIsNone(self.instance.test_push_notification("good-token"))
+
+        messaging.add_unregistered_token("bad-token")
+        message = self.instance.test_push_notification("bad-token")
+        self.assertIn("Requested entity was not found", message)
+        send_count = messaging.send_count
+        self.assertEqual(message, self.instance.test_push_notification("bad-token"))
+        self.assertEqual(send_count, messaging.send_count)
+        self.assert_no_push_notifications()
+
+        # Errors that do not say the token is bad are not remembered
+        messaging.add_invalid_token("other-token")
+        self.assertIn("Invalid token", self.instance.test_push_notification("other-token"))
+        send_count = messaging.send_count
+        self.assertIn("Invalid token", self.instance.test_push_notification("other-token"))
+        self.assertEqual(send_count + 1, messaging.send_count)
+
+    def test_fcm_outage(self):
+        get_bean_instance(BeanName.PUSH_NOTIFIER).retry_policy = RetryPolicy(max_attempts=1)
+        messaging.add_transient_errors(100)
+        for _ in range(5):
+            self.assertFalse(self.instance.send_push_notification("some-token", "session-id").success)
+        # One notification for the outage, not one per failure
+        self.assertEqual("Push notifications suspended", self.pop_notification().subject)
+        self.assert_no_notifications()
+
+        # We no longer call FCM
+        self.assertFalse(self.instance.send_push_notification("some-token", "session-id").success)
+        results = self.instance.send_push_notifications([Session("session-id", "some-token", 60)])
+        self.assertEqual(PushErrorCode.UNAVAILABLE, results[0].error_code)
+        self.assertEqual(95, len(messaging.transient_errors))
+        self.assert_no_notifications()
+
+    def test_push_call_fails(self):
+        notifier = get_bean_instance(BeanName.PUSH_NOTIFIER)
+
+        def fail(messages, dry_run=False):
+            raise ValueError("No credentials")
+
+        # Failures outside of the sends still count, so a probe can never be left without an outcome
+        notifier.notify_many = fail
+        sessions = [Session("session-id", "some-token", 60), Session("other-id", "other-token", 60)]
+        for _ in range(5):
+            with self.assertRaises(ValueError):
+                self.instance.send_push_notifications(sessions)
+        self.assertTrue(self.instance.is_push_suspended())
+        self.assertEqual("Push notifications suspended", self.pop_notification().subject)
+
+    def test_retry_metrics(self):
+        self.assertEqual({}, self.instance.log_retry_metrics())
+        messaging.add_transient_errors(2)
+        self.assertTrue(self.instance.send_push_notification("some-token", "session-id").success)
+        logged = self.instance.log_retry_metrics()
+        self.assertEqual({'pushNotifier': {'calls': 1, 'retries': 2, 'exhausted': 0,
+                                           'retriesByError': {'UnavailableError': 2}}}, logged)
+        # Only what happened since the last time
+        self.assertTrue(self.instance.send_push_notification("some-token", "session-id").success)
+        self.assertEqual({}, self.instance.log_retry_metrics())
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
+import bean.beans
+from base_test import BaseTest, FUNCTION_ARN
+from bean import BeanName
+from mocks.gcp.firebase_admin import messaging
+from scheduler.local_scheduler import LocalScheduler
+from session_repo import Session
+from utils.date_utils import get_system_time_in_seconds
+
+
+class LocalSchedulerTest(BaseTest):
+
+    def setUp(self) -> None:
+        os.environ['SS_KEEPALIVE_SCHEDULING_MODE'] = 'local'
+        super().setUp()
+        self.scheduler: LocalScheduler = bean.beans.get_bean_instance(BeanName.SCHEDULER)
+
+    def tearDown(self) -> None:
+        self.scheduler.close()
+        os.environ.pop('SS_KEEPALIVE_SCHEDULING_MODE')
+        super().tearDown()
+
+    def test_heap(self):
+        events: List[Dict[str, Any]] = []
+        fired = threading.Event()
+
+        def dispatch(event: Dict[str, Any], context: Any):
+            self.assertEqual(FUNCTION_ARN, context.invoked_function_arn)
+            events.append(event['internalEvent'])
+            if len(events) == 3:
+                fired.set()
+
+        scheduler = LocalScheduler(dispatch, 1)
+        try:
+            expire_time = get_system_time_in_seconds() + 100
+            self.assertTrue(scheduler.create_schedule(FUNCTION_ARN, Session("slow", "token-1", 60, expire_time)))
+            self.assertTrue(scheduler.create_schedule(FUNCTION_ARN, Session("fast", "token-2", 1, expire_time)))
+            self.assertFalse(scheduler.create_schedule(FUNCTION_ARN, Session("fast", "token-2", 1, expire_time)))
+            self.assertTrue(fired.wait(5))
+        finally:
+            scheduler.close()
+        self.assertEqual(["fast"] * 3, list(map(lambda e: e['sessionId'], events[0:3])))
+        self.assertEqual({'type': 'keepalive', 'sessionId': 'fast', 'fcmDeviceToken': 'token-2',
+                          'expireTime': expire_time, 'stateCounter': 0, 'intervalSeconds': 1}, events[0])
+        self.assertEqual(2, scheduler.get_schedule_count())
+
+    def test_loop(self):
+        self.create_session("session-1")
+        self.create_session("session-2")
+        self.pop_push_notification()
+        self.assertEqual(2, self.scheduler.get_schedule_count())
+
+        # Let each session fire a couple of times, through app.handler
+        deadline = time.time() + 5
+        while len(messaging.captured) < 4 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertGreaterEqual(len(messaging.captured), 4)
+
+        self.invoke_web_event(path="sessions/session-1", method="DELETE", expected_status_code=204)
+        self.assertFalse(self.scheduler.has_schedule("session-1"))
+
+        # Close to its expire time the keepalive reads the session, finds it gone and deletes the schedule
+        gone = Session("gone", "some-token", 1, get_system_time_in_seconds() + 30)
+        self.assertTrue(self.scheduler.create_schedule(FUNCTION_ARN, gone))
+        deadline = time.time() + 5
+        while self.scheduler.has_schedule("gone") and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(["session-2"], list(self.scheduler.list_session_ids(time.time() + 1, 10))[0].items)
+
+    def create_session(self, session_id: str):
+        body = {'sessionId': session_id, 'fcmToken': "some-token", 'intervalSeconds': 1}
+        self.invoke_web_event(path="sessions", method="POST", body=body, expected_status_code=204)
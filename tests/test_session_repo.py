@@ -0,0 +1,128 @@
+from aws.dynamodb import DynamoDb
+from better_test_case import BetterTestCase
+from botomocks.dynamodb_mock import MockDynamoDbClient, KeyPart, KeyDefinition
+from session_repo import Session, LEGACY_FORMAT, COMPACT_FORMAT, PACKED_FORMAT
+from session_repo.aws_session_repo import AwsSessionRepo
+from utils.date_utils import get_system_time_in_seconds, get_system_time_in_millis
+
+_TABLE_NAME = "SSKeepaliveSession"
+
+
+def _new_session(session_id: str = "session-id") -> Session:
+    return Session(session_id, "some-token", 120)
+
+
+class SessionRepoTest(BetterTestCase):
+
+    def setUp(self) -> None:
+        self.client = MockDynamoDbClient()
+        self.client.add_manual_table(_TABLE_NAME, KeyDefinition([KeyPart('sessionId', "S")]))
+        self.ddb = DynamoDb(self.client)
+
+    def test_record_formats(self):
+        session = Session("session-id", "some-token", 300, get_system_time_in_seconds() + 100,
+                          get_system_time_in_millis(), 12)
+        for storage_format in (LEGACY_FORMAT, COMPACT_FORMAT, PACKED_FORMAT):
+            record = session.to_record(storage_format)
+            self.assertEqual(session, Session.from_record(record))
+            self.assertEqual(storage_format, Session.from_record(record).storage_format)
+
+        compact = session.to_record(COMPACT_FORMAT)
+        self.assertEqual({'sessionId', 'v', 't', 'expireTime', 'i', 'm', 'c'}, set(compact.keys()))
+        packed = session.to_record(PACKED_FORMAT)
+        self.assertEqual({'sessionId', 'v', 't', 'expireTime', 'p'}, set(packed.keys()))
+
+        session.schedule_end_time = session.expire_time + 100
+        for storage_format in (LEGACY_FORMAT, COMPACT_FORMAT, PACKED_FORMAT):
+            self.assertEqual(session.schedule_end_time,
+                             Session.from_record(session.to_record(storage_format)).schedule_end_time)
+
+    def test_compact(self):
+        self._execute_test(COMPACT_FORMAT)
+
+    def test_packed(self):
+        self._execute_test(PACKED_FORMAT)
+
+    def test_legacy_migration(self):
+        legacy = Session("legacy-id", "some-token", 60, get_system_time_in_seconds() + 100,
+                         get_system_time_in_millis(), 3)
+        self.ddb.put_item(_TABLE_NAME, legacy.to_record(LEGACY_FORMAT))
+
+        repo = AwsSessionRepo(self.client)
+        session = repo.find_session("legacy-id")
+        self.assertEqual(LEGACY_FORMAT, session.storage_format)
+        self.assertEqual(legacy, session)
+
+        self.assertTrue(repo.extend_session(session, 1000))
+        # A stale session should fail now that it has been migrated
+        self.assertFalse(repo.extend_session(session, 1000))
+
+        item = self.ddb.find_item(_TABLE_NAME, {'sessionId': 'legacy-id'}, consistent=True)
+        self.assertNotIn('fcmDeviceToken', item)
+        self.assertNotIn('stateCounter', item)
+
+        migrated = repo.find_session("legacy-id")
+        self.assertEqual(COMPACT_FORMAT, migrated.storage_format)
+        self.assertEqual(4, migrated.state_counter)
+        self.assertEqual("some-token", migrated.fcm_device_token)
+
+    def _execute_test(self, storage_format: int):
+        repo = AwsSessionRepo(self.client, storage_format)
+        session = _new_session()
+        self.assertTrue(repo.create_session(session, 100))
+        self.assertFalse(repo.create_session(_new_session(), 100))
+
+        found = repo.find_session(session.session_id)
+        self.assertEqual(storage_format, found.storage_format)
+        self.assertEqual(session, found)
+
+        self.assertTrue(repo.extend_session(found, 200))
+        self.assertFalse(repo.extend_session(found, 200))
+        extended = repo.find_session(session.session_id)
+        self.assertEqual(found.state_counter + 1, extended.state_counter)
+        self.assertGreater(extended.expire_time, found.expire_time)
+
+        self.assertTrue(repo.delete_session(session.session_id))
+        self.assertFalse(repo.extend_session(extended, 200))
+        self.assertIsNone(repo.find_session(session.session_id))
+
+    def test_unit_of_work(self):
+        repo = AwsSessionRepo(self.client)
+        with repo.begin_unit_of_work() as work:
+            self.assertTrue(repo.create_session(_new_session(), 100))
+            self.assertEqual("some-token", repo.find_session("session-id").fcm_device_token)
+            # Nothing is written until we commit
+            self.assertIsNone(self.ddb.find_item(_TABLE_NAME, {'sessionId': 'session-id'}, consistent=True))
+        self.assertIsNone(repo.find_session("session-id"))
+
+        with repo.begin_unit_of_work() as work:
+            repo.create_session(_new_session(), 100)
+            repo.create_session(_new_session("other-id"), 100)
+            self.assertTrue(work.commit())
+            self.assertFalse(work.is_active())
+        self.assertIsNotNone(repo.find_session("session-id"))
+
+        with repo.begin_unit_of_work() as work:
+            repo.create_session(_new_session(), 100)
+            self.assertFalse(work.commit())
+
+        with repo.begin_unit_of_work() as work:
+            self.assertTrue(repo.delete_session("session-id"))
+            self.assertIsNone(repo.find_session("session-id"))
+            self.assertFalse(repo.delete_session("session-id"))
+            self.assertTrue(work.commit())
+        self.assertIsNone(repo.find_session("session-id"))
+        self.assertIsNotNone(repo.find_session("other-id"))
+
+    def test_scan(self):
+        repo = AwsSessionRepo(self.client)
+        for index in range(5):
+            repo.create_session(_new_session(f"session-{index}"), 100)
+        pages = list(repo.scan_sessions(2))
+        self.assertEqual([2, 2, 1], list(map(lambda page: len(page.items), pages)))
+        self.assertIsNone(pages[-1].cursor)
+
+        # Resuming after the first page lists the rest
+        resumed = list(repo.scan_sessions(2, pages[0].cursor))
+        self.assertEqual([session.session_id for page in pages[1:] for session in page.items],
+                         [session.session_id for page in resumed for session in page.items])
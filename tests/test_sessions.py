@@ -1,17 +1,18 @@
 import json
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
 
 import bean.beans
 from aws.dynamodb import DynamoDb
-from base_test import BaseTest, NOTIFICATION_GROUP, FUNCTION_ARN, SCHEDULE_ROLE_ARN
+from base_test import BaseTest, NOTIFICATION_GROUP, FUNCTION_ARN, SCHEDULE_ROLE_ARN, Context
 from bean import BeanName
 from botomocks.scheduler_mock import Schedule
 from mocks.gcp.firebase_admin import messaging
 from session_repo import Session
 from utils import date_utils
 from utils.date_utils import get_system_time_in_seconds
+from utils.retry import RetryPolicy
 
 _DEFAULT_TOKEN = "ThisIsAnFcmToken"
 _DEFAULT_SESSION_ID = "this-is-a-session-id"
@@ -39,6 +40,8 @@ class SessionsTest(BaseTest):
         # Make sure it created a schedule
         schedule = self.get_schedule()
         self._validate_schedule(schedule)
+        self.assertEqual(sess.expire_time, sess.schedule_end_time)
+        self.assertEqual(datetime.utcfromtimestamp(sess.schedule_end_time), schedule.end_date)
 
         # Already exists
         self.create_session(
@@ -56,6 +59,12 @@ class SessionsTest(BaseTest):
         # Make sure the session is not lingering
         self.assertIsNone(self.instance.find_session('new-one'))
 
+    def test_create_with_scheduler_throttling(self):
+        self.scheduler_mock.add_throttles(3)
+        self.create_session()
+        self._validate_schedule(self.get_schedule())
+        self.assertEqual(3, self.scheduler_mock.throttle_count)
+
     def test_create_with_bad_args(self):
         self.create_session(
             interval_minutes=0,
@@ -141,6 +150,24 @@ class SessionsTest(BaseTest):
         self.assertNotEquals(sess, after_sess)
         self.assertEqual(sess.state_counter + 1, after_sess.state_counter)
         self.assertGreater(after_sess.expire_time, sess.expire_time)
+        # The last fire of the schedule is hours away, it moves the end, so it was left alone
+        self.assertEqual(0, self.scheduler_mock.update_count)
+        self.assertEqual(sess.schedule_end_time, after_sess.schedule_end_time)
+
+        # Now make the last fire one that may have passed
+        start_date = self.get_schedule().start_date
+        ddb: DynamoDb = bean.beans.get_bean_instance(BeanName.DYNAMODB)
+        ddb.update_item("SSKeepaliveSession",
+                        keys={"sessionId": _DEFAULT_SESSION_ID},
+                        item={'e': get_system_time_in_seconds() + 90})
+        self.send_keepalive()
+        self.assertEqual(1, self.scheduler_mock.update_count)
+        extended = self.get_session()
+        self.assertEqual(extended.expire_time, extended.schedule_end_time)
+        schedule = self.get_schedule()
+        self._validate_schedule(schedule)
+        self.assertEqual(datetime.utcfromtimestamp(extended.schedule_end_time), schedule.end_date)
+        self.assertEqual(start_date, schedule.start_date)
 
     def test_lambda_invocation(self):
         self.create_session()
@@ -157,16 +184,19 @@ class SessionsTest(BaseTest):
 
         self.assert_no_notifications()
 
-        # Test failure
+        # Test failure, the push is not tried a second time after reading the session
         self.add_invalid_push_token(_DEFAULT_TOKEN)
+        send_count = messaging.send_count
         self.invoke_lambda(s)
+        self.assertEqual(send_count + 1, messaging.send_count)
         self.assert_no_push_notifications()
+        self.assertIsNotNone(self.find_schedule())
 
         nn = self.pop_notification()
         self.assertIn("ValueError: Invalid token: ThisIsAnFcmToken", nn.message)
         self.assertEqual('Failed to send push notification', nn.subject)
 
-        # Now, test with it being expired
+        # Now, test with it being expired, the payload has to be near expiry for us to look at the session
         stamp = get_system_time_in_seconds() - 14410
         ddb: DynamoDb = bean.beans.get_bean_instance(BeanName.DYNAMODB)
         ddb.update_item("SSKeepaliveSession",
@@ -175,8 +205,163 @@ class SessionsTest(BaseTest):
                             'expireTime': stamp
                         })
 
+        # The schedule ended with the session, so a late fire leaves it to go on its own
+        self.invoke_lambda(s, expire_time=stamp)
+        self.assert_no_push_notifications()
+        self.assertIsNotNone(self.find_schedule(_DEFAULT_SESSION_ID))
+
+    def test_lambda_invocation_without_reads(self):
+        self.create_session()
+        messaging.pop_invocation()
+        s = self.get_schedule()
+
+        # Remove the session behind our back, the push still goes out since it does not read the session
+        self.ddb_mock.delete_item(TableName="SSKeepaliveSession", Key={'sessionId': {'S': _DEFAULT_SESSION_ID}})
         self.invoke_lambda(s)
-        self.assertIsNone(self.find_schedule(_DEFAULT_SESSION_ID))
+        self.assertEqual(_DEFAULT_TOKEN, messaging.pop_invocation().token)
+
+        # Near expiry it reads the session and finds it gone
+        self.invoke_lambda(s, expire_time=get_system_time_in_seconds() + 30)
+        self.assert_no_push_notifications()
+        self.assertIsNone(self.find_schedule())
+
+    def test_lambda_invocation_suspended(self):
+        self.create_session()
+        messaging.pop_invocation()
+        s = self.get_schedule()
+        bean.beans.get_bean_instance(BeanName.PUSH_NOTIFIER).retry_policy = RetryPolicy(max_attempts=1)
+        messaging.add_transient_errors(100)
+        for _ in range(5):
+            self.invoke_lambda(s)
+        self.assertTrue(self.instance.is_push_suspended())
+        self.pop_notification()
+
+        # With pushes suspended a failed push does not read the session, which would have found it gone
+        self.ddb_mock.delete_item(TableName="SSKeepaliveSession", Key={'sessionId': {'S': _DEFAULT_SESSION_ID}})
+        send_count = messaging.send_count
+        self.invoke_lambda(s)
+        self.assertEqual(send_count, messaging.send_count)
+        self.assertIsNotNone(self.find_schedule())
+
+    def test_lambda_invocation_refresh(self):
+        self.create_session()
+        messaging.pop_invocation()
+        self.send_keepalive()
+        s = self.get_schedule()
+        self.assertEqual(0, json.loads(s.target.input)['internalEvent']['stateCounter'])
+
+        # Not the last fire before the schedule ends, so the session is not read
+        self.invoke_lambda(s, expire_time=get_system_time_in_seconds() + 180)
+        self.assertEqual(_DEFAULT_TOKEN, messaging.pop_invocation().token)
+        self.assertEqual(0, self.scheduler_mock.update_count)
+
+        # The session was extended, so on the last fire before the old expire time the schedule is refreshed
+        self.invoke_lambda(s, expire_time=get_system_time_in_seconds() + 90)
+        self.assertEqual(_DEFAULT_TOKEN, messaging.pop_invocation().token)
+        s = self.get_schedule()
+        self._validate_schedule(s)
+        self.assertEqual(1, self.scheduler_mock.update_count)
+        self.assertEqual(datetime.utcfromtimestamp(self.get_session().expire_time), s.end_date)
+
+    def test_purge_expired(self):
+        self.create_session()
+        self.create_session(session_id="expired-session")
+        self.create_session(session_id="no-schedule")
+        self.scheduler_mock.delete_schedule(GroupName=NOTIFICATION_GROUP, Name="ss-keepalive-no-schedule")
+
+        # Nothing to purge yet
+        self.assertIsNone(self.invoke_event({'internalEvent': {'type': 'purgeExpiredSessions'}}))
+        self.assertIsNotNone(self.find_session("expired-session"))
+
+        stamp = get_system_time_in_seconds() - 3600
+        ddb: DynamoDb = bean.beans.get_bean_instance(BeanName.DYNAMODB)
+        for session_id in ("expired-session", "no-schedule"):
+            ddb.update_item("SSKeepaliveSession",
+                            keys={"sessionId": session_id},
+                            item={'expireTime': stamp})
+
+        self.invoke_event({'internalEvent': {'type': 'purgeExpiredSessions'}})
+        self.assertIsNone(self.find_session("expired-session"))
+        self.assertIsNone(self.find_schedule("expired-session"))
+        self.assertIsNone(self.find_session("no-schedule"))
+
+        self.get_session()
+        self.get_schedule()
+
+    def test_purge_expired_resume(self):
+        stamp = get_system_time_in_seconds() - 3600
+        ddb: DynamoDb = bean.beans.get_bean_instance(BeanName.DYNAMODB)
+        for index in range(5):
+            self.create_session(session_id=f"expired-{index}")
+            ddb.update_item("SSKeepaliveSession", keys={"sessionId": f"expired-{index}"}, item={'expireTime': stamp})
+        self.create_session()
+
+        # Out of time after the first page
+        context = Context()
+        context.remaining_millis = 10000
+        result = self.invoke_event({'internalEvent': {'type': 'purgeExpiredSessions', 'pageSize': 2}}, context)
+        self.assertIsNotNone(result['cursor'])
+        remaining = len(list(filter(lambda i: self.find_session(f"expired-{i}") is not None, range(5))))
+        self.assertTrue(3 <= remaining <= 4)
+
+        self.assertIsNone(self.invoke_event({'internalEvent': {'type': 'purgeExpiredSessions',
+                                                               'pageSize': 2,
+                                                               'cursor': result['cursor']}}))
+        for index in range(5):
+            self.assertIsNone(self.find_session(f"expired-{index}"))
+            self.assertIsNone(self.find_schedule(f"expired-{index}"))
+        self.get_session()
+
+    def test_unregistered_token(self):
+        self.create_session()
+        messaging.pop_invocation()
+        s = self.get_schedule()
+
+        self.add_unregistered_push_token(_DEFAULT_TOKEN)
+        self.invoke_lambda(s)
+        self.assert_no_push_notifications()
+        # An unregistered token is expected, nobody needs to hear about it
+        self.assert_no_notifications()
+        self.assertIsNone(self.instance.find_session(_DEFAULT_SESSION_ID))
+        self.assertIsNone(self.find_schedule())
+        # Dropping the session deleted the schedule, the handler does not try again
+        self.assertEqual(1, self.scheduler_mock.delete_count)
+
+        # The token is known to be bad, so we do not ask FCM again
+        self.create_session(expected_status_code=400,
+                            expected_error_message="Invalid fcmToken: Requested entity was not found: "
+                                                   f"{_DEFAULT_TOKEN}.")
+        self.assert_no_push_notifications()
+
+    def test_reconcile(self):
+        for session_id in ("session-1", "session-2", "session-3", "session-4", "orphan"):
+            self.create_session(session_id=session_id)
+        self.ddb_mock.delete_item(TableName="SSKeepaliveSession", Key={'sessionId': {'S': "orphan"}})
+        self.scheduler_mock.delete_schedule(GroupName=NOTIFICATION_GROUP, Name="ss-keepalive-session-2")
+
+        # The orphan is too young to be touched yet
+        self.invoke_event({'internalEvent': {'type': 'reconcileSchedules', 'pageSize': 2}})
+        self.assertIsNotNone(self.find_schedule("orphan"))
+        self.assertIsNotNone(self.find_schedule("session-2"))
+
+        self.scheduler_mock.delete_schedule(GroupName=NOTIFICATION_GROUP, Name="ss-keepalive-session-3")
+        for schedule in self.scheduler_mock.schedules.values():
+            schedule.creation_date -= timedelta(minutes=10)
+
+        # Out of time before the first page, so we get a cursor to resume from and nothing is touched
+        context = Context()
+        context.remaining_millis = 10000
+        result = self.invoke_event({'internalEvent': {'type': 'reconcileSchedules', 'pageSize': 2}}, context)
+        cursor = result['cursor']
+        self.assertEqual({'0': None}, cursor['shards'])
+        self.assertIsNone(cursor['sessions'])
+        self.assertIsNotNone(self.find_schedule("orphan"))
+
+        result = self.invoke_event({'internalEvent': {'type': 'reconcileSchedules', 'pageSize': 2, 'cursor': cursor}})
+        self.assertIsNone(result)
+        self.assertIsNone(self.find_schedule("orphan"))
+        for session_id in ("session-1", "session-2", "session-3", "session-4"):
+            self._validate_schedule(self.get_schedule(session_id), session_id)
 
     ##############################################################################################
     # Support methods
@@ -241,13 +426,21 @@ class SessionsTest(BaseTest):
         start_dt = schedule.start_date
         self.assertIsNotNone(start_dt)
         self.assertGreater(start_dt, datetime.utcnow())
+        self.assertGreater(schedule.end_date, start_dt)
+        self.assertEqual('DELETE', schedule.action_after_completion)
         self.assertEqual({'Mode': 'OFF'}, schedule.flexible_time_window)
 
         target = schedule.target
         self.assertEqual(FUNCTION_ARN, target.arn)
         self.assertEqual(target.role_arn, SCHEDULE_ROLE_ARN)
         record = json.loads(target.input)
-        self.assertEqual({'internalEvent': {'type': 'keepalive', 'sessionId': session_id}}, record)
+        session = self.get_session(session_id)
+        self.assertEqual({'internalEvent': {'type': 'keepalive',
+                                            'sessionId': session_id,
+                                            'fcmDeviceToken': session.fcm_device_token,
+                                            'expireTime': session.expire_time,
+                                            'stateCounter': session.state_counter,
+                                            'intervalSeconds': session.interval_seconds}}, record)
 
     def find_session(self, session_id: str = _DEFAULT_SESSION_ID) -> Optional[Session]:
         return self.instance.find_session(session_id)
@@ -258,5 +451,8 @@ class SessionsTest(BaseTest):
             self.fail(f"Session {session_id} not found")
         return sess
 
-    def invoke_lambda(self, schedule: Schedule):
-        self.invoke_event(json.loads(schedule.target.input))
+    def invoke_lambda(self, schedule: Schedule, expire_time: Optional[int] = None):
+        event = json.loads(schedule.target.input)
+        if expire_time is not None:
+            event['internalEvent']['expireTime'] = expire_time
+        self.invoke_event(event)
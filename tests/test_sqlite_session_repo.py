@@ -0,0 +1,99 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from bean import BeanName, beans
+from bean.beans import get_bean_instance
+from better_test_case import BetterTestCase
+from session_repo import Session
+from session_repo.sqlite_session_repo import SqliteSessionRepo
+
+
+class SqliteSessionRepoTest(BetterTestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "sessions.db")
+        self.repo = SqliteSessionRepo(self.path)
+
+    def tearDown(self) -> None:
+        self.repo.close()
+        self.temp_dir.cleanup()
+
+    def test_crud(self):
+        session = Session("session-id", "some-token", 60)
+        self.assertTrue(self.repo.create_session(session, 100))
+        self.assertFalse(self.repo.create_session(Session("session-id", "other-token", 60), 100))
+
+        found = self.repo.find_session("session-id")
+        self.assertEqual(session, found)
+        self.assertFalse(found.is_expired())
+
+        self.assertTrue(self.repo.extend_session(found, 200))
+        self.assertFalse(self.repo.extend_session(found, 200))
+        extended = self.repo.find_session("session-id")
+        self.assertEqual(1, extended.state_counter)
+        self.assertGreater(extended.expire_time, found.expire_time)
+
+        self.assertTrue(self.repo.delete_session("session-id"))
+        self.assertFalse(self.repo.delete_session("session-id"))
+        self.assertIsNone(self.repo.find_session("session-id"))
+        self.assertFalse(self.repo.extend_session(extended, 200))
+
+    def test_unit_of_work(self):
+        with self.repo.begin_unit_of_work() as work:
+            self.assertTrue(self.repo.create_session(Session("session-id", "some-token", 60), 100))
+            self.assertIsNotNone(self.repo.find_session("session-id"))
+            self.assertTrue(self.repo.delete_session("session-id"))
+            self.assertTrue(self.repo.create_session(Session("other-id", "some-token", 60), 100))
+            self.assertTrue(work.commit())
+        self.assertIsNone(self.repo.find_session("session-id"))
+        found = self.repo.find_session("other-id")
+        self.assertIsNotNone(found)
+
+        with self.repo.begin_unit_of_work():
+            self.assertTrue(self.repo.extend_session(found, 200))
+        self.assertEqual(0, self.repo.find_session("other-id").state_counter)
+
+        self.repo.extend_session(found, 200)
+        with self.repo.begin_unit_of_work() as work:
+            self.assertTrue(self.repo.create_session(Session("third-id", "some-token", 60), 100))
+            self.assertTrue(self.repo.extend_session(found, 200))
+            self.assertFalse(work.commit())
+        # The whole unit of work was rolled back
+        self.assertIsNone(self.repo.find_session("third-id"))
+
+    def test_concurrent(self):
+        def create(index: int) -> bool:
+            return self.repo.create_session(Session(f"session-{index}", "some-token", 60), 100)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(create, range(200)))
+        self.assertTrue(all(results))
+        self.assertIsNotNone(self.repo.find_session("session-199"))
+
+    def test_scan(self):
+        for index in range(5):
+            self.repo.create_session(Session(f"session-{index}", "some-token", 60), 100)
+        pages = list(self.repo.scan_sessions(2))
+        self.assertEqual([2, 2, 1], list(map(lambda page: len(page.items), pages)))
+        self.assertEqual(list(map(lambda i: f"session-{i}", range(5))),
+                         [session.session_id for page in pages for session in page.items])
+        self.assertEqual(["session-1", "session-3", None], list(map(lambda page: page.cursor, pages)))
+
+        # Resuming after a page
+        pages = list(self.repo.scan_sessions(2, "session-1"))
+        self.assertEqual(["session-2", "session-3", "session-4"],
+                         [session.session_id for page in pages for session in page.items])
+
+    def test_bean_selection(self):
+        os.environ['SS_KEEPALIVE_SESSION_REPO'] = 'sqlite'
+        os.environ['SS_KEEPALIVE_SQLITE_PATH'] = os.path.join(self.temp_dir.name, "bean.db")
+        try:
+            repo = get_bean_instance(BeanName.SESSION_REPO)
+            self.assertTrue(isinstance(repo, SqliteSessionRepo))
+            repo.close()
+        finally:
+            os.environ.pop('SS_KEEPALIVE_SESSION_REPO')
+            os.environ.pop('SS_KEEPALIVE_SQLITE_PATH')
+            beans.reset()
@@ -0,0 +1,25 @@
+from better_test_case import BetterTestCase
+from utils.timer_wheel import TimerWheel
+
+
+class TimerWheelTest(BetterTestCase):
+
+    def test_wheel(self):
+        wheel: TimerWheel[str] = TimerWheel(100, slot_count=4)
+        wheel.schedule(101, "a")
+        wheel.schedule(105, "b")
+        wheel.schedule(101, "c")
+        wheel.schedule(100, "d")
+        self.assertEqual(4, len(wheel))
+
+        self.assertEqual(["d"], wheel.advance())
+        self.assertEqual(["a", "c"], wheel.advance())
+        # b shares a slot with a and c, but is one revolution out
+        self.assertEqual(1, len(wheel))
+        for _ in range(3):
+            self.assertEqual([], wheel.advance())
+        self.assertEqual(105, wheel.get_current_tick())
+        self.assertEqual(["b"], wheel.advance())
+        self.assertEqual(0, len(wheel))
+
+        self.assertRaises(ValueError, lambda: wheel.schedule(105, "late"))
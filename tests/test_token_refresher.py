@@ -0,0 +1,65 @@
+import threading
+import time
+
+from better_test_case import BetterTestCase
+from utils.token_refresher import TokenRefresher, AccessToken
+
+
+class TokenRefresherTest(BetterTestCase):
+
+    def test_single_flight(self):
+        release = threading.Event()
+        fetches = []
+
+        def fetch() -> AccessToken:
+            fetches.append(1)
+            release.wait(5)
+            return AccessToken(f"token-{len(fetches)}", time.time() + 3600)
+
+        refresher = TokenRefresher(fetch, 300)
+        tokens = []
+        threads = list(map(lambda i: threading.Thread(target=lambda: tokens.append(refresher.get_token())),
+                           range(5)))
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(["token-1"] * 5, tokens)
+        self.assertEqual(1, len(fetches))
+        self.assertEqual("token-1", refresher.get_token())
+        self.assertEqual(1, refresher.get_refresh_count())
+
+    def test_background_refresh(self):
+        release = threading.Event()
+        lifetimes = [301, 3600]
+
+        def fetch() -> AccessToken:
+            lifetime = lifetimes.pop(0)
+            if len(lifetimes) == 0:
+                release.wait(5)
+            return AccessToken(f"token-{lifetime}", time.time() + lifetime)
+
+        refresher = TokenRefresher(fetch, 300)
+        self.assertEqual("token-301", refresher.get_token())
+
+        # Within the margin, we get the current token while the new one is fetched
+        time.sleep(1.1)
+        self.assertEqual("token-301", refresher.get_token())
+        self.assertEqual("token-301", refresher.get_token())
+        release.set()
+        deadline = time.time() + 5
+        while refresher.get_refresh_count() < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual("token-3600", refresher.get_token())
+        self.assertEqual(2, refresher.get_refresh_count())
+
+    def test_failure(self):
+        def fetch() -> AccessToken:
+            raise ValueError("no token for you")
+
+        refresher = TokenRefresher(fetch, 300)
+        self.assertRaises(ValueError, refresher.get_token)
+        self.assertRaises(ValueError, refresher.get_token)
+        self.assertEqual(0, refresher.get_refresh_count())
@@ -0,0 +1,22 @@
+from better_test_case import BetterTestCase
+from utils.ttl_cache import TtlCache
+
+
+class TtlCacheTest(BetterTestCase):
+
+    def test_cache(self):
+        cache: TtlCache[str, int] = TtlCache(2, 60)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(1, cache.get("a"))
+        # b is the least recently used
+        cache.put("c", 3)
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(3, cache.get("c"))
+
+        cache.put("a", 4, ttl_seconds=0)
+        self.assertEqual("missing", cache.get("a", "missing"))
+        self.assertEqual(1, len(cache))
+        self.assertTrue(cache.remove("c"))
+        self.assertFalse(cache.remove("c"))
@@ -0,0 +1,88 @@
+import json
+import os
+import time
+from datetime import datetime
+
+import bean.beans
+from base_test import BaseTest, NOTIFICATION_GROUP, Context
+from bean import BeanName
+from botomocks import KeyId
+from mocks.gcp.firebase_admin import messaging
+from scheduler.bucket_scheduler import to_bucket_id
+from scheduler.wheel_scheduler import WheelScheduler, calc_offset
+
+_WHEEL_SCHEDULE_NAME = "ss-keepalive-bucket-w5"
+
+
+class WheelSchedulerTest(BaseTest):
+
+    def setUp(self) -> None:
+        os.environ['SS_KEEPALIVE_SCHEDULING_MODE'] = 'wheel'
+        super().setUp()
+
+    def tearDown(self) -> None:
+        os.environ.pop('SS_KEEPALIVE_SCHEDULING_MODE')
+        super().tearDown()
+
+    def test_offsets(self):
+        offsets = set(map(lambda i: calc_offset(f"token-{i}", 15), range(1000)))
+        self.assertEqual(set(range(15)), offsets)
+
+    def test_validation(self):
+        self.create_session("session-1", {'intervalSeconds': 7}, 400, "Unsupported intervalSeconds: 7.")
+        self.create_session("session-1", {'intervalSeconds': 90}, 400, "Unsupported intervalSeconds: 90.")
+        self.create_session("session-1", {'intervalSeconds': 0}, 400,
+                            "Invalid intervalSeconds: 0, must be between 1 and 86400.")
+        self.create_session("session-1", {'intervalSeconds': 15, 'intervalMinutes': 1}, 400,
+                            "Only one of intervalMinutes and intervalSeconds can be given.")
+        self.assertEqual(0, len(self.scheduler_mock.schedules))
+
+        # Whole minutes still go to the regular buckets
+        self.create_session("session-1", {'intervalSeconds': 120})
+        self.pop_push_notification()
+        self.assertEqual(["session-1"],
+                         self.instance.list_bucket_members(to_bucket_id("some-token", 2)))
+
+    def test_wheel(self):
+        self.assertTrue(isinstance(bean.beans.get_bean_instance(BeanName.SCHEDULER), WheelScheduler))
+        for session_id in ("session-1", "session-2"):
+            self.create_session(session_id, {'intervalSeconds': 5})
+        self.pop_push_notification()
+        self.delete_session("session-2")
+
+        self.assertEqual(1, len(self.scheduler_mock.schedules))
+        schedule = self.scheduler_mock.schedules[KeyId(NOTIFICATION_GROUP, _WHEEL_SCHEDULE_NAME)]
+        self.assertEqual("rate(1 minutes)", schedule.schedule_expression)
+        self.assertGreater(schedule.start_date, datetime.utcnow())
+        self.assertEqual(0, schedule.start_date.second)
+        event = json.loads(schedule.target.input)
+        self.assertEqual({'internalEvent': {'type': 'wheelKeepalive', 'bucketId': 'w5'}}, event)
+
+        # Late in a minute the wheel catches up on the last few seconds, so we see at least one push
+        if time.time() % 60 < 6:
+            time.sleep(6 - time.time() % 60)
+        context = Context()
+        context.remaining_millis = 3500
+        started = time.time()
+        self.invoke_event(event, context)
+        self.assertLess(time.time() - started, 3)
+
+        count = 0
+        while len(messaging.captured) > 0:
+            notification = self.pop_push_notification()
+            self.assertEqual({'type': 'keepalive', 'sessionId': 'session-1'}, notification.data)
+            count += 1
+        self.assertIn(count, (1, 2))
+        self.assertEqual(["session-1"], self.instance.list_bucket_members("w5"))
+
+    def create_session(self, session_id: str, params: dict, expected_status_code: int = 204,
+                       expected_error_message: str = None):
+        body = {'sessionId': session_id, 'fcmToken': "some-token"}
+        body.update(params)
+        self.invoke_web_event(path="sessions", method="POST", body=body,
+                              expected_status_code=expected_status_code,
+                              expected_error_message=expected_error_message)
+
+    def delete_session(self, session_id: str):
+        self.invoke_web_event(path=f"sessions/{session_id}", method="DELETE", expected_status_code=204)
+